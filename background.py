@@ -0,0 +1,45 @@
+# background.py
+"""
+Tiny periodic job runner (daemon threads) for in-process maintenance work
+such as stats reconciliation.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob(threading.Thread):
+    def __init__(self, name, interval, fn, run_first=False):
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.fn = fn
+        self.run_first = run_first
+        self._stop_event = threading.Event()
+
+    def run(self):
+        if self.run_first:
+            self._call()
+        while not self._stop_event.wait(self.interval):
+            self._call()
+
+    def _call(self):
+        try:
+            self.fn()
+        except Exception:
+            logger.exception("Periodic job %s failed", self.name)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_periodic(name, interval, fn, run_first=False):
+    """
+    Run fn() every `interval` seconds in a daemon thread (and once right away
+    with run_first). interval <= 0 disables the job.
+    """
+    if not interval or interval <= 0:
+        return None
+    job = PeriodicJob(name, interval, fn, run_first)
+    job.start()
+    return job
@@ -0,0 +1,60 @@
+# bench_db_async.py
+"""
+1k concurrent coroutines doing a bot-style DB round (get-or-create user,
+reserve a call, record a usage) and a read-only round (fetch the user):
+db_utils.run_db on the thread-pool executor vs. db_async on the async engine.
+
+    python bench_db_async.py [coroutines]
+
+Needs aiosqlite. Runs against a throwaway SQLite database in a temp directory.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import db_async
+import db_utils
+from models import init_db
+
+
+def sync_round(i):
+    user = db_utils.sync_get_or_create_user(i)
+    db_utils.sync_decrement_free_call(i)
+    db_utils.sync_create_usage(user.id, 1, f"35{i:013d}", True)
+
+
+async def async_round(i):
+    user = await db_async.get_or_create_user(i)
+    await db_async.decrement_free_call(i)
+    await db_async.create_usage(user.id, 1, f"35{i:013d}", True)
+
+
+async def timed(label, coros):
+    start = time.perf_counter()
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for r in results if isinstance(r, Exception))
+    print(f"{label:28} {elapsed:8.3f} s  {len(results) / elapsed:10,.0f} rounds/s  errors: {errors}")
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db_utils.init_session_factory(init_db(url))
+        await db_async.init_async_engine(url)
+        # users 0..n-1 exist for the second pass of each path
+        await timed("run_db (new users)", (db_utils.run_db(sync_round, i) for i in range(n)))
+        await timed("run_db (existing users)", (db_utils.run_db(sync_round, i) for i in range(n)))
+        await timed("async (new users)", (async_round(i) for i in range(n, 2 * n)))
+        await timed("async (existing users)", (async_round(i) for i in range(n, 2 * n)))
+        await timed("run_db (read user)", (db_utils.run_db(db_utils.sync_get_user_by_tg, i) for i in range(n)))
+        await timed("async (read user)", (db_async.get_user_by_tg(i) for i in range(n)))
+        print(f"run_db executor: {db_utils.stats.snapshot()}")
+        await db_async.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
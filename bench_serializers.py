@@ -0,0 +1,87 @@
+# bench_serializers.py
+"""
+Rows/sec of a usage listing: ORM objects + hand-built dicts + jsonify (the old
+endpoints) vs. column projection + serializers (the current ones).
+
+    python bench_serializers.py [rows] [repeats]
+
+Runs against a throwaway SQLite database in a temp directory.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+import serializers
+from models import APIUsage, init_db
+
+
+def orm_listing(SessionLocal, limit):
+    db = SessionLocal()
+    usages = db.query(APIUsage).order_by(APIUsage.id.desc()).limit(limit).all()
+    result = []
+    for u in usages:
+        result.append({
+            'id': u.id,
+            'user_id': u.user_id,
+            'service_id': u.service_id,
+            'imei': u.imei,
+            'success': bool(u.success),
+            'cost': u.cost,
+            'created_at': u.created_at.isoformat() if u.created_at else None
+        })
+    db.close()
+    return jsonify({'items': result}).get_data()
+
+
+def projected_listing(SessionLocal, limit):
+    db = SessionLocal()
+    rows = (db.query(*serializers.columns(APIUsage))
+            .order_by(APIUsage.id.desc()).limit(limit).all())
+    db.close()
+    return serializers.json_response({'items': serializers.rows_to_dicts(APIUsage, rows)}).get_data()
+
+
+def measure(fn, SessionLocal, rows, repeats):
+    fn(SessionLocal, rows)  # warm-up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(SessionLocal, rows)
+        best = min(best, time.perf_counter() - start)
+    return rows / best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = init_db(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(insert(APIUsage), [
+                {"user_id": i % 100 + 1, "service_id": i % 7 + 1, "imei": f"35{i:013d}",
+                 "success": i % 5 != 0, "cost": 0.0, "created_at": now - timedelta(seconds=i)}
+                for i in range(rows)
+            ])
+
+        app = Flask(__name__)
+        with app.app_context():
+            before = measure(orm_listing, SessionLocal, rows, repeats)
+            after = measure(projected_listing, SessionLocal, rows, repeats)
+        engine.dispose()
+
+    encoder = "orjson" if serializers.orjson is not None else "json"
+    print(f"rows: {rows}, best of {repeats}")
+    print(f"{'ORM + dict + jsonify':36} {before:12,.0f} rows/s")
+    print(f"{f'projection + serializers ({encoder})':36} {after:12,.0f} rows/s  ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
+import asyncio
+import functools
 import logging
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
@@ -12,22 +17,221 @@ logger = logging.getLogger(__name__)
 import os
 from dotenv import load_dotenv
 
+from bot_state import StateStore
+
 load_dotenv()
 
 API_URL = os.getenv("API_URL", "https://serviceapi.shegergsm.com/api")
 BOT_TOKEN = os.getenv("BOT_TOKEN", "6806239673:AAESKUzLKgyOWl0-atsgsA-diSYrkhmRO9I")
+# keep-alive connections to the Flask API, shared by all handlers
+API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "32"))
+API_TIMEOUT = float(os.getenv("BOT_API_TIMEOUT", "5"))
+LOOKUP_TIMEOUT = float(os.getenv("BOT_LOOKUP_TIMEOUT", "10"))
+# updates handled in parallel (one slow lookup must not block other users)
+CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+# "api": every action goes over HTTP to the Flask API (API_URL).
+# "direct": the bot runs next to the database and calls the lookup service /
+# db_utils in-process (DATABASE_URL), without the HTTP hop.
+BOT_MODE = os.getenv("BOT_MODE", "api").lower()
+# direct mode: threads for lookups, which block on the provider; kept apart from
+# the db_utils executor, which is sized to the DB pool and only runs DB work
+LOOKUP_WORKERS = int(os.getenv("BOT_LOOKUP_WORKERS", str(CONCURRENT_UPDATES)))
+# local service catalog snapshot, refreshed in the background every BOT_CATALOG_TTL / 2 seconds
+CATALOG_TTL = float(os.getenv("BOT_CATALOG_TTL", "60"))
+
+# per-user pending IMEI prompts; BOT_STATE_DB makes them survive restarts
+STATE = StateStore(
+    max_entries=int(os.getenv("BOT_STATE_MAX", "10000")),
+    ttl=float(os.getenv("BOT_STATE_TTL", "900")),
+    path=os.getenv("BOT_STATE_DB") or None,
+)
+# expired prompts are dropped from memory (and BOT_STATE_DB) every BOT_STATE_PURGE_INTERVAL seconds
+STATE_PURGE_INTERVAL = float(os.getenv("BOT_STATE_PURGE_INTERVAL", "300"))
+state_purge_task = None
+
+http = None  # httpx.AsyncClient, opened in post_init and closed in post_shutdown
+lookups = None  # lookup_service.LookupService in direct mode
+lookup_pool = None  # ThreadPoolExecutor for lookups.lookup in direct mode
+
+
+def init_direct_mode():
+    """Open the database and build the in-process lookup service (BOT_MODE=direct)."""
+    global lookups, lookup_pool
+    import db_utils
+    from lookup_service import LookupService
+    from models import init_db
+
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    engine = init_db(os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(basedir, 'bot.db')}"))
+    db_utils.init_session_factory(engine)
+    lookups = LookupService.from_env(
+        db_utils.SessionLocal,
+        spool_path=os.getenv("BOT_WRITE_BEHIND_SPOOL", os.path.join(basedir, "write_behind.bot.spool.jsonl")),
+    )
+    lookups.start()
+    lookup_pool = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix="bot-lookup")
+
+
+async def open_http_client(application=None):
+    global http
+    http = httpx.AsyncClient(
+        base_url=API_URL.rstrip("/") + "/",
+        timeout=API_TIMEOUT,
+        limits=httpx.Limits(max_connections=API_POOL_SIZE, max_keepalive_connections=API_POOL_SIZE),
+    )
+
+
+async def close_http_client(application=None):
+    global http
+    if http is not None:
+        await http.aclose()
+        http = None
+
+
+# ---------- KEYBOARDS ---------- #
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🛠️ Services", callback_data="services")],
+    [InlineKeyboardButton("👤 Account", callback_data="account")],
+    [InlineKeyboardButton("ℹ️ Info", callback_data="info")],
+    [InlineKeyboardButton("🆘 Help", callback_data="help")],
+])
+BACK_MAIN = InlineKeyboardMarkup([[InlineKeyboardButton("⬅ Back", callback_data="back_main")]])
+
+
+def build_group_keyboard(services):
+    # 2 buttons per row, then a back button
+    buttons = []
+    row = []
+    for svc in services:
+        row.append(InlineKeyboardButton(svc["name"], callback_data=f"svc_{svc['code']}"))
+        if len(row) == 2:        # when row is full → push it
+            buttons.append(row)
+            row = []
+    if row:                      # remaining button (odd count)
+        buttons.append(row)
+    buttons.append([InlineKeyboardButton("⬅ Back", callback_data="back_services")])
+    return InlineKeyboardMarkup(buttons)
+
+
+class CatalogCache:
+    """
+    Grouped service catalog (/services/grouped) with its keyboards prebuilt
+    once per catalog version. Refreshes revalidate with If-None-Match, so an
+    unchanged catalog costs a 304 and keeps the existing keyboards.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.grouped = {}
+        self.etag = None
+        self.version = 0
+        self.loaded_at = None
+        self.groups_keyboard = self._build_groups_keyboard()
+        self.group_keyboards = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def get(self):
+        """The current snapshot; only fetched inline when the background refresh is not keeping up."""
+        if not self.fresh():
+            await self.refresh()
+        return self
+
+    async def refresh(self):
+        async with self._lock:
+            try:
+                if lookups is not None:
+                    from db_utils import run_db
+                    snap = await run_db(lookups.catalog.snapshot)
+                    if snap.etag != self.etag:
+                        self._build(snap.grouped, snap.etag)
+                else:
+                    headers = {"If-None-Match": self.etag} if self.etag else None
+                    r = await http.get("services/grouped", headers=headers)
+                    if r.status_code != 304:
+                        r.raise_for_status()
+                        self._build(r.json(), r.headers.get("ETag"))
+                self.loaded_at = time.monotonic()
+            except Exception as e:
+                # keep serving the previous snapshot
+                logger.error(f"Failed to refresh services: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 2)
+            await self.refresh()
+
+    def _build(self, grouped, etag):
+        self.grouped = grouped
+        self.etag = etag
+        self.version += 1
+        self.groups_keyboard = self._build_groups_keyboard()
+        self.group_keyboards = {grp: build_group_keyboard(svcs) for grp, svcs in grouped.items()}
+
+    def _build_groups_keyboard(self):
+        buttons = [[InlineKeyboardButton(grp, callback_data=f"group_{grp}")] for grp in self.grouped]
+        buttons.append([InlineKeyboardButton("⬅ Back", callback_data="back_main")])
+        return InlineKeyboardMarkup(buttons)
+
+
+catalog = CatalogCache(CATALOG_TTL)
+
+
+async def purge_state_loop():
+    while True:
+        await asyncio.sleep(STATE_PURGE_INTERVAL)
+        try:
+            removed = await STATE.apurge_expired()
+            if removed:
+                logger.info(f"Purged {removed} expired IMEI prompts")
+        except Exception as e:
+            logger.error(f"Failed to purge expired IMEI prompts: {e}")
+
+
+async def post_init(application):
+    global state_purge_task
+    if BOT_MODE == "direct":
+        init_direct_mode()
+    else:
+        await open_http_client()
+    await catalog.refresh()
+    catalog.start()
+    if STATE_PURGE_INTERVAL > 0:
+        state_purge_task = asyncio.create_task(purge_state_loop())
+
 
-STATE = {}  # per-user temporary state
+async def post_shutdown(application):
+    await catalog.stop()
+    if state_purge_task is not None:
+        state_purge_task.cancel()
+    await close_http_client()
+    if lookup_pool is not None:
+        lookup_pool.shutdown(wait=True)
+    STATE.close()
 
 
 # ---------- API HELPERS ---------- #
-def api_get_user(user_id, username=None):
+async def api_get_user(user_id, username=None):
     """Fetch user info from Flask API with safe error handling."""
+    r = None
     try:
-        url = f"{API_URL}/user/{user_id}"
-        if username:
-            url = f"{url}?username={username}"
-        r = requests.get(url, timeout=5)
+        if lookups is not None:
+            from db_utils import run_db, sync_get_or_create_user
+            user = await run_db(sync_get_or_create_user, user_id, username)
+            return {"user_id": user.id, "free_calls": user.free_calls,
+                    "paid_calls": user.paid_calls, "username": user.username}
+        r = await http.get(f"user/{user_id}", params={"username": username} if username else None)
         r.raise_for_status()
         return r.json()
     except Exception as e:
@@ -35,26 +239,14 @@ def api_get_user(user_id, username=None):
         return {"id": user_id, "free_calls": 0, "paid_calls": 0, "username": None}
 
 
-def api_get_services():
-    try:
-        r = requests.get(f"{API_URL}/services/grouped", timeout=5)
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        logger.error(f"Failed to fetch services: {e}")
-        return {}
-
-
-def api_lookup(service, imei, user_id, username=None):
+async def api_lookup(service, imei, user_id, username=None):
+    if lookups is not None:
+        return await direct_lookup(service, imei, user_id, username)
     try:
         payload = {"user_id": user_id, "service": service, "imei": imei}
         if username:
             payload["username"] = username
-        r = requests.post(
-            f"{API_URL}/lookup",
-            json=payload,
-            timeout=10
-        )
+        r = await http.post("lookup", json=payload, timeout=LOOKUP_TIMEOUT)
         r.raise_for_status()
         data = r.json()
         if "error" in data:
@@ -65,19 +257,29 @@ def api_lookup(service, imei, user_id, username=None):
         return f"⚠️ Lookup failed: {e}"
 
 
+async def direct_lookup(service, imei, user_id, username=None):
+    from lookup_service import LookupRejected
+    loop = asyncio.get_running_loop()
+    try:
+        outcome = await loop.run_in_executor(
+            lookup_pool, functools.partial(lookups.lookup, user_id, service, imei, username=username))
+    except LookupRejected as e:
+        return f"⚠️ Error: {e}"
+    except Exception as e:
+        logger.error(f"Lookup failed: {e}")
+        return f"⚠️ Lookup failed: {e}"
+    if not outcome.success:
+        return f"⚠️ Error: {outcome.error}"
+    return outcome.result
+
+
 # ---------- BOT MENU HANDLERS ---------- #
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    buttons = [
-        [InlineKeyboardButton("🛠️ Services", callback_data="services")],
-        [InlineKeyboardButton("👤 Account", callback_data="account")],
-        [InlineKeyboardButton("ℹ️ Info", callback_data="info")],
-        [InlineKeyboardButton("🆘 Help", callback_data="help")],
-    ]
     text = "Welcome! Choose an option:"
     if update.message:
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+        await update.message.reply_text(text, reply_markup=MAIN_MENU)
     else:
-        await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+        await update.callback_query.edit_message_text(text, reply_markup=MAIN_MENU)
 
 
 async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -96,22 +298,19 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ACCOUNT
     if data == "account":
-        user = api_get_user(user_id, query.from_user.username)
+        user = await api_get_user(user_id, query.from_user.username)
         msg = f"👤 **Account Info**\nFree Calls: {user.get('free_calls',0)}\nPaid Calls: {user.get('paid_calls',0)}"
-        buttons = [[InlineKeyboardButton("⬅ Back", callback_data="back_main")]]
-        await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(buttons))
+        await query.edit_message_text(msg, reply_markup=BACK_MAIN)
         return
 
     # INFO
     if data == "info":
-        buttons = [[InlineKeyboardButton("⬅ Back", callback_data="back_main")]]
-        await query.edit_message_text("This bot provides device lookup services.", reply_markup=InlineKeyboardMarkup(buttons))
+        await query.edit_message_text("This bot provides device lookup services.", reply_markup=BACK_MAIN)
         return
 
     # HELP
     if data == "help":
-        buttons = [[InlineKeyboardButton("⬅ Back", callback_data="back_main")]]
-        await query.edit_message_text("Send /start anytime to return to menu.", reply_markup=InlineKeyboardMarkup(buttons))
+        await query.edit_message_text("Send /start anytime to return to menu.", reply_markup=BACK_MAIN)
         return
 
     # SERVICES
@@ -119,74 +318,58 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_services(update, context)
         return
 
-    # SERVICE GROUP
     # SERVICE GROUP
     if data.startswith("group_"):
         group_name = data.replace("group_", "")
-        all_services = api_get_services()
+        snapshot = await catalog.get()
+        keyboard = snapshot.group_keyboards.get(group_name)
 
-        if group_name not in all_services:
+        if keyboard is None:
             await query.edit_message_text(f"No services in group {group_name}")
             return
 
-        services = all_services[group_name]
-
-        # --- BUILD 2 BUTTONS PER ROW ---
-        buttons = []
-        row = []
-        for svc in services:
-            row.append(InlineKeyboardButton(svc["name"], callback_data=f"svc_{svc['code']}"))
-            if len(row) == 2:        # when row is full → push it
-                buttons.append(row)
-                row = []
-        if row:                      # remaining button (odd count)
-            buttons.append(row)
-
-        # BACK BUTTON
-        buttons.append([InlineKeyboardButton("⬅ Back", callback_data="back_services")])
-
-        await query.edit_message_text(
-            f"Services in *{group_name}*:",
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
+        await query.edit_message_text(f"Services in *{group_name}*:", reply_markup=keyboard)
         return
 
     # SERVICE SELECTED → ask IMEI
     if data.startswith("svc_"):
         service_code = data.replace("svc_", "")
-        STATE[user_id] = {"awaiting_imei": True, "service": service_code}
+        await STATE.aset(user_id, service_code)
         await query.edit_message_text("Send the IMEI/Serial number for this service:")
         return
 
 
 async def show_services(update, context):
     """List service groups."""
-    all_services = api_get_services()
-    buttons = [[InlineKeyboardButton(grp, callback_data=f"group_{grp}")] for grp in all_services.keys()]
-    buttons.append([InlineKeyboardButton("⬅ Back", callback_data="back_main")])
-    await update.callback_query.edit_message_text("Choose a service group:", reply_markup=InlineKeyboardMarkup(buttons))
+    snapshot = await catalog.get()
+    await update.callback_query.edit_message_text("Choose a service group:", reply_markup=snapshot.groups_keyboard)
 
 
 # ---------- IMEI HANDLER ---------- #
 async def receive_imei(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_id not in STATE or not STATE[user_id].get("awaiting_imei"):
+    # taken (and cleared) atomically, so a second message sent meanwhile is not looked up too
+    service = await STATE.apop(user_id)
+    if service is None:
         return  # ignore unrelated messages
 
     imei = update.message.text.strip()
-    service = STATE[user_id]["service"]
 
     username = update.effective_user.username if update.effective_user else None
-    result = api_lookup(service, imei, user_id, username=username)
+    result = await api_lookup(service, imei, user_id, username=username)
     await update.message.reply_text(f"📡 Result:\n{result}")
 
-    # Clear user state
-    STATE[user_id]["awaiting_imei"] = False
-
 
 # ---------- MAIN ---------- #
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(menu_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receive_imei))
@@ -0,0 +1,137 @@
+# bot_state.py
+"""
+Per-user conversation state for the bot (which service a user picked and is
+about to send an IMEI for).
+
+Entries are compact (service code, expiry) tuples in an LRU-ordered dict,
+expire after `ttl` seconds and are capped at `max_entries` (least recently
+used first), so memory stays flat however many users have ever opened a
+service. With `path` set, entries are also written through to a small SQLite
+file: a restarted bot picks pending prompts up again, and entries evicted
+from memory are still found on disk. Async callers use aset() / apop() /
+apurge_expired(), which run the SQLite work on a worker thread instead of the
+event loop; the bot calls apurge_expired() periodically.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class StateStore:
+    def __init__(self, max_entries=10000, ttl=900, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # user_id -> (service, expires_at)
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS bot_state ("
+                "user_id INTEGER PRIMARY KEY, service TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._load()
+
+    def set(self, user_id, service):
+        """Remember that `user_id` is expected to send an IMEI for `service`."""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(user_id, (service, expires_at))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO bot_state VALUES (?, ?, ?)",
+                                 (user_id, service, expires_at))
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    self._db.execute("DELETE FROM bot_state WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, user_id):
+        """The pending service for `user_id`, or None."""
+        with self._lock:
+            return self._lookup(user_id)
+
+    def pop(self, user_id):
+        """Take (and clear) the pending service for `user_id`, or None."""
+        with self._lock:
+            service = self._lookup(user_id)
+            if service is not None:
+                self._delete(user_id)
+            return service
+
+    async def aset(self, user_id, service):
+        """set() without blocking the event loop on the SQLite write."""
+        if self._db is None:
+            return self.set(user_id, service)
+        return await asyncio.to_thread(self.set, user_id, service)
+
+    async def apop(self, user_id):
+        """pop() without blocking the event loop on the SQLite lookup / delete."""
+        if self._db is None:
+            return self.pop(user_id)
+        return await asyncio.to_thread(self.pop, user_id)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._delete(user_id)
+
+    def purge_expired(self):
+        """Drop every expired entry. Returns how many were removed from memory."""
+        now = time.time()
+        with self._lock:
+            expired = [uid for uid, (_, exp) in self._entries.items() if exp <= now]
+            for uid in expired:
+                del self._entries[uid]
+            if self._db is not None:
+                self._db.execute("DELETE FROM bot_state WHERE expires_at <= ?", (now,))
+        return len(expired)
+
+    async def apurge_expired(self):
+        """purge_expired() without blocking the event loop on the SQLite delete."""
+        if self._db is None:
+            return self.purge_expired()
+        return await asyncio.to_thread(self.purge_expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _lookup(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None and self._db is not None:
+            row = self._db.execute("SELECT service, expires_at FROM bot_state WHERE user_id = ?",
+                                   (user_id,)).fetchone()
+            entry = tuple(row) if row else None
+        if entry is None:
+            return None
+        service, expires_at = entry
+        if expires_at <= time.time():
+            self._delete(user_id)
+            return None
+        self._remember(user_id, entry)
+        return service
+
+    def _remember(self, user_id, entry):
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _delete(self, user_id):
+        self._entries.pop(user_id, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM bot_state WHERE user_id = ?", (user_id,))
+
+    def _load(self):
+        rows = self._db.execute(
+            "SELECT user_id, service, expires_at FROM bot_state WHERE expires_at > ? "
+            "ORDER BY expires_at DESC LIMIT ?", (time.time(), self.max_entries)
+        ).fetchall()
+        for user_id, service, expires_at in reversed(rows):
+            self._entries[user_id] = (service, expires_at)
@@ -0,0 +1,104 @@
+# catalog.py
+"""
+Versioned in-process snapshot of the service catalog.
+
+The `services` table changes rarely but is read by every catalog endpoint and
+every lookup. ServiceCatalog loads it once into plain ServiceEntry objects and
+serves reads from memory until invalidate() is called by the code that
+modified the table. Each snapshot carries a version number and an ETag derived
+from its content, so clients can revalidate with If-None-Match.
+
+Other worker processes do not see an invalidate(), so snapshots also expire
+after CATALOG_TTL seconds.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from models import Service
+
+CATALOG_TTL = float(os.environ.get("CATALOG_TTL", "30"))
+
+FIELDS = ("id", "code", "name", "description", "api_url", "api_key", "is_public", "group",
+          "cache_ttl", "http_method", "param_style", "auth_style")
+
+
+class ServiceEntry:
+    """Detached, read-mostly copy of a Service row."""
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for f in FIELDS:
+            setattr(self, f, values.get(f))
+
+    @classmethod
+    def from_row(cls, svc):
+        return cls(**{f: getattr(svc, f) for f in FIELDS})
+
+    def to_dict(self):
+        d = {f: getattr(self, f) for f in FIELDS}
+        d["is_public"] = bool(self.is_public)
+        return d
+
+
+class Snapshot:
+    def __init__(self, version, entries):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.services = entries                      # ordered by group, name
+        self.by_code = {e.code: e for e in entries}
+        self.by_id = {e.id: e for e in entries}
+        self.listing = [e.to_dict() for e in entries]
+        self.grouped = {}
+        for e in entries:
+            self.grouped.setdefault(e.group, []).append({"code": e.code, "name": e.name, "api_url": e.api_url})
+        digest = hashlib.sha1(json.dumps(self.listing, sort_keys=True, default=str).encode()).hexdigest()
+        self.digest = digest[:16]
+        self.etag = f"svc-{version}-{self.digest}"
+
+
+class ServiceCatalog:
+    def __init__(self, session_factory, ttl=CATALOG_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        snap = self._snapshot
+        if snap is not None and time.monotonic() - snap.loaded_at < self.ttl:
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if snap is None or time.monotonic() - snap.loaded_at >= self.ttl:
+                snap = self._load(snap)
+                self._snapshot = snap
+            return snap
+
+    def invalidate(self):
+        """Drop the current snapshot; the next read reloads the catalog."""
+        with self._lock:
+            self._snapshot = None
+
+    def get_by_code(self, code):
+        return self.snapshot().by_code.get(code)
+
+    def get(self, svc_id):
+        return self.snapshot().by_id.get(svc_id)
+
+    def _load(self, previous):
+        db = self.session_factory()
+        try:
+            rows = db.query(Service).order_by(Service.group, Service.name).all()
+            entries = [ServiceEntry.from_row(r) for r in rows]
+        finally:
+            db.close()
+        snap = Snapshot(self._version + 1, entries)
+        if previous is not None and snap.digest == previous.digest:
+            # unchanged content (e.g. a TTL refresh) keeps its version and ETag
+            snap = Snapshot(previous.version, entries)
+        self._version = snap.version
+        return snap
@@ -0,0 +1,156 @@
+# db_async.py
+"""
+Optional asyncio variant of db_utils on an async SQLAlchemy engine.
+
+The helpers mirror db_utils' sync_* functions but are awaited directly on the
+event loop (AsyncSession), so thousands of concurrent bot handlers do not
+queue for a handful of executor threads. SQLite needs the `aiosqlite`
+driver (and SQLAlchemy's `greenlet` dependency); PostgreSQL URLs use
+`asyncpg`. Neither is required unless init_async_engine() is called.
+
+    await db_async.init_async_engine(DATABASE_URL)
+    user = await db_async.get_or_create_user(telegram_id, username)
+
+The engine uses the same tuning profile as models.init_db (pool settings,
+SQLite pragmas). Schema creation and migrations stay with init_db.
+"""
+from sqlalchemy import event, select, update
+from sqlalchemy.engine import make_url
+
+from models import APIUsage, DeviceRecord, Service, User, engine_profile_from_env, sqlite_pragmas
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+engine = None
+AsyncSessionLocal = None  # set by init_async_engine()
+
+
+def async_url(database_url):
+    """Map a sync DATABASE_URL to its async driver (sqlite:// -> sqlite+aiosqlite://)."""
+    url = make_url(database_url)
+    if "+" in url.drivername:
+        backend, driver = url.drivername.split("+", 1)
+        if driver in ("aiosqlite", "asyncpg", "psycopg", "aiomysql", "asyncmy"):
+            return url
+    else:
+        backend = url.drivername
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} URLs")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+async def init_async_engine(database_url, profile=None):
+    """Create the async engine and session factory. Returns the engine."""
+    global engine, AsyncSessionLocal
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    profile = engine_profile_from_env() if profile is None else profile
+    url = async_url(database_url)
+    pool_args = {k: profile[k] for k in ("pool_size", "max_overflow", "pool_timeout") if k in profile}
+    if url.get_backend_name() == "sqlite":
+        in_memory = url.database in (None, "", ":memory:")
+        engine = create_async_engine(
+            url,
+            connect_args={"timeout": (profile.get("busy_timeout_ms") or 0) / 1000.0},
+            **({} if in_memory else pool_args),
+        )
+        event.listen(engine.sync_engine, "connect", sqlite_pragmas(profile))
+    else:
+        for k in ("pool_recycle", "pool_pre_ping"):
+            if k in profile:
+                pool_args[k] = profile[k]
+        engine = create_async_engine(url, **pool_args)
+    AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    return engine
+
+
+async def dispose():
+    if engine is not None:
+        await engine.dispose()
+
+
+# ---------- helpers (async mirrors of db_utils.sync_*) ----------
+async def get_or_create_user(telegram_id, username=None):
+    async with AsyncSessionLocal() as s:
+        u = (await s.execute(select(User).filter_by(telegram_id=telegram_id))).scalar_one_or_none()
+        if not u:
+            u = User(telegram_id=telegram_id, username=username, free_calls=10, paid_calls=0, registered=True)
+            s.add(u)
+            await s.commit()
+            await s.refresh(u)
+        elif username and username != u.username:
+            u.username = username
+            await s.commit()
+        return u
+
+
+async def list_services():
+    async with AsyncSessionLocal() as s:
+        return (await s.execute(select(Service).order_by(Service.id))).scalars().all()
+
+
+async def get_service_by_code(code):
+    async with AsyncSessionLocal() as s:
+        return (await s.execute(select(Service).filter_by(code=code))).scalar_one_or_none()
+
+
+async def create_usage(user_id, service_id, imei, success, cost=0.0):
+    async with AsyncSessionLocal() as s:
+        u = APIUsage(user_id=user_id, service_id=service_id, imei=imei, success=success, cost=cost)
+        s.add(u)
+        await s.commit()
+        await s.refresh(u)
+        return u
+
+
+async def store_device(user_id, imei=None, serial=None, note=None):
+    async with AsyncSessionLocal() as s:
+        d = DeviceRecord(user_id=user_id, imei=imei, serial=serial, note=note)
+        s.add(d)
+        await s.commit()
+        await s.refresh(d)
+        return d
+
+
+async def reserve_call(s, user_id):
+    """Async counterpart of quota.reserve_calls(db, user_id, 1): free calls first, then paid."""
+    for column, taken in ((User.free_calls, (1, 0)), (User.paid_calls, (0, 1))):
+        res = await s.execute(
+            update(User)
+            .where(User.id == user_id, column > 0)
+            .values({column: column - 1})
+        )
+        await s.commit()
+        if res.rowcount == 1:
+            return taken
+    return None
+
+
+async def decrement_free_call(telegram_id):
+    """
+    Consume one call (free first, then paid) with an atomic reservation.
+    Returns the reservation (free_taken, paid_taken) to hand to refund_call,
+    or None if the user does not exist or has no calls left.
+    """
+    async with AsyncSessionLocal() as s:
+        u = (await s.execute(select(User).filter_by(telegram_id=telegram_id))).scalar_one_or_none()
+        if not u:
+            return None
+        return await reserve_call(s, u.id)
+
+
+async def refund_call(telegram_id, reservation):
+    """Give back a call reserved by decrement_free_call (e.g. when the lookup failed)."""
+    free_back, paid_back = reservation
+    async with AsyncSessionLocal() as s:
+        await s.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id)
+            .values(free_calls=User.free_calls + free_back, paid_calls=User.paid_calls + paid_back)
+        )
+        await s.commit()
+
+
+async def get_user_by_tg(telegram_id):
+    async with AsyncSessionLocal() as s:
+        return (await s.execute(select(User).filter_by(telegram_id=telegram_id))).scalar_one_or_none()
@@ -1,89 +1,206 @@
 # db_utils.py
 import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from sqlalchemy.orm import sessionmaker
 from models import User, Service, DeviceRecord, APIUsage, Payment
+import quota
+from lookup_service import get_or_create_user
+import stats_counters  # registers the ORM hooks that maintain dashboard counters
+
+logger = logging.getLogger(__name__)
+
+# run_db() work waiting longer than this for a worker is logged (the DB executor is saturated)
+DB_QUEUE_WAIT_WARN_MS = float(os.environ.get("DB_QUEUE_WAIT_WARN_MS", "500"))
 
 SessionLocal = None  # will be set from app startup
+_executor = None     # dedicated run_db() threads, sized to the engine's connection pool
+
+
+class ExecutorStats:
+    """Queue wait / execution time and saturation counters for run_db()."""
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._last_warning = 0.0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.submitted = self.started = self.completed = self.failed = 0
+            self.active = self.queued = self.max_queued = 0
+            self.saturated = 0          # submissions that found every worker busy
+            self.wait_ms_total = self.wait_ms_max = 0.0
+            self.exec_ms_total = self.exec_ms_max = 0.0
+
+    def submit(self):
+        with self._lock:
+            self.submitted += 1
+            if self.active + self.queued >= self.workers:
+                self.saturated += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def start(self, wait_ms):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.started += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            warn = wait_ms >= DB_QUEUE_WAIT_WARN_MS and time.monotonic() - self._last_warning > 60
+            if warn:
+                self._last_warning = time.monotonic()
+        if warn:
+            logger.warning("run_db waited %.0f ms for a DB worker (%d workers, %d queued)",
+                           wait_ms, self.workers, self.queued)
+
+    def finish(self, exec_ms, ok):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            if not ok:
+                self.failed += 1
+            self.exec_ms_total += exec_ms
+            self.exec_ms_max = max(self.exec_ms_max, exec_ms)
+
+    def snapshot(self):
+        with self._lock:
+            # waits are recorded when a job starts, run times when it finishes
+            started = self.started or 1
+            done = self.completed or 1
+            return {
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "started": self.started,
+                "completed": self.completed,
+                "failed": self.failed,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "saturated": self.saturated,
+                "saturation_ratio": round(self.saturated / self.submitted, 4) if self.submitted else 0.0,
+                "avg_wait_ms": round(self.wait_ms_total / started, 3),
+                "max_wait_ms": round(self.wait_ms_max, 3),
+                "avg_exec_ms": round(self.exec_ms_total / done, 3),
+                "max_exec_ms": round(self.exec_ms_max, 3),
+            }
+
+
+stats = ExecutorStats()
+
+
+def _pool_capacity(engine):
+    """Connections the engine's pool can hand out at once (pool_size + max_overflow)."""
+    pool = engine.pool
+    try:
+        size = pool.size()
+    except (AttributeError, TypeError):
+        return 5
+    overflow = getattr(pool, "_max_overflow", 0) or 0
+    return max(1, size + max(overflow, 0))
+
 
-def init_session_factory(engine):
-    global SessionLocal
+def init_session_factory(engine, max_workers=None):
+    global SessionLocal, _executor
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
+    # more threads than pooled connections would only queue inside the pool
+    workers = max_workers or int(os.environ.get("DB_EXECUTOR_WORKERS", "0")) or _pool_capacity(engine)
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+    stats.workers = workers
+
+
+@contextmanager
+def session_scope():
+    """A session that is rolled back on error and always closed."""
+    s = SessionLocal()
+    try:
+        yield s
+    except Exception:
+        s.rollback()
+        raise
+    finally:
+        s.close()
+
 
 async def run_db(func, *args, **kwargs):
     """
-    Run blocking DB function in a thread and return result.
-    func must be a sync function that uses SessionLocal().
+    Run blocking DB function in a DB executor thread and return result.
+    func must be a sync function that uses SessionLocal() / session_scope().
     """
+    submitted = time.perf_counter()
+
+    def call():
+        started = time.perf_counter()
+        stats.start((started - submitted) * 1000)
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            stats.finish((time.perf_counter() - started) * 1000, ok)
+
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+    stats.submit()
+    return await loop.run_in_executor(_executor, call)
 
 
 # Example sync DB helper functions (called via run_db)
 def sync_get_or_create_user(telegram_id, username=None):
-    s = SessionLocal()
-    try:
-        u = s.query(User).filter_by(telegram_id=telegram_id).first()
-        if not u:
-            u = User(telegram_id=telegram_id, username=username)
-            s.add(u)
-            s.commit()
-            s.refresh(u)
-        return u
-    finally:
-        s.close()
+    with session_scope() as s:
+        return get_or_create_user(s, telegram_id, username)
 
 def sync_list_services():
-    s = SessionLocal()
-    try:
+    with session_scope() as s:
         return s.query(Service).order_by(Service.id).all()
-    finally:
-        s.close()
 
 def sync_get_service_by_code(code):
-    s = SessionLocal()
-    try:
+    with session_scope() as s:
         return s.query(Service).filter_by(code=code).first()
-    finally:
-        s.close()
 
 def sync_create_usage(user_id, service_id, imei, success, cost=0.0):
-    s = SessionLocal()
-    try:
+    with session_scope() as s:
         u = APIUsage(user_id=user_id, service_id=service_id, imei=imei, success=success, cost=cost)
         s.add(u)
         s.commit()
         s.refresh(u)
         return u
-    finally:
-        s.close()
 
 def sync_store_device(user_id, imei=None, serial=None, note=None):
-    s = SessionLocal()
-    try:
+    with session_scope() as s:
         d = DeviceRecord(user_id=user_id, imei=imei, serial=serial, note=note)
         s.add(d)
         s.commit()
         s.refresh(d)
         return d
-    finally:
-        s.close()
 
 def sync_decrement_free_call(telegram_id):
-    s = SessionLocal()
-    try:
+    """
+    Consume one call (free first, then paid) with an atomic reservation.
+    Returns the reservation (free_taken, paid_taken) to hand to
+    sync_refund_call, or None if the user does not exist or has no calls left.
+    """
+    with session_scope() as s:
         u = s.query(User).filter_by(telegram_id=telegram_id).first()
         if not u:
             return None
-        if u.free_calls > 0:
-            u.free_calls -= 1
-            s.commit()
-        return u
-    finally:
-        s.close()
+        return quota.reserve_calls(s, u.id)
+
+def sync_refund_call(telegram_id, reservation):
+    """Give back a call reserved by sync_decrement_free_call (e.g. when the lookup failed)."""
+    with session_scope() as s:
+        u = s.query(User).filter_by(telegram_id=telegram_id).first()
+        if u:
+            quota.refund_calls(s, u.id, reservation)
 
 def sync_get_user_by_tg(telegram_id):
-    s = SessionLocal()
-    try:
+    with session_scope() as s:
         return s.query(User).filter_by(telegram_id=telegram_id).first()
-    finally:
-        s.close()
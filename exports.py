@@ -0,0 +1,77 @@
+# exports.py
+"""
+Streaming CSV / NDJSON exports of whole tables.
+
+Rows are read with a Core SELECT of plain columns, executed with
+`yield_per` so the driver hands them over in fixed-size partitions (a
+server-side cursor where the backend supports one), and are serialized into
+chunks as they arrive. Memory use is bounded by the chunk size, not by the
+table size.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from models import APIUsage, DeviceRecord, Payment
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+YIELD_PER = 1000
+
+EXPORTS = {
+    "usages": (APIUsage, ("id", "user_id", "service_id", "imei", "success", "cost", "created_at")),
+    "payments": (Payment, ("id", "user_id", "amount", "method", "note", "created_at")),
+    "devices": (DeviceRecord, ("id", "user_id", "imei", "serial", "note", "created_at")),
+}
+
+
+def export_query(name):
+    """SELECT of the exported columns of `name`, in id order. Returns (model, columns, query)."""
+    model, columns = EXPORTS[name]
+    return model, columns, select(*(getattr(model, c) for c in columns)).order_by(model.id)
+
+
+def _value(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def _csv_chunks(columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for partition in rows.partitions():
+        writer.writerows([_value(v) for v in row] for row in partition)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _ndjson_chunks(columns, rows):
+    for partition in rows.partitions():
+        yield "".join(
+            json.dumps(dict(zip(columns, (_value(v) for v in row)))) + "\n" for row in partition
+        )
+
+
+def stream_export(session_factory, columns, query, fmt):
+    """
+    Generator of text chunks for `query` in `fmt` (csv / ndjson). The session
+    is opened on first iteration and closed when the generator is exhausted
+    or closed, so it is safe to hand straight to a streaming Response.
+    """
+    db = session_factory()
+    try:
+        rows = db.execute(query.execution_options(yield_per=YIELD_PER))
+        chunks = _csv_chunks if fmt == "csv" else _ndjson_chunks
+        yield from chunks(columns, rows)
+    finally:
+        db.close()
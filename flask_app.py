@@ -1,12 +1,21 @@
 import os
-import requests
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
 from dotenv import load_dotenv
 from models import init_db, Service, User, DeviceRecord, APIUsage, Payment
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func
-import models, db_utils
-from datetime import datetime
+from sqlalchemy.orm import joinedload, sessionmaker
+import models, db_utils, quota, rollups, stats_counters
+from background import start_periodic
+import provider_client
+from pagination import PaginationError, apply_filters, keyset_page, parse_datetime, parse_int, parse_limit
+from lookup_service import LookupRejected, LookupService, get_or_create_user, validate_request_style
+import exports
+import metrics
+import profiling
+import serializers
+from serializers import json_response
+from datetime import datetime, timedelta
 
 load_dotenv()
 
@@ -14,13 +23,69 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 DATABASE_URL = os.environ.get("DATABASE_URL", f"sqlite:///{os.path.join(basedir, 'bot.db')}")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "password")
 FLASK_SECRET = os.environ.get("FLASK_SECRET", "secret-key")
+LOOKUP_BATCH_MAX = int(os.environ.get("LOOKUP_BATCH_MAX", "1000"))
+LOOKUP_BATCH_WORKERS = int(os.environ.get("LOOKUP_BATCH_WORKERS", "8"))
+STATS_RECONCILE_INTERVAL = float(os.environ.get("STATS_RECONCILE_INTERVAL", "600"))
+ROLLUP_INTERVAL = float(os.environ.get("ROLLUP_INTERVAL", "60"))
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "100"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # if set, /metrics requires "Authorization: Bearer <token>"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "0"))  # 0 = slow-query log off
+PROFILE_ROUTES = [r.strip() for r in os.environ.get("PROFILE_ROUTES", "").split(",") if r.strip()]
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(basedir, "profiles"))
 
 engine = init_db(DATABASE_URL)
+metrics.instrument_engine(engine)
+if SLOW_QUERY_MS > 0:
+    profiling.log_slow_queries(engine, SLOW_QUERY_MS)
 db_utils.init_session_factory(engine)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
+# dashboard counters are maintained incrementally; seed them once, then correct drift periodically
+_db = SessionLocal()
+if stats_counters.needs_reconcile(_db):
+    stats_counters.reconcile(SessionLocal)
+_db.close()
+start_periodic("stats-reconcile", STATS_RECONCILE_INTERVAL, lambda: stats_counters.reconcile(SessionLocal))
+# new api_usages rows are folded into the hourly / daily rollups behind /api/usages/stats,
+# starting with whatever backlog is already there (off the import / request path)
+start_periodic("usage-rollups", ROLLUP_INTERVAL, lambda: rollups.fold_new_usages(SessionLocal), run_first=True)
+
 app = Flask(__name__)
 app.secret_key = FLASK_SECRET
+metrics.instrument_app(app)
+profiling.add_query_headers(app)
+if PROFILE_ROUTES:
+    profiling.profile_routes(app, PROFILE_ROUTES, PROFILE_DIR)
+
+# lookup service layer (shared with the bot's direct-DB mode)
+lookups = LookupService.from_env(SessionLocal)
+lookups.start()
+
+# Shared, pooled HTTP client for upstream provider calls (keep-alive per host)
+provider = lookups.provider
+# in-memory service catalog; every write to the services table must call catalog.invalidate()
+catalog = lookups.catalog
+# (service code, imei) -> provider result; optionally persisted in the lookup_cache table
+result_cache = lookups.result_cache
+# concurrent identical (service code, imei) lookups share one provider call
+inflight = lookups.inflight
+# usage/device rows from /api/lookup are written in bulk by a background thread
+usage_writer = lookups.usage_writer
+# bounded worker pool for /api/lookup/batch fan-out
+batch_pool = ThreadPoolExecutor(max_workers=LOOKUP_BATCH_WORKERS, thread_name_prefix="lookup")
+
+metrics.registry.gauge("write_behind_queue_depth", "Usage records waiting to be written.",
+                       lambda: usage_writer.stats()["depth"])
+metrics.registry.gauge("lookup_cache_entries", "Entries in the lookup result cache.",
+                       lambda: result_cache.stats()["entries"])
+metrics.registry.gauge("lookup_cache_hit_ratio", "Lookup result cache hit ratio since start.",
+                       lambda: result_cache.stats()["hit_ratio"])
+metrics.registry.gauge("provider_circuit_open", "1 while a provider host's circuit breaker is not closed.",
+                       lambda: {(host, h["state"]): int(h["state"] != "closed")
+                                for host, h in provider.health.snapshot().items()},
+                       ("host", "state"))
+metrics.registry.gauge("db_executor_queue_depth", "Jobs waiting for a db_utils executor thread.",
+                       lambda: db_utils.stats.snapshot()["queued"])
 
 
 # Add permissive CORS headers for development (allows the Vite frontend to call the API)
@@ -57,6 +122,17 @@ def admin_required(fn):
     return wrapped
 
 
+def api_admin_required(fn):
+    """Like admin_required, but answers JSON 401 instead of redirecting (for /api/admin/*)."""
+    from functools import wraps
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        if not session.get("admin_logged_in"):
+            return jsonify({"error": "Admin login required"}), 401
+        return fn(*args, **kwargs)
+    return wrapped
+
+
 # ============================================================
 # LOGIN / LOGOUT
 # ============================================================
@@ -95,6 +171,60 @@ def logout():
     return redirect(url_for("login"))
 
 
+# ---------- METRICS ----------
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+# ---------- PROVIDER CLIENT STATS ----------
+@app.route('/api/admin/provider/stats')
+@api_admin_required
+def api_provider_stats():
+    return jsonify(provider.stats())
+
+
+# ---------- LOOKUP RESULT CACHE ----------
+@app.route('/api/admin/lookup-cache')
+@api_admin_required
+def api_lookup_cache_stats():
+    stats = result_cache.stats()
+    stats['singleflight'] = inflight.stats()
+    return jsonify(stats)
+
+
+@app.route('/api/admin/lookup-cache', methods=['DELETE'])
+@api_admin_required
+def api_lookup_cache_purge():
+    # optional filters: ?service=<code>&imei=<imei>; no filter purges everything
+    removed = result_cache.purge(service_code=request.args.get('service'), imei=request.args.get('imei'))
+    return jsonify({'message': 'Cache purged', 'removed': removed})
+
+
+# ---------- WRITE-BEHIND USAGE QUEUE ----------
+@app.route('/api/admin/write-behind')
+@api_admin_required
+def api_write_behind_stats():
+    return jsonify(usage_writer.stats())
+
+
+# ---------- PROVIDER HEALTH / CIRCUIT BREAKERS ----------
+@app.route('/api/admin/provider/health')
+@api_admin_required
+def api_provider_health():
+    return jsonify(provider.health.snapshot())
+
+
+@app.route('/api/admin/provider/health/reset', methods=['POST'])
+@api_admin_required
+def api_provider_health_reset():
+    # optional ?host=https://api.imei.info ; no host resets every breaker
+    provider.health.reset(request.args.get('host'))
+    return jsonify({'message': 'Provider health reset'})
+
+
 # ============================================================
 # ADMIN PAGES
 # ============================================================
@@ -102,20 +232,27 @@ def logout():
 @admin_required
 def users():
     db = SessionLocal()
-    users = db.query(User).order_by(User.id.desc()).all()
+    users, next_cursor = keyset_page(db.query(User), User, ADMIN_PAGE_SIZE, request.args.get('cursor'))
+    total = int(stats_counters.read(db)['users_count'])
     db.close()
-    return render_template("users.html", users=users)
+    return render_template("users.html", users=users, total=total, next_cursor=next_cursor)
 
 
 @app.route("/user/<int:user_id>")
 @admin_required
 def user_detail(user_id):
     db = SessionLocal()
-    user = db.query(User).filter_by(id=user_id).first()
-    devices = db.query(DeviceRecord).filter_by(user_id=user_id).all()
-    usages = db.query(APIUsage).filter_by(user_id=user_id).order_by(APIUsage.created_at.desc()).limit(200).all()
+    user = db.get(User, user_id)
+    if user is None:
+        db.close()
+        return "User not found", 404
+    devices = db.query(DeviceRecord).filter_by(user_id=user_id).order_by(DeviceRecord.id).all()
+    # the service of every usage comes in the same query (the session is closed before rendering)
+    usages, next_cursor = keyset_page(
+        db.query(APIUsage).filter_by(user_id=user_id).options(joinedload(APIUsage.service)),
+        APIUsage, ADMIN_PAGE_SIZE, request.args.get('cursor'))
     db.close()
-    return render_template("user_detail.html", user=user, devices=devices, usages=usages)
+    return render_template("user_detail.html", user=user, devices=devices, usages=usages, next_cursor=next_cursor)
 
 
 @app.route("/services", methods=["GET", "POST"])
@@ -132,6 +269,8 @@ def services():
         )
         db.add(svc)
         db.commit()
+        db.close()
+        catalog.invalidate()
         return redirect(url_for("services"))
 
     services = db.query(Service).order_by(Service.id).all()
@@ -143,9 +282,11 @@ def services():
 @admin_required
 def payments():
     db = SessionLocal()
-    payments = db.query(Payment).order_by(Payment.created_at.desc()).limit(200).all()
+    payments, next_cursor = keyset_page(db.query(Payment).options(joinedload(Payment.user)),
+                                        Payment, ADMIN_PAGE_SIZE, request.args.get('cursor'))
+    total = stats_counters.read(db)['payments_total']
     db.close()
-    return render_template("payments.html", payments=payments)
+    return render_template("payments.html", payments=payments, total=total, next_cursor=next_cursor)
 
 
 @app.route("/user/<int:user_id>/set_quota", methods=["POST"])
@@ -223,74 +364,51 @@ def api_add_service():
     db.add(svc)
     db.commit()
     db.refresh(svc)
+    result = serializers.to_dict(Service, svc)
     db.close()
+    catalog.invalidate()
+
+    return json_response({"message": "Service added successfully", "service": result}, 201)
+
+# ---------- LIST PAGINATION ----------
+@app.errorhandler(PaginationError)
+def handle_pagination_error(e):
+    return jsonify({'error': str(e)}), 400
+
+
+def _list_page(query, model):
+    """
+    One keyset page of `query` (newest first) using the request's
+    limit / cursor params and list filters. Returns (rows, next_cursor).
+    """
+    query = apply_filters(query, model, request.args)
+    return keyset_page(query, model, parse_limit(request.args.get('limit')), request.args.get('cursor'))
 
-    return jsonify({
-        "message": "Service added successfully",
-        "service": {
-            "id": svc.id,
-            "code": svc.code,
-            "name": svc.name,
-            "group": svc.group,
-            "api_url": svc.api_url,
-            "api_key": svc.api_key
-        }
-    }), 201
 
 # ---------- GET SERVICE GROUPS ----------
+def _catalog_response(snap, payload):
+    """JSON response for catalog data, tagged with the snapshot's ETag (304 when unchanged)."""
+    response = json_response(payload)
+    response.set_etag(snap.etag)
+    response.headers['X-Catalog-Version'] = str(snap.version)
+    return response.make_conditional(request)
+
 @app.route("/api/services")
 def api_services():
-    db = SessionLocal()
-    all_services = db.query(Service).order_by(Service.group, Service.name).all()
-    result = []
-    for svc in all_services:
-        result.append({
-            "id": svc.id,
-            "code": svc.code,
-            "name": svc.name,
-            "description": svc.description,
-            "api_url": svc.api_url,
-            "api_key": svc.api_key,
-            "is_public": bool(svc.is_public),
-            "group": svc.group
-        })
-    db.close()
-    return jsonify(result)
+    snap = catalog.snapshot()
+    return _catalog_response(snap, snap.listing)
 
 @app.route("/api/services/grouped")
 def api_services_grouped():
-    db = SessionLocal()
-    all_services = db.query(Service).order_by(Service.group, Service.name).all()
-
-    groups = {}
-    for svc in all_services:
-        if svc.group not in groups:
-            groups[svc.group] = []
-        groups[svc.group].append({
-            "code": svc.code,
-            "name": svc.name,
-            "api_url": svc.api_url
-        })
-
-    db.close()
-    return jsonify(groups)
+    snap = catalog.snapshot()
+    return _catalog_response(snap, snap.grouped)
 
 @app.route('/api/payments')
 def api_payments():
     db = SessionLocal()
-    payments = db.query(Payment).order_by(Payment.created_at.desc()).limit(200).all()
-    result = []
-    for p in payments:
-        result.append({
-            'id': p.id,
-            'user_id': p.user_id,
-            'amount': p.amount,
-            'method': p.method,
-            'note': p.note,
-            'created_at': p.created_at.isoformat() if p.created_at else None
-        })
+    rows, next_cursor = _list_page(db.query(*serializers.columns(Payment)), Payment)
     db.close()
-    return jsonify(result)
+    return json_response({'items': serializers.rows_to_dicts(Payment, rows), 'next_cursor': next_cursor})
 
 
 # =========================
@@ -300,23 +418,11 @@ def api_payments():
 # --------- SERVICES CRUD ----------
 @app.route('/api/services/<int:svc_id>')
 def api_get_service(svc_id: int):
-    db = SessionLocal()
-    svc = db.query(Service).filter_by(id=svc_id).first()
+    snap = catalog.snapshot()
+    svc = snap.by_id.get(svc_id)
     if not svc:
-        db.close()
         return jsonify({'error': 'Service not found'}), 404
-    result = {
-        'id': svc.id,
-        'code': svc.code,
-        'name': svc.name,
-        'description': svc.description,
-        'api_url': svc.api_url,
-        'api_key': svc.api_key,
-        'is_public': bool(svc.is_public),
-        'group': svc.group
-    }
-    db.close()
-    return jsonify(result)
+    return _catalog_response(snap, svc.to_dict())
 
 
 @app.route('/api/services', methods=['POST'])
@@ -331,9 +437,13 @@ def api_create_service():
     api_url = data.get('api_url')
     api_key = data.get('api_key')
     description = data.get('description', '')
+    cache_ttl = data.get('cache_ttl')
 
     if not code or not name or not api_url:
         return jsonify({'error': 'Missing required fields: code, name, api_url'}), 400
+    style_error = validate_request_style(data)
+    if style_error:
+        return jsonify({'error': style_error}), 400
 
     db = SessionLocal()
     existing = db.query(Service).filter_by(code=code).first()
@@ -341,22 +451,16 @@ def api_create_service():
         db.close()
         return jsonify({'error': 'Service with this code already exists'}), 400
 
-    svc = Service(code=code, name=name, group=group, api_url=api_url, description=description, api_key=api_key)
+    svc = Service(code=code, name=name, group=group, api_url=api_url, description=description, api_key=api_key, cache_ttl=cache_ttl,
+                  http_method=(data.get('http_method') or '').upper() or None,
+                  param_style=data.get('param_style'), auth_style=data.get('auth_style'))
     db.add(svc)
     db.commit()
     db.refresh(svc)
-    result = {
-        'id': svc.id,
-        'code': svc.code,
-        'name': svc.name,
-        'description': svc.description,
-        'api_url': svc.api_url,
-        'api_key': svc.api_key,
-        'is_public': bool(svc.is_public),
-        'group': svc.group
-    }
+    catalog.invalidate()
+    result = serializers.to_dict(Service, svc)
     db.close()
-    return jsonify({'message': 'Service created', 'service': result}), 201
+    return json_response({'message': 'Service created', 'service': result}, 201)
 
 
 @app.route('/api/services/<int:svc_id>', methods=['PUT'])
@@ -364,30 +468,34 @@ def api_update_service(svc_id: int):
     data = request.json
     if not data:
         return jsonify({'error': 'Missing JSON data'}), 400
+    style_error = validate_request_style(data)
+    if style_error:
+        return jsonify({'error': style_error}), 400
     db = SessionLocal()
     svc = db.query(Service).filter_by(id=svc_id).first()
     if not svc:
         db.close()
         return jsonify({'error': 'Service not found'}), 404
 
+    old_code = svc.code
+    # a new provider URL has to be learned again unless the style is given explicitly
+    if data.get('api_url', svc.api_url) != svc.api_url and 'http_method' not in data:
+        svc.http_method = svc.param_style = svc.auth_style = None
     # allow updating a subset of fields
-    for field in ('code', 'name', 'description', 'api_url', 'group', 'is_public', 'api_key'):
+    for field in ('code', 'name', 'description', 'api_url', 'group', 'is_public', 'api_key', 'cache_ttl',
+                  'http_method', 'param_style', 'auth_style'):
         if field in data:
             setattr(svc, field, data[field])
+    if svc.http_method:
+        svc.http_method = svc.http_method.upper()
     db.commit()
     db.refresh(svc)
-    result = {
-        'id': svc.id,
-        'code': svc.code,
-        'name': svc.name,
-        'description': svc.description,
-        'api_url': svc.api_url,
-        'api_key': svc.api_key,
-        'is_public': bool(svc.is_public),
-        'group': svc.group
-    }
+    # provider/url may have changed: cached results for this service are stale
+    result_cache.purge(service_code=old_code)
+    catalog.invalidate()
+    result = serializers.to_dict(Service, svc)
     db.close()
-    return jsonify({'message': 'Service updated', 'service': result})
+    return json_response({'message': 'Service updated', 'service': result})
 
 
 @app.route('/api/services/<int:svc_id>', methods=['DELETE'])
@@ -397,9 +505,12 @@ def api_delete_service(svc_id: int):
     if not svc:
         db.close()
         return jsonify({'error': 'Service not found'}), 404
+    code = svc.code
     db.delete(svc)
     db.commit()
     db.close()
+    catalog.invalidate()
+    result_cache.purge(service_code=code)
     return jsonify({'message': 'Service deleted'})
 
 
@@ -407,20 +518,9 @@ def api_delete_service(svc_id: int):
 @app.route('/api/users')
 def api_get_users():
     db = SessionLocal()
-    users = db.query(User).order_by(User.id.desc()).all()
-    result = []
-    for u in users:
-        result.append({
-            'id': u.id,
-            'telegram_id': u.telegram_id,
-            'username': u.username,
-            'registered': bool(u.registered),
-            'free_calls': u.free_calls,
-            'paid_calls': u.paid_calls,
-            'created_at': u.created_at.isoformat() if u.created_at else None
-        })
+    rows, next_cursor = _list_page(db.query(*serializers.columns(User)), User)
     db.close()
-    return jsonify(result)
+    return json_response({'items': serializers.rows_to_dicts(User, rows), 'next_cursor': next_cursor})
 
 
 @app.route('/api/users/<int:user_id>', methods=['GET', 'PUT', 'DELETE'])
@@ -428,21 +528,11 @@ def api_user_detail(user_id: int):
     db = SessionLocal()
     # GET by internal id
     if request.method == 'GET':
-        u = db.query(User).filter_by(id=user_id).first()
-        if not u:
-            db.close()
-            return jsonify({'error': 'User not found'}), 404
-        result = {
-            'id': u.id,
-            'telegram_id': u.telegram_id,
-            'username': u.username,
-            'registered': bool(u.registered),
-            'free_calls': u.free_calls,
-            'paid_calls': u.paid_calls,
-            'created_at': u.created_at.isoformat() if u.created_at else None
-        }
+        row = db.query(*serializers.columns(User)).filter(User.id == user_id).first()
         db.close()
-        return jsonify(result)
+        if not row:
+            return jsonify({'error': 'User not found'}), 404
+        return json_response(serializers.row_to_dict(User, row))
 
     # PUT update
     if request.method == 'PUT':
@@ -478,19 +568,9 @@ def api_user_detail(user_id: int):
 @app.route('/api/devices')
 def api_get_devices():
     db = SessionLocal()
-    devices = db.query(DeviceRecord).order_by(DeviceRecord.id.desc()).all()
-    result = []
-    for d in devices:
-        result.append({
-            'id': d.id,
-            'user_id': d.user_id,
-            'imei': d.imei,
-            'serial': d.serial,
-            'note': d.note,
-            'created_at': d.created_at.isoformat() if d.created_at else None
-        })
+    rows, next_cursor = _list_page(db.query(*serializers.columns(DeviceRecord)), DeviceRecord)
     db.close()
-    return jsonify(result)
+    return json_response({'items': serializers.rows_to_dicts(DeviceRecord, rows), 'next_cursor': next_cursor})
 
 
 @app.route('/api/devices', methods=['POST'])
@@ -509,57 +589,101 @@ def api_create_device():
     db.add(device)
     db.commit()
     db.refresh(device)
-    result = {
-        'id': device.id,
-        'user_id': device.user_id,
-        'imei': device.imei,
-        'serial': device.serial,
-        'note': device.note,
-        'created_at': device.created_at.isoformat() if device.created_at else None
-    }
+    result = serializers.to_dict(DeviceRecord, device)
     db.close()
-    return jsonify({'message': 'Device created', 'device': result}), 201
+    return json_response({'message': 'Device created', 'device': result}, 201)
 
 
 # --------- USAGE / LOGS READ ONLY ----------
 @app.route('/api/usages')
 def api_get_usages():
     db = SessionLocal()
-    usages = db.query(APIUsage).order_by(APIUsage.created_at.desc()).limit(500).all()
-    result = []
-    for u in usages:
-        result.append({
-            'id': u.id,
-            'user_id': u.user_id,
-            'service_id': u.service_id,
-            'imei': u.imei,
-            'success': bool(u.success),
-            'cost': u.cost,
-            'created_at': u.created_at.isoformat() if u.created_at else None
-        })
+    rows, next_cursor = _list_page(db.query(*serializers.columns(APIUsage)), APIUsage)
     db.close()
-    return jsonify(result)
+    return json_response({'items': serializers.rows_to_dicts(APIUsage, rows), 'next_cursor': next_cursor})
+
+
+@app.route('/api/usages/stats')
+def api_usage_stats():
+    """
+    Usage time series from the rollup tables (current up to the last periodic
+    fold, i.e. at most ROLLUP_INTERVAL seconds behind).
+    ?granularity=hour|day  ?from=&to= (ISO, `to` exclusive)  ?service_id=  ?user_id=
+    ?group_by=service|provider|user
+    """
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in rollups.ROLLUPS:
+        raise PaginationError("granularity must be hour or day")
+    group_by = request.args.get('group_by') or None
+    if group_by not in (None, 'service', 'provider', 'user'):
+        raise PaginationError("group_by must be service, provider or user")
+    now = datetime.utcnow()
+    start = parse_datetime(request.args['from'], 'from') if request.args.get('from') else \
+        now - timedelta(days=7 if granularity == 'hour' else 90)
+    end = parse_datetime(request.args['to'], 'to') if request.args.get('to') else None
+    service_id = parse_int(request.args['service_id'], 'service_id') if request.args.get('service_id') else None
+    user_id = parse_int(request.args['user_id'], 'user_id') if request.args.get('user_id') else None
+
+    db = SessionLocal()
+    try:
+        points = rollups.query_stats(db, granularity, start, end, service_id, user_id,
+                                     'service' if group_by == 'provider' else group_by)
+    finally:
+        db.close()
+
+    if group_by == 'provider':
+        by_id = catalog.snapshot().by_id
+        merged = {}
+        for p in points:
+            svc = by_id.get(p.pop('service_id'))
+            host = provider_client.host_key(svc.api_url) if svc and svc.api_url else None
+            m = merged.setdefault((p['bucket'], host), dict(p, provider=host, total=0, success=0, failed=0, cost=0.0))
+            for k in ('total', 'success', 'failed', 'cost'):
+                m[k] += p[k]
+        points = list(merged.values())
+        for m in points:
+            m['success_rate'] = round(m['success'] / m['total'], 4) if m['total'] else None
+
+    return json_response({'granularity': granularity, 'group_by': group_by, 'points': points})
+
+
+# --------- EXPORTS ----------
+@app.route('/api/export/<name>')
+def api_export(name: str):
+    """
+    Stream a whole table as CSV or NDJSON (?format=csv|ndjson, default csv),
+    in id order, with the same from / to / user_id / service_id / success
+    filters as the list endpoints.
+    """
+    if name not in exports.EXPORTS:
+        return jsonify({'error': 'Unknown export'}), 404
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    model, columns, query = exports.export_query(name)
+    query = apply_filters(query, model, request.args)
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    return Response(
+        exports.stream_export(SessionLocal, columns, query, fmt),
+        mimetype=exports.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{name}-{stamp}.{fmt}"'},
+    )
 
 
 # --------- PAYMENTS CRUD ----------
 @app.route('/api/payments/<int:pay_id>', methods=['GET', 'DELETE'])
 def api_payment_detail(pay_id: int):
     db = SessionLocal()
+    if request.method == 'GET':
+        row = db.query(*serializers.columns(Payment)).filter(Payment.id == pay_id).first()
+        db.close()
+        if not row:
+            return jsonify({'error': 'Payment not found'}), 404
+        return json_response(serializers.row_to_dict(Payment, row))
     p = db.query(Payment).filter_by(id=pay_id).first()
     if not p:
         db.close()
         return jsonify({'error': 'Payment not found'}), 404
-    if request.method == 'GET':
-        result = {
-            'id': p.id,
-            'user_id': p.user_id,
-            'amount': p.amount,
-            'method': p.method,
-            'note': p.note,
-            'created_at': p.created_at.isoformat() if p.created_at else None
-        }
-        db.close()
-        return jsonify(result)
     if request.method == 'DELETE':
         db.delete(p)
         db.commit()
@@ -583,71 +707,52 @@ def api_create_payment():
     db.add(p)
     db.commit()
     db.refresh(p)
-    result = {
-        'id': p.id,
-        'user_id': p.user_id,
-        'amount': p.amount,
-        'method': p.method,
-        'note': p.note,
-        'created_at': p.created_at.isoformat() if p.created_at else None
-    }
+    result = serializers.to_dict(Payment, p)
     db.close()
-    return jsonify({'message': 'Payment created', 'payment': result}), 201
+    return json_response({'message': 'Payment created', 'payment': result}, 201)
 
 
 # --------- DASHBOARD STATUS ----------
 @app.route('/api/status')
 def api_status():
     db = SessionLocal()
-    users_count = db.query(User).count()
-    services_count = db.query(Service).count()
-    devices_count = db.query(DeviceRecord).count()
-    usages_count = db.query(APIUsage).count()
-    payments_sum = db.query(func.coalesce(func.sum(Payment.amount), 0.0)).scalar()
+    counters = stats_counters.read(db)
 
     # recent usages sample
-    recent_usages = db.query(APIUsage).order_by(APIUsage.created_at.desc()).limit(10).all()
-    recent = []
-    for u in recent_usages:
-        recent.append({
-            'id': u.id,
-            'user_id': u.user_id,
-            'service_id': u.service_id,
-            'imei': u.imei,
-            'success': bool(u.success),
-            'cost': u.cost,
-            'created_at': u.created_at.isoformat() if u.created_at else None
-        })
+    recent_usages = (db.query(*serializers.columns(APIUsage))
+                     .order_by(APIUsage.created_at.desc()).limit(10).all())
+    recent = serializers.rows_to_dicts(APIUsage, recent_usages)
     db.close()
-    return jsonify({
-        'users_count': users_count,
-        'services_count': services_count,
-        'devices_count': devices_count,
-        'usages_count': usages_count,
-        'payments_total': float(payments_sum or 0.0),
+    return json_response({
+        'users_count': int(counters['users_count']),
+        'services_count': int(counters['services_count']),
+        'devices_count': int(counters['devices_count']),
+        'usages_count': int(counters['usages_count']),
+        'payments_total': float(counters['payments_total']),
         'recent_usages': recent
     })
 
 
+@app.route('/api/admin/stats/reconcile', methods=['POST'])
+@api_admin_required
+def api_stats_reconcile():
+    return jsonify(stats_counters.reconcile(SessionLocal))
+
+
 # --------- ADDITIONAL HELPERS / FILTERED ENDPOINTS ----------
 @app.route('/api/devices/<int:device_id>', methods=['GET', 'PUT', 'DELETE'])
 def api_device_detail(device_id: int):
     db = SessionLocal()
+    if request.method == 'GET':
+        row = db.query(*serializers.columns(DeviceRecord)).filter(DeviceRecord.id == device_id).first()
+        db.close()
+        if not row:
+            return jsonify({'error': 'Device not found'}), 404
+        return json_response(serializers.row_to_dict(DeviceRecord, row))
     d = db.query(DeviceRecord).filter_by(id=device_id).first()
     if not d:
         db.close()
         return jsonify({'error': 'Device not found'}), 404
-    if request.method == 'GET':
-        result = {
-            'id': d.id,
-            'user_id': d.user_id,
-            'imei': d.imei,
-            'serial': d.serial,
-            'note': d.note,
-            'created_at': d.created_at.isoformat() if d.created_at else None
-        }
-        db.close()
-        return jsonify(result)
     if request.method == 'PUT':
         data = request.json
         if not data:
@@ -658,16 +763,9 @@ def api_device_detail(device_id: int):
                 setattr(d, field, data[field])
         db.commit()
         db.refresh(d)
-        res = {
-            'id': d.id,
-            'user_id': d.user_id,
-            'imei': d.imei,
-            'serial': d.serial,
-            'note': d.note,
-            'created_at': d.created_at.isoformat() if d.created_at else None
-        }
+        res = serializers.to_dict(DeviceRecord, d)
         db.close()
-        return jsonify({'message': 'Device updated', 'device': res})
+        return json_response({'message': 'Device updated', 'device': res})
     if request.method == 'DELETE':
         db.delete(d)
         db.commit()
@@ -678,225 +776,128 @@ def api_device_detail(device_id: int):
 @app.route('/api/usages/<int:usage_id>')
 def api_get_usage(usage_id: int):
     db = SessionLocal()
-    u = db.query(APIUsage).filter_by(id=usage_id).first()
-    if not u:
-        db.close()
-        return jsonify({'error': 'Usage not found'}), 404
-    result = {
-        'id': u.id,
-        'user_id': u.user_id,
-        'service_id': u.service_id,
-        'imei': u.imei,
-        'success': bool(u.success),
-        'cost': u.cost,
-        'created_at': u.created_at.isoformat() if u.created_at else None
-    }
+    row = db.query(*serializers.columns(APIUsage)).filter(APIUsage.id == usage_id).first()
     db.close()
-    return jsonify(result)
+    if not row:
+        return jsonify({'error': 'Usage not found'}), 404
+    return json_response(serializers.row_to_dict(APIUsage, row))
 
 
 @app.route('/api/users/<int:user_id>/usages')
 def api_get_user_usages(user_id: int):
     db = SessionLocal()
-    usages = db.query(APIUsage).filter_by(user_id=user_id).order_by(APIUsage.created_at.desc()).limit(500).all()
-    result = []
-    for u in usages:
-        result.append({
-            'id': u.id,
-            'user_id': u.user_id,
-            'service_id': u.service_id,
-            'imei': u.imei,
-            'success': bool(u.success),
-            'cost': u.cost,
-            'created_at': u.created_at.isoformat() if u.created_at else None
-        })
+    rows, next_cursor = _list_page(db.query(*serializers.columns(APIUsage)).filter(APIUsage.user_id == user_id), APIUsage)
     db.close()
-    return jsonify(result)
+    return json_response({'items': serializers.rows_to_dicts(APIUsage, rows), 'next_cursor': next_cursor})
 
 
 @app.route('/api/users/<int:user_id>/payments')
 def api_get_user_payments(user_id: int):
     db = SessionLocal()
-    payments = db.query(Payment).filter_by(user_id=user_id).order_by(Payment.created_at.desc()).all()
-    result = []
-    for p in payments:
-        result.append({
-            'id': p.id,
-            'user_id': p.user_id,
-            'amount': p.amount,
-            'method': p.method,
-            'note': p.note,
-            'created_at': p.created_at.isoformat() if p.created_at else None
-        })
+    rows, next_cursor = _list_page(db.query(*serializers.columns(Payment)).filter(Payment.user_id == user_id), Payment)
     db.close()
-    return jsonify(result)
+    return json_response({'items': serializers.rows_to_dicts(Payment, rows), 'next_cursor': next_cursor})
 
 
 @app.route('/api/services/code/<string:code>')
 def api_get_service_by_code(code: str):
-    db = SessionLocal()
-    svc = db.query(Service).filter_by(code=code).first()
+    snap = catalog.snapshot()
+    svc = snap.by_code.get(code)
     if not svc:
-        db.close()
         return jsonify({'error': 'Service not found'}), 404
-    result = {
-        'id': svc.id,
-        'code': svc.code,
-        'name': svc.name,
-        'description': svc.description,
-        'api_url': svc.api_url,
-        'api_key': svc.api_key,
-        'is_public': bool(svc.is_public),
-        'group': svc.group
-    }
-    db.close()
-    return jsonify(result)
+    return _catalog_response(snap, svc.to_dict())
 
 
 # =========================================
 # /api/lookup endpoint – now calls REAL provider APIs correctly
 # =========================================
+@app.errorhandler(LookupRejected)
+def handle_lookup_rejected(e):
+    return jsonify({'error': str(e)}), e.status
+
+
 @app.route("/api/lookup", methods=["POST"])
 def api_lookup_flask():
     data = request.json
-    user_id = data.get("user_id")
-    service_code = data.get("service")
-    imei = data.get("imei")
-
-    db = SessionLocal()
-
-    # ----------------------------
-    # USER HANDLING
-    # ----------------------------
-    username = data.get("username")
-    user = db.query(User).filter_by(telegram_id=user_id).first()
-
-    if not user:
-        user = User(
-            telegram_id=user_id,
-            username=username,
-            free_calls=10,
-            paid_calls=0,
-            registered=True
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+    outcome = lookups.lookup(data.get("user_id"), data.get("service"), data.get("imei"),
+                             username=data.get("username"))
+    if outcome.success:
+        response = jsonify(outcome.result)
+        response.headers['X-Cache'] = outcome.source
+        return response
     else:
-        if username and username != user.username:
-            user.username = username
-            db.commit()
-
-    # ----------------------------
-    # SERVICE LOOKUP
-    # ----------------------------
-    svc = db.query(Service).filter_by(code=service_code).first()
-    if not svc:
-        db.close()
-        return jsonify({"error": "Service not found"}), 404
-
-    # QUOTA
-    if user.free_calls <= 0:
-        db.close()
-        return jsonify({"error": "No free calls left"}), 403
-
-    # ----------------------------
-    # CALL REAL IMEI PROVIDER API
-    # ----------------------------
-    success = False
-    service_result = None
-    error_msg = None
-
-    # ----------------------------
-    # CALL REAL IMEI PROVIDER API
-    # ----------------------------
-    success = False
-    service_result = None
-    error_msg = None
-
-    # Prepare payload and headers
-    params = {"imei": imei}
-    headers = {
-        "User-Agent": "TGService/1.0",
-        "Accept": "application/json"
-    }
+        return jsonify({"error": outcome.error}), 200
 
-    if svc.api_key:
-        params["apikey"] = svc.api_key
-        params["key"] = svc.api_key
-        params["token"] = svc.api_key
-        headers["Authorization"] = f"Bearer {svc.api_key}"
-        headers["key"] = svc.api_key
+# =========================================
+# /api/lookup/batch – many IMEIs (x services), streamed as NDJSON
+# =========================================
+@app.route("/api/lookup/batch", methods=["POST"])
+def api_lookup_batch():
+    data = request.json
+    if not data:
+        return jsonify({"error": "Missing JSON data"}), 400
 
-    try:
-        # Default to POST for known services or if explicitly needed
-        # Since we don't have a method field, we'll try to infer or default to POST for these providers
-        if "imei.info" in svc.api_url or "imeicheck.net" in svc.api_url:
-             response = requests.post(svc.api_url, json=params, headers=headers, timeout=30)
-        else:
-             # Default to GET for others
-             response = requests.get(svc.api_url, params=params, headers=headers, timeout=30)
-        
-        # Check if we got a valid response
-        if response.status_code == 405: # Method Not Allowed -> Try the other one
-             if "imei.info" in svc.api_url or "imeicheck.net" in svc.api_url:
-                 response = requests.get(svc.api_url, params=params, headers=headers, timeout=30)
-             else:
-                 response = requests.post(svc.api_url, json=params, headers=headers, timeout=30)
-
-        response.raise_for_status()
+    telegram_id = data.get("user_id")
+    imeis = data.get("imeis") or []
+    codes = data.get("services") or ([data["service"]] if data.get("service") else [])
+    if not telegram_id or not imeis or not codes:
+        return jsonify({"error": "Missing required fields: user_id, imeis, service(s)"}), 400
+    if not isinstance(imeis, list) or not all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in imeis):
+        return jsonify({"error": "imeis must be a list of strings"}), 400
+    if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
+        return jsonify({"error": "services must be a list of service codes"}), 400
+
+    # de-duplicate while keeping the caller's order
+    imeis = list(dict.fromkeys(str(i).strip() for i in imeis if str(i).strip()))
+    codes = list(dict.fromkeys(codes))
+    total = len(imeis) * len(codes)
+    if total > LOOKUP_BATCH_MAX:
+        return jsonify({"error": f"Batch too large ({total} lookups, max {LOOKUP_BATCH_MAX})"}), 400
+
+    snap = catalog.snapshot()
+    missing = sorted(code for code in codes if code not in snap.by_code)
+    if missing:
+        return jsonify({"error": "Service not found", "services": missing}), 404
 
-        try:
-            service_result = response.json()
-            success = True
-            
-            # Check for common API error fields in 200 OK responses
-            if isinstance(service_result, dict):
-                if "error" in service_result and service_result["error"]:
-                    success = False
-                    error_msg = str(service_result["error"])
-                elif "status" in service_result and service_result["status"] == "failed":
-                    success = False
-                    error_msg = service_result.get("message", "Unknown error")
-
-        except ValueError:
-            error_msg = "Provider returned invalid JSON: " + response.text[:100]
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Provider API call failed: {str(e)}"
-
-    # ----------------------------
-    # QUOTA REDUCTION (only on success)
-    # ----------------------------
-    if success and user.free_calls > 0:
-        user.free_calls -= 1
-
-    # ----------------------------
-    # SAVE USAGE + DEVICE
-    # ----------------------------
-    usage = APIUsage(
-        user_id=user.id,
-        service_id=svc.id,
-        imei=imei,
-        success=success,
-        cost=0.0
-    )
-
-    device = db.query(DeviceRecord).filter_by(user_id=user.id, imei=imei).first()
-    if not device:
-        device = DeviceRecord(user_id=user.id, imei=imei)
+    db = SessionLocal()
+    user = get_or_create_user(db, telegram_id, data.get("username"))
 
-    db.add(usage)
-    db.add(device)
-    db.commit()
+    # QUOTA – reserved once for the whole batch, unused calls are refunded at the end
+    reservation = quota.reserve_calls(db, user.id, total)
     db.close()
+    if reservation is None:
+        return jsonify({"error": f"Not enough calls left for batch (need {total})"}), 403
 
-    # ----------------------------
-    # RETURN RESULT
-    # ----------------------------
-    if success:
-        return jsonify(service_result)
-    else:
-        return jsonify({"error": error_msg}), 200
+    jobs = [(snap.by_code[code], imei) for code in codes for imei in imeis]
+    user_id = user.id
+
+    def generate():
+        records = []
+        futures = {batch_pool.submit(lookups.lookup_one, svc, imei): (svc, imei) for svc, imei in jobs}
+        try:
+            for fut in as_completed(futures):
+                svc, imei = futures[fut]
+                try:
+                    success, service_result, error_msg, source = fut.result()
+                except Exception as e:
+                    success, service_result, error_msg, source = False, None, f"Lookup failed: {e}", 'MISS'
+                records.append((svc.id, imei, success, source))
+                line = {"service": svc.code, "imei": imei, "success": success, "cache": source}
+                if success:
+                    line["result"] = service_result
+                else:
+                    line["error"] = error_msg
+                yield json.dumps(line, default=str) + "\n"
+        finally:
+            # also runs when the client disconnects: keep what was already done
+            for fut in futures:
+                fut.cancel()
+            charged = lookups.save_batch(user_id, records, reservation)
+        succeeded = sum(1 for r in records if r[2])
+        yield json.dumps({"summary": {"total": total, "succeeded": succeeded,
+                                      "failed": len(records) - succeeded, "charged": charged}}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
 
 # ============================================================
 # RUN FLASK
@@ -0,0 +1,25 @@
+import React from 'react';
+
+interface LoadMoreProps {
+  hasMore: boolean;
+  loading: boolean;
+  onClick: () => void;
+  error?: string | null;
+}
+
+export const LoadMore: React.FC<LoadMoreProps> = ({ hasMore, loading, onClick, error }) => {
+  if (error) return <div className="p-4 text-center text-sm text-red-600">{error}</div>;
+  if (!hasMore && !loading) return null;
+
+  return (
+    <div className="p-4 flex justify-center">
+      <button
+        onClick={onClick}
+        disabled={loading}
+        className="px-4 py-1.5 border border-slate-300 rounded bg-white text-slate-600 text-sm hover:bg-slate-50 disabled:text-slate-400"
+      >
+        {loading ? 'Loading…' : 'Load more'}
+      </button>
+    </div>
+  );
+};
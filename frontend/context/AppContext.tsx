@@ -1,22 +1,16 @@
 
 import React, { createContext, useContext, useState, ReactNode, useEffect } from 'react';
-import { User, Service, DeviceRecord, APIUsage, Payment } from '../types';
+import { Service } from '../types';
 import api from '../services/api';
 
+// Only the (small) service catalog lives here. Users, devices, usage and payments
+// are paginated and loaded by the pages that show them (hooks/usePagedList).
 interface AppContextType {
-  users: User[];
   services: Service[];
-  devices: DeviceRecord[];
-  usage: APIUsage[];
-  payments: Payment[];
   isAuthenticated: boolean;
-  addUser: (user: User) => void;
-  updateUser: (user: User) => void;
-  deleteUser: (id: string) => void;
   addService: (service: Service) => void;
   updateService: (service: Service) => void;
   deleteService: (id: string) => void;
-  addPayment: (payment: Payment) => void;
   login: (email: string, password: string) => Promise<boolean>;
   logout: () => void;
 }
@@ -29,12 +23,7 @@ export const AppProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
   const [isAuthenticated, setIsAuthenticated] = useState<boolean>(false);
 
   // Data state
-  // start with empty arrays; we'll load real data from the backend
-  const [users, setUsers] = useState<User[]>([]);
   const [services, setServices] = useState<Service[]>([]);
-  const [devices, setDevices] = useState<DeviceRecord[]>([]);
-  const [usage, setUsage] = useState<APIUsage[]>([]);
-  const [payments, setPayments] = useState<Payment[]>([]);
 
   // Check for persisted session on mount
   useEffect(() => {
@@ -42,23 +31,13 @@ export const AppProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
     if (storedAuth === 'true') {
       setIsAuthenticated(true);
     }
-    // Fetch initial data from backend (services, users, devices, usage, payments)
+    // Fetch the service catalog from the backend
     (async () => {
       try {
-        const [svcs, usrs, devs, usg, pays] = await Promise.all([
-          api.getServices().catch((e) => { console.error('svc err', e); return [] as Service[] }),
-          api.getUsers().catch((e) => { console.error('users err', e); return [] as User[] }),
-          api.getDevices().catch((e) => { console.error('devices err', e); return [] as DeviceRecord[] }),
-          api.getUsages().catch((e) => { console.error('usage err', e); return [] as any[] }),
-          api.getPayments().catch((e) => { console.error('payments err', e); return [] as Payment[] })
-        ]);
-  if (svcs && svcs.length) setServices(svcs.map(s => ({ ...s, id: String((s as any).id) })));
-  if (usrs && usrs.length) setUsers(usrs.map(u => ({ ...u, id: String((u as any).id), telegram_id: String((u as any).telegram_id) })));
-  if (devs && devs.length) setDevices(devs.map(d => ({ ...d, id: String((d as any).id), user_id: String((d as any).user_id) })));
-  if (usg && usg.length) setUsage((usg as any[]).map(u => ({ ...u, id: String((u as any).id), user_id: String((u as any).user_id), service_id: String((u as any).service_id) })) as APIUsage[]);
-  if (pays && pays.length) setPayments(pays.map(p => ({ ...p, id: String((p as any).id), user_id: p.user_id ? String((p as any).user_id) : p.user_id })));
+        const svcs = await api.getServices();
+        if (svcs && svcs.length) setServices(svcs.map(s => ({ ...s, id: String((s as any).id) })));
       } catch (e) {
-        console.error('Failed to fetch initial data', e);
+        console.error('Failed to fetch services', e);
       }
     })();
   }, []);
@@ -90,36 +69,6 @@ export const AppProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
     localStorage.removeItem('admin_nexus_auth');
   };
 
-  const addUser = (user: User) => {
-    // Creating users via the API is not currently implemented on backend.
-    // For now, add locally and log a warning. If you want real-user create support,
-    // we can add POST /api/users on the backend and call it from here.
-    console.warn('addUser: user creation via API is not implemented; adding locally');
-    setUsers(prev => [...prev, user]);
-  };
-
-  const updateUser = (updatedUser: User) => {
-    const id: any = (updatedUser as any).id;
-    api.updateUser(id, updatedUser as Partial<User>)
-      .then(() => setUsers(prev => prev.map(u => u.id === updatedUser.id ? updatedUser : u)))
-      .catch((err) => {
-        console.error('Failed to update user', err);
-        // fallback to local update
-        setUsers(prev => prev.map(u => u.id === updatedUser.id ? updatedUser : u));
-      });
-  };
-
-  const deleteUser = (id: string) => {
-    const anyId: any = id;
-    api.deleteUser(anyId)
-      .then(() => setUsers(prev => prev.filter(u => u.id !== id)))
-      .catch((err) => {
-        console.error('Failed to delete user', err);
-        // fallback: remove locally
-        setUsers(prev => prev.filter(u => u.id !== id));
-      });
-  };
-
   // addService will attempt to persist to backend, then update local state.
   const addService = (service: Service) => {
     // fire-and-forget to preserve synchronous signature used in UI code
@@ -160,40 +109,13 @@ export const AppProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
       });
   };
 
-  const addPayment = (payment: Payment) => {
-    // persist payment to backend then update local list
-    api.createPayment(payment as Partial<Payment>)
-      .then((res) => {
-        // Normalize backend-created payment IDs (may be numeric) to strings
-        const createdRaw = res && (res as any).payment ? (res as any).payment as any : payment as any;
-        const created: Payment = {
-          ...createdRaw,
-          id: createdRaw.id !== undefined ? String(createdRaw.id) : String(`p${Date.now()}`),
-          user_id: createdRaw.user_id !== undefined && createdRaw.user_id !== null ? String(createdRaw.user_id) : createdRaw.user_id,
-        } as Payment;
-        setPayments(prev => [created, ...prev]);
-      })
-      .catch((err) => {
-        console.error('Failed to create payment', err);
-        setPayments(prev => [payment, ...prev]);
-      });
-  };
-
   return (
     <AppContext.Provider value={{
-      users,
       services,
-      devices,
-      usage,
-      payments,
       isAuthenticated,
-      addUser,
-      updateUser,
-      deleteUser,
       addService,
       updateService,
       deleteService,
-      addPayment,
       login,
       logout
     }}>
@@ -0,0 +1,54 @@
+import { useCallback, useEffect, useRef, useState } from 'react';
+import { ListParams, Page } from '../services/api';
+
+// One keyset-paginated list: the first page is fetched on mount (and again when
+// `params` change), loadMore() appends the next one. Only what the admin asks
+// for is downloaded. `fetchPage` must be a stable (module-level) function;
+// `params` of null leaves the list empty until there is something to fetch.
+export function usePagedList<T>(
+  fetchPage: (params?: ListParams) => Promise<Page<T>>,
+  params: ListParams | null = {},
+  pageSize = 50,
+) {
+  const [items, setItems] = useState<T[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loading, setLoading] = useState(false);
+  const [error, setError] = useState<string | null>(null);
+  // responses for an older `params` value are dropped
+  const generation = useRef(0);
+  const paramsKey = JSON.stringify(params);
+
+  const load = useCallback(async (cursor?: string) => {
+    if (paramsKey === 'null') return;
+    const gen = generation.current;
+    setLoading(true);
+    try {
+      const page = await fetchPage({ ...JSON.parse(paramsKey), limit: pageSize, cursor });
+      if (gen !== generation.current) return;
+      setItems(prev => (cursor ? [...prev, ...page.items] : page.items));
+      setNextCursor(page.next_cursor);
+      setError(null);
+    } catch (e: any) {
+      if (gen === generation.current) setError(e?.message || 'Failed to load');
+    } finally {
+      if (gen === generation.current) setLoading(false);
+    }
+  }, [fetchPage, paramsKey, pageSize]);
+
+  const reload = useCallback(() => {
+    generation.current += 1;
+    setNextCursor(null);
+    load();
+  }, [load]);
+
+  useEffect(() => {
+    setItems([]);
+    reload();
+  }, [reload]);
+
+  const loadMore = () => {
+    if (nextCursor && !loading) load(nextCursor);
+  };
+
+  return { items, setItems, hasMore: nextCursor !== null, loading, error, loadMore, reload };
+}
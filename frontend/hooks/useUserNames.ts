@@ -0,0 +1,44 @@
+import { useEffect, useState } from 'react';
+import { User } from '../types';
+import api from '../services/api';
+
+// Users referenced by the rows on screen, fetched by id on demand and cached for
+// the session (lists no longer carry the whole users table around).
+const cache = new Map<string, User | null>();
+const pending = new Map<string, Promise<void>>();
+
+function fetchUser(id: string): Promise<void> {
+  let p = pending.get(id);
+  if (!p) {
+    p = api.getUserById(id)
+      .then(u => { cache.set(id, u); })
+      .catch(() => { cache.set(id, null); })
+      .finally(() => { pending.delete(id); });
+    pending.set(id, p);
+  }
+  return p;
+}
+
+export function useUserNames(ids: (string | null | undefined)[]) {
+  const [, setVersion] = useState(0);
+  const key = Array.from(new Set(ids.filter((id): id is string => !!id && id !== 'null'))).sort().join(',');
+
+  useEffect(() => {
+    const missing = key ? key.split(',').filter(id => !cache.has(id)) : [];
+    if (!missing.length) return;
+    let active = true;
+    Promise.all(missing.map(fetchUser)).then(() => { if (active) setVersion(v => v + 1); });
+    return () => { active = false; };
+  }, [key]);
+
+  return (id: string | null | undefined): User | undefined => (id ? cache.get(id) || undefined : undefined);
+}
+
+// Keep the cache in step with edits made on the Users page.
+export function rememberUser(user: User) {
+  cache.set(user.id, user);
+}
+
+export function forgetUser(id: string) {
+  cache.set(id, null);
+}
@@ -1,5 +1,5 @@
 
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { 
   BarChart, 
   Bar, 
@@ -14,12 +14,36 @@ import {
 import { Users, Activity, CreditCard, ArrowUpRight, ArrowDownRight } from 'lucide-react';
 import { DAILY_STATS_DATA } from '../constants';
 import { useApp } from '../context/AppContext';
+import { getUsageStats, getStatus, getPaymentsPage } from '../services/api';
+import { Payment } from '../types';
 
 export const Dashboard: React.FC = () => {
-  const { users, usage, payments, services } = useApp();
+  const { services } = useApp();
 
-  const totalRevenue = payments.reduce((sum, p) => sum + p.amount, 0);
-  const totalCalls = usage.length;
+  // totals come from the server-side stats counters; only the latest payments are fetched
+  const [totals, setTotals] = useState({ users: 0, calls: 0, revenue: 0 });
+  const [recentPayments, setRecentPayments] = useState<Payment[]>([]);
+  useEffect(() => {
+    getStatus()
+      .then(s => setTotals({ users: s.users_count, calls: s.usages_count, revenue: s.payments_total }))
+      .catch(() => {});
+    getPaymentsPage({ limit: 4 })
+      .then(page => setRecentPayments(page.items))
+      .catch(() => {});
+  }, []);
+
+  // last 30 days from the server-side daily rollups; the sample data stays as a fallback
+  const [dailyStats, setDailyStats] = useState(DAILY_STATS_DATA);
+  useEffect(() => {
+    const from = new Date(Date.now() - 30 * 24 * 3600 * 1000).toISOString().slice(0, 10);
+    getUsageStats({ granularity: 'day', from })
+      .then(points => {
+        if (points.length) {
+          setDailyStats(points.map(p => ({ name: p.bucket.slice(5, 10), calls: p.total, cost: p.cost })));
+        }
+      })
+      .catch(() => {});
+  }, []);
   
   const MetricCard = ({ title, value, subValue, icon: Icon, trend }: any) => (
     <div className="bg-white p-6 rounded-xl border border-slate-200 shadow-sm">
@@ -57,21 +81,21 @@ export const Dashboard: React.FC = () => {
       <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-4 gap-6">
         <MetricCard 
           title="Total Users" 
-          value={users.length} 
+          value={totals.users} 
           subValue="+12%" 
           icon={Users} 
           trend="up" 
         />
         <MetricCard 
           title="Total Revenue" 
-          value={`$${totalRevenue.toFixed(2)}`} 
+          value={`$${totals.revenue.toFixed(2)}`} 
           subValue="+8.2%" 
           icon={CreditCard} 
           trend="up" 
         />
         <MetricCard 
           title="API Calls" 
-          value={totalCalls} 
+          value={totals.calls} 
           subValue="98.5% Success" 
           icon={Activity} 
           trend="up" 
@@ -90,7 +114,7 @@ export const Dashboard: React.FC = () => {
           <h3 className="text-lg font-bold text-slate-900 mb-4">Daily API Usage</h3>
           <div className="h-72">
             <ResponsiveContainer width="100%" height="100%">
-              <AreaChart data={DAILY_STATS_DATA}>
+              <AreaChart data={dailyStats}>
                 <defs>
                   <linearGradient id="colorCalls" x1="0" y1="0" x2="0" y2="1">
                     <stop offset="5%" stopColor="#4f46e5" stopOpacity={0.3}/>
@@ -110,7 +134,7 @@ export const Dashboard: React.FC = () => {
         <div className="bg-white p-6 rounded-xl border border-slate-200 shadow-sm">
           <h3 className="text-lg font-bold text-slate-900 mb-4">Recent Payments</h3>
           <div className="space-y-4">
-            {payments.slice(0, 4).map(payment => (
+            {recentPayments.map(payment => (
               <div key={payment.id} className="flex items-center justify-between p-3 bg-slate-50 rounded-lg">
                 <div className="flex items-center space-x-3">
                   <div className="w-8 h-8 rounded-full bg-green-100 flex items-center justify-center text-green-600">
@@ -124,7 +148,7 @@ export const Dashboard: React.FC = () => {
                 <span className="text-xs text-slate-400">{new Date(payment.created_at).toLocaleDateString()}</span>
               </div>
             ))}
-            {payments.length === 0 && (
+            {recentPayments.length === 0 && (
                <p className="text-sm text-slate-500 text-center py-4">No payments yet.</p>
             )}
           </div>
@@ -1,10 +1,14 @@
 
 import React, { useState } from 'react';
 import { Search, Smartphone } from 'lucide-react';
-import { useApp } from '../context/AppContext';
+import { getDevicesPage } from '../services/api';
+import { usePagedList } from '../hooks/usePagedList';
+import { useUserNames } from '../hooks/useUserNames';
+import { LoadMore } from '../components/LoadMore';
 
 export const DevicesPage: React.FC = () => {
-  const { devices, users } = useApp();
+  const { items: devices, hasMore, loading, error, loadMore } = usePagedList(getDevicesPage);
+  const userFor = useUserNames(devices.map(d => d.user_id));
   const [searchTerm, setSearchTerm] = useState('');
 
   const filteredDevices = devices.filter(d => 
@@ -34,7 +38,7 @@ export const DevicesPage: React.FC = () => {
       <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
         {filteredDevices.length > 0 ? (
           filteredDevices.map(device => {
-            const user = users.find(u => u.id === device.user_id);
+            const user = userFor(device.user_id);
             return (
               <div key={device.id} className="bg-white border border-slate-200 rounded-xl p-4 shadow-sm flex items-start space-x-4">
                 <div className="p-3 bg-slate-100 text-slate-600 rounded-lg">
@@ -68,6 +72,7 @@ export const DevicesPage: React.FC = () => {
           </div>
         )}
       </div>
+      <LoadMore hasMore={hasMore} loading={loading} onClick={loadMore} error={error} />
     </div>
   );
 };
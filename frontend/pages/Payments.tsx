@@ -3,22 +3,42 @@ import React, { useState } from 'react';
 import { Plus, DollarSign, Download } from 'lucide-react';
 import { Payment } from '../types';
 import { Modal } from '../components/Modal';
-import { useApp } from '../context/AppContext';
+import api, { getPaymentsPage, getUsersPage, normalizePayment } from '../services/api';
+import { usePagedList } from '../hooks/usePagedList';
+import { useUserNames } from '../hooks/useUserNames';
+import { LoadMore } from '../components/LoadMore';
 
 export const PaymentsPage: React.FC = () => {
-  const { payments, users, addPayment } = useApp();
+  const { items: payments, setItems: setPayments, hasMore, loading, error, loadMore } = usePagedList(getPaymentsPage);
+  const userFor = useUserNames(payments.map(p => p.user_id));
+  // the user picker pages through users on its own
+  const userList = usePagedList(getUsersPage);
+  const users = userList.items;
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [amount, setAmount] = useState('');
   const [method, setMethod] = useState<Payment['method']>('Credit Card');
   const [note, setNote] = useState('');
-  const [userId, setUserId] = useState(users.length > 0 ? users[0].id : '');
+  const [userId, setUserId] = useState('');
+  const selectedUserId = userId || (users.length > 0 ? users[0].id : '');
+
+  const addPayment = (payment: Payment) => {
+    api.createPayment(payment as Partial<Payment>)
+      .then((res) => {
+        const created = res && (res as any).payment ? normalizePayment((res as any).payment) : payment;
+        setPayments(prev => [created, ...prev]);
+      })
+      .catch((err) => {
+        console.error('Failed to create payment', err);
+        setPayments(prev => [payment, ...prev]);
+      });
+  };
 
   const handleAddPayment = () => {
-    if (!amount || !userId) return;
+    if (!amount || !selectedUserId) return;
 
     const newPayment: Payment = {
       id: `p${Date.now()}`,
-      user_id: userId,
+      user_id: selectedUserId,
       amount: parseFloat(amount),
       method: method,
       note: note,
@@ -30,7 +50,7 @@ export const PaymentsPage: React.FC = () => {
     setAmount('');
     setNote('');
     // Reset to first user if exists
-    if (users.length > 0) setUserId(users[0].id);
+    setUserId('');
   };
 
   return (
@@ -65,7 +85,7 @@ export const PaymentsPage: React.FC = () => {
             </thead>
             <tbody>
               {payments.map((payment) => {
-                const user = users.find(u => u.id === payment.user_id);
+                const user = userFor(payment.user_id);
                 return (
                   <tr key={payment.id} className="bg-white border-b border-slate-100 hover:bg-slate-50">
                     <td className="px-6 py-4 font-mono text-xs text-slate-500">
@@ -102,6 +122,9 @@ export const PaymentsPage: React.FC = () => {
             </tbody>
           </table>
         </div>
+        <div className="border-t border-slate-200 bg-slate-50">
+          <LoadMore hasMore={hasMore} loading={loading} onClick={loadMore} error={error} />
+        </div>
       </div>
 
       <Modal
@@ -114,11 +137,21 @@ export const PaymentsPage: React.FC = () => {
              <label className="block text-sm font-medium text-slate-700 mb-1">Select User</label>
              <select 
                className="w-full px-3 py-2 border border-slate-300 rounded-lg focus:ring-indigo-500"
-               value={userId}
+               value={selectedUserId}
                onChange={e => setUserId(e.target.value)}
              >
                {users.map(u => <option key={u.id} value={u.id}>{u.username} ({u.telegram_id})</option>)}
              </select>
+             {userList.hasMore && (
+               <button
+                 type="button"
+                 onClick={userList.loadMore}
+                 disabled={userList.loading}
+                 className="mt-1 text-xs text-indigo-600 hover:underline disabled:text-slate-400"
+               >
+                 {userList.loading ? 'Loading…' : 'Load more users'}
+               </button>
+             )}
           </div>
           <div>
             <label className="block text-sm font-medium text-slate-700 mb-1">Amount ($)</label>
@@ -1,12 +1,30 @@
 
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Plus, MoreVertical, Globe, Lock, Activity, DollarSign, BarChart2, Edit2, Trash2, X } from 'lucide-react';
 import { Service } from '../types';
 import { Modal } from '../components/Modal';
 import { useApp } from '../context/AppContext';
+import { getUsageStats } from '../services/api';
 
 export const ServicesPage: React.FC = () => {
-  const { services, usage, addService, updateService, deleteService } = useApp();
+  const { services, addService, updateService, deleteService } = useApp();
+  // per-service totals from the daily rollups instead of the raw usage rows
+  const [serviceStats, setServiceStats] = useState<Record<string, { total: number; success: number; cost: number }>>({});
+  useEffect(() => {
+    getUsageStats({ granularity: 'day', group_by: 'service' })
+      .then(points => {
+        const byService: Record<string, { total: number; success: number; cost: number }> = {};
+        for (const p of points) {
+          const key = String(p.service_id);
+          const acc = byService[key] || (byService[key] = { total: 0, success: 0, cost: 0 });
+          acc.total += p.total;
+          acc.success += p.success;
+          acc.cost += p.cost;
+        }
+        setServiceStats(byService);
+      })
+      .catch(() => {});
+  }, []);
   const [revealedKeyId, setRevealedKeyId] = useState<string | null>(null);
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [isEditMode, setIsEditMode] = useState(false);
@@ -72,10 +90,10 @@ export const ServicesPage: React.FC = () => {
 
       <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
         {services.map((service) => {
-          const serviceUsage = usage.filter(u => u.service_id === service.id);
-          const totalCalls = serviceUsage.length;
-          const totalRevenue = serviceUsage.reduce((acc, curr) => acc + curr.cost, 0);
-          const successCount = serviceUsage.filter(u => u.success).length;
+          const stats = serviceStats[service.id] || { total: 0, success: 0, cost: 0 };
+          const totalCalls = stats.total;
+          const totalRevenue = stats.cost;
+          const successCount = stats.success;
           const successRate = totalCalls > 0 ? Math.round((successCount / totalCalls) * 100) : 0;
 
           return (
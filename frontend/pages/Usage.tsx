@@ -1,10 +1,41 @@
 
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { CheckCircle, XCircle } from 'lucide-react';
 import { useApp } from '../context/AppContext';
+import { getUsageStats, getUsagesPage } from '../services/api';
+import { usePagedList } from '../hooks/usePagedList';
+import { useUserNames } from '../hooks/useUserNames';
+import { LoadMore } from '../components/LoadMore';
+
+interface UsageSummary {
+  total: number;
+  success: number;
+  cost: number;
+}
 
 export const UsagePage: React.FC = () => {
-  const { usage, users, services } = useApp();
+  const { services } = useApp();
+  const [serviceId, setServiceId] = useState('');
+  const [status, setStatus] = useState('');
+
+  // 30-day totals from the server-side daily rollups (follows the service filter)
+  const [summary, setSummary] = useState<UsageSummary | null>(null);
+  useEffect(() => {
+    const from = new Date(Date.now() - 30 * 24 * 3600 * 1000).toISOString().slice(0, 10);
+    getUsageStats({ granularity: 'day', from, service_id: serviceId || undefined })
+      .then(points => setSummary(points.reduce(
+        (acc, p) => ({ total: acc.total + p.total, success: acc.success + p.success, cost: acc.cost + p.cost }),
+        { total: 0, success: 0, cost: 0 }
+      )))
+      .catch(() => setSummary(null));
+  }, [serviceId]);
+
+  // newest calls first, one page at a time; filters are applied by the server
+  const { items: rows, hasMore, loading, error, loadMore } = usePagedList(getUsagesPage, {
+    service_id: serviceId || undefined,
+    success: status ? status === 'success' : undefined,
+  });
+  const userFor = useUserNames(rows.map(u => u.user_id));
 
   return (
     <div className="space-y-6">
@@ -13,21 +44,48 @@ export const UsagePage: React.FC = () => {
         <p className="text-slate-500">Monitor API calls, success rates, and costs.</p>
       </div>
 
+      {summary && (
+        <div className="grid grid-cols-1 sm:grid-cols-3 gap-4">
+          <div className="bg-white p-4 rounded-xl border border-slate-200 shadow-sm">
+            <p className="text-sm font-medium text-slate-500">Calls (30 days)</p>
+            <h3 className="text-xl font-bold text-slate-900 mt-1">{summary.total.toLocaleString()}</h3>
+          </div>
+          <div className="bg-white p-4 rounded-xl border border-slate-200 shadow-sm">
+            <p className="text-sm font-medium text-slate-500">Success rate</p>
+            <h3 className="text-xl font-bold text-slate-900 mt-1">
+              {summary.total ? `${((summary.success / summary.total) * 100).toFixed(1)}%` : '–'}
+            </h3>
+          </div>
+          <div className="bg-white p-4 rounded-xl border border-slate-200 shadow-sm">
+            <p className="text-sm font-medium text-slate-500">Cost (30 days)</p>
+            <h3 className="text-xl font-bold text-slate-900 mt-1">${summary.cost.toFixed(2)}</h3>
+          </div>
+        </div>
+      )}
+
       <div className="bg-white border border-slate-200 rounded-xl overflow-hidden shadow-sm">
         <div className="p-4 border-b border-slate-200 bg-slate-50 flex flex-col sm:flex-row sm:items-center justify-between gap-4">
           <div className="flex gap-2">
-             <select className="px-3 py-1.5 bg-white border border-slate-300 rounded text-sm text-slate-600 focus:outline-none">
-               <option>All Services</option>
+             <select
+               value={serviceId}
+               onChange={(e) => setServiceId(e.target.value)}
+               className="px-3 py-1.5 bg-white border border-slate-300 rounded text-sm text-slate-600 focus:outline-none"
+             >
+               <option value="">All Services</option>
                {services.map(s => <option key={s.id} value={s.id}>{s.name}</option>)}
              </select>
-             <select className="px-3 py-1.5 bg-white border border-slate-300 rounded text-sm text-slate-600 focus:outline-none">
-               <option>All Status</option>
-               <option>Success</option>
-               <option>Failed</option>
+             <select
+               value={status}
+               onChange={(e) => setStatus(e.target.value)}
+               className="px-3 py-1.5 bg-white border border-slate-300 rounded text-sm text-slate-600 focus:outline-none"
+             >
+               <option value="">All Status</option>
+               <option value="success">Success</option>
+               <option value="failed">Failed</option>
              </select>
           </div>
           <div className="text-sm text-slate-500">
-            Showing last {usage.length} calls
+            Showing last {rows.length} calls
           </div>
         </div>
         <div className="overflow-x-auto">
@@ -43,8 +101,8 @@ export const UsagePage: React.FC = () => {
               </tr>
             </thead>
             <tbody>
-              {usage.map((usageItem) => {
-                const user = users.find(u => u.id === usageItem.user_id);
+              {rows.map((usageItem) => {
+                const user = userFor(usageItem.user_id);
                 const service = services.find(s => s.id === usageItem.service_id);
                 return (
                   <tr key={usageItem.id} className="bg-white border-b border-slate-100 hover:bg-slate-50 transition-colors">
@@ -82,12 +140,8 @@ export const UsagePage: React.FC = () => {
             </tbody>
           </table>
         </div>
-        <div className="p-4 border-t border-slate-200 bg-slate-50 flex justify-between items-center">
-            <div className="text-sm text-slate-500">Page 1 of 1</div>
-            <div className="flex gap-1">
-                <button className="px-3 py-1 border border-slate-300 rounded bg-white text-slate-400 text-sm" disabled>Prev</button>
-                <button className="px-3 py-1 border border-slate-300 rounded bg-white text-slate-600 text-sm hover:bg-slate-50">Next</button>
-            </div>
+        <div className="border-t border-slate-200 bg-slate-50">
+          <LoadMore hasMore={hasMore} loading={loading} onClick={loadMore} error={error} />
         </div>
       </div>
     </div>
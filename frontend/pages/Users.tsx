@@ -4,9 +4,14 @@ import { Eye, Edit2, Trash2, Search, Filter } from 'lucide-react';
 import { User } from '../types';
 import { Modal } from '../components/Modal';
 import { useApp } from '../context/AppContext';
+import api, { getUsersPage, getDevicesPage, getUsagesPage, getPaymentsPage } from '../services/api';
+import { usePagedList } from '../hooks/usePagedList';
+import { rememberUser, forgetUser } from '../hooks/useUserNames';
+import { LoadMore } from '../components/LoadMore';
 
 export const UsersPage: React.FC = () => {
-  const { users, devices, usage, payments, services, updateUser, deleteUser } = useApp();
+  const { services } = useApp();
+  const { items: users, setItems: setUsers, hasMore, loading, error, loadMore } = usePagedList(getUsersPage);
   
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
@@ -15,6 +20,40 @@ export const UsersPage: React.FC = () => {
   const [editFormData, setEditFormData] = useState<Partial<User>>({});
   const [activeTab, setActiveTab] = useState<'devices' | 'usage' | 'payments'>('devices');
 
+  // the detail modal pages through the selected user's history; nothing loads until it is open
+  const detailUserId = isDetailOpen && selectedUser ? selectedUser.id : null;
+  const devices = usePagedList(getDevicesPage, detailUserId ? { user_id: detailUserId } : null);
+  const usage = usePagedList(getUsagesPage, detailUserId && activeTab === 'usage' ? { user_id: detailUserId } : null);
+  const payments = usePagedList(getPaymentsPage, detailUserId && activeTab === 'payments' ? { user_id: detailUserId } : null);
+
+  const updateUser = (updatedUser: User) => {
+    const replace = () => {
+      rememberUser(updatedUser);
+      setUsers(prev => prev.map(u => u.id === updatedUser.id ? updatedUser : u));
+    };
+    api.updateUser(updatedUser.id, updatedUser as Partial<User>)
+      .then(replace)
+      .catch((err) => {
+        console.error('Failed to update user', err);
+        // fallback to local update
+        replace();
+      });
+  };
+
+  const deleteUser = (id: string) => {
+    const remove = () => {
+      forgetUser(id);
+      setUsers(prev => prev.filter(u => u.id !== id));
+    };
+    api.deleteUser(id)
+      .then(remove)
+      .catch((err) => {
+        console.error('Failed to delete user', err);
+        // fallback: remove locally
+        remove();
+      });
+  };
+
   const filteredUsers = users.filter(user => 
     user.username?.toLowerCase().includes(searchTerm.toLowerCase()) ||
     user.telegram_id.includes(searchTerm)
@@ -46,8 +85,8 @@ export const UsersPage: React.FC = () => {
   };
 
   // Detail View Sub-components
-  const UserDevices = ({ userId }: { userId: string }) => {
-    const userDevices = devices.filter(d => d.user_id === userId);
+  const UserDevices = () => {
+    const userDevices = devices.items;
     return (
       <div className="overflow-x-auto">
         <table className="w-full text-sm text-left">
@@ -65,15 +104,16 @@ export const UsersPage: React.FC = () => {
                 <td className="px-4 py-2 font-mono">{d.serial}</td>
                 <td className="px-4 py-2 text-slate-500">{d.note}</td>
               </tr>
-            )) : <tr><td colSpan={3} className="px-4 py-4 text-center text-slate-500">No devices found</td></tr>}
+            )) : !devices.loading && <tr><td colSpan={3} className="px-4 py-4 text-center text-slate-500">No devices found</td></tr>}
           </tbody>
         </table>
+        <LoadMore hasMore={devices.hasMore} loading={devices.loading} onClick={devices.loadMore} error={devices.error} />
       </div>
     );
   };
 
-  const UserUsage = ({ userId }: { userId: string }) => {
-    const userUsage = usage.filter(u => u.user_id === userId);
+  const UserUsage = () => {
+    const userUsage = usage.items;
     return (
       <div className="overflow-x-auto">
          <table className="w-full text-sm text-left">
@@ -100,15 +140,16 @@ export const UsersPage: React.FC = () => {
                   </td>
                 </tr>
               );
-            }) : <tr><td colSpan={4} className="px-4 py-4 text-center text-slate-500">No usage history</td></tr>}
+            }) : !usage.loading && <tr><td colSpan={4} className="px-4 py-4 text-center text-slate-500">No usage history</td></tr>}
           </tbody>
         </table>
+        <LoadMore hasMore={usage.hasMore} loading={usage.loading} onClick={usage.loadMore} error={usage.error} />
       </div>
     );
   };
 
-  const UserPayments = ({ userId }: { userId: string }) => {
-    const userPayments = payments.filter(p => p.user_id === userId);
+  const UserPayments = () => {
+    const userPayments = payments.items;
     return (
       <div className="overflow-x-auto">
         <table className="w-full text-sm text-left">
@@ -126,9 +167,10 @@ export const UsersPage: React.FC = () => {
                 <td className="px-4 py-2">{p.method}</td>
                 <td className="px-4 py-2 font-medium text-green-600">+${p.amount.toFixed(2)}</td>
               </tr>
-            )) : <tr><td colSpan={3} className="px-4 py-4 text-center text-slate-500">No payments found</td></tr>}
+            )) : !payments.loading && <tr><td colSpan={3} className="px-4 py-4 text-center text-slate-500">No payments found</td></tr>}
           </tbody>
         </table>
+        <LoadMore hasMore={payments.hasMore} loading={payments.loading} onClick={payments.loadMore} error={payments.error} />
       </div>
     );
   };
@@ -216,6 +258,9 @@ export const UsersPage: React.FC = () => {
             </tbody>
           </table>
         </div>
+        <div className="border-t border-slate-200 bg-slate-50">
+          <LoadMore hasMore={hasMore} loading={loading} onClick={loadMore} error={error} />
+        </div>
       </div>
 
       {/* User Detail Modal */}
@@ -250,7 +295,7 @@ export const UsersPage: React.FC = () => {
                 </div>
                 <div className="text-center">
                   <div className="text-xs text-slate-500">Devices</div>
-                  <div className="font-semibold text-slate-900">{devices.filter(d => d.user_id === selectedUser.id).length}</div>
+                  <div className="font-semibold text-slate-900">{devices.items.length}{devices.hasMore ? '+' : ''}</div>
                 </div>
                 <div className="flex items-center space-x-2">
                   <button onClick={() => { setIsDetailOpen(false); handleEditUser(selectedUser); }} className="px-3 py-2 bg-amber-50 text-amber-700 rounded-md text-sm">Edit</button>
@@ -268,9 +313,9 @@ export const UsersPage: React.FC = () => {
 
             <div className="mt-4">
               <div className="bg-white border border-slate-100 rounded-lg p-4">
-                {activeTab === 'devices' && <UserDevices userId={selectedUser.id} />}
-                {activeTab === 'usage' && <UserUsage userId={selectedUser.id} />}
-                {activeTab === 'payments' && <UserPayments userId={selectedUser.id} />}
+                {activeTab === 'devices' && <UserDevices />}
+                {activeTab === 'usage' && <UserUsage />}
+                {activeTab === 'payments' && <UserPayments />}
               </div>
             </div>
           </div>
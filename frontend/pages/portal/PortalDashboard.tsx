@@ -23,7 +23,7 @@ export const PortalDashboard: React.FC = () => {
                 const id = parseInt(userId);
                 const [userData, usagesData] = await Promise.all([
                     api.getUser(id),
-                    api.getUserUsages(id)
+                    api.getUserUsages(id, { limit: 5 }, 5)
                 ]);
                 setUser(userData);
                 if (Array.isArray(usagesData)) {
@@ -18,6 +18,63 @@ async function handleResponse(res: Response) {
   }
 }
 
+// List endpoints are keyset-paginated: each call returns { items, next_cursor }
+// and passing next_cursor back as `cursor` fetches the following (older) page.
+export interface Page<T> {
+  items: T[];
+  next_cursor: string | null;
+}
+
+export interface ListParams {
+  limit?: number;
+  cursor?: string;
+  from?: string;   // ISO date/datetime, inclusive
+  to?: string;     // ISO date/datetime, exclusive
+  user_id?: number | string;
+  service_id?: number | string;
+  success?: boolean;
+}
+
+function toQuery(params?: object): string {
+  if (!params) return '';
+  const qs = new URLSearchParams();
+  Object.entries(params).forEach(([k, v]) => {
+    if (v !== undefined && v !== null && v !== '') qs.set(k, String(v));
+  });
+  const str = qs.toString();
+  return str ? `?${str}` : '';
+}
+
+export async function getPage<T>(path: string, params?: ListParams): Promise<Page<T>> {
+  const res = await fetch(`${API_BASE}${path}${toQuery(params)}`);
+  const data = await handleResponse(res);
+  return { items: (data && data.items) || [], next_cursor: (data && data.next_cursor) || null };
+}
+
+// Follow next_cursor until the list is exhausted (or maxItems rows were collected).
+// The backend sends numeric ids; the UI keys everything by string id.
+export const normalizeUser = (u: any): User => ({ ...u, id: String(u.id), telegram_id: String(u.telegram_id) });
+export const normalizeDevice = (d: any): DeviceRecord => ({ ...d, id: String(d.id), user_id: String(d.user_id) });
+export const normalizeUsage = (u: any): APIUsage => ({ ...u, id: String(u.id), user_id: String(u.user_id), service_id: String(u.service_id) });
+export const normalizePayment = (p: any): Payment => ({ ...p, id: String(p.id), user_id: p.user_id != null ? String(p.user_id) : p.user_id });
+
+async function getNormalizedPage<T>(path: string, normalize: (row: any) => T, params?: ListParams): Promise<Page<T>> {
+  const page = await getPage<any>(path, params);
+  return { items: page.items.map(normalize), next_cursor: page.next_cursor };
+}
+
+export async function getAllPages<T>(path: string, params: ListParams = {}, maxItems?: number): Promise<T[]> {
+  const items: T[] = [];
+  let cursor: string | null | undefined = params.cursor;
+  const limit = params.limit || 500;
+  do {
+    const page = await getPage<T>(path, { ...params, limit, cursor: cursor || undefined });
+    items.push(...page.items);
+    cursor = page.next_cursor;
+  } while (cursor && (maxItems === undefined || items.length < maxItems));
+  return maxItems === undefined ? items : items.slice(0, maxItems);
+}
+
 export async function getServices(): Promise<Service[]> {
   const res = await fetch(`${API_BASE}/api/services`);
   const data = await handleResponse(res);
@@ -73,24 +130,22 @@ export async function getStatus(): Promise<any> {
   return handleResponse(res);
 }
 
-export async function getUsers(): Promise<User[]> {
-  const res = await fetch(`${API_BASE}/api/users`);
-  return handleResponse(res) as Promise<User[]>;
+// Admin lists load one page at a time (see hooks/usePagedList); nothing fetches a whole table.
+export async function getUsersPage(params?: ListParams): Promise<Page<User>> {
+  return getNormalizedPage('/api/users', normalizeUser, params);
 }
 
 export async function getUserById(id: number | string): Promise<User> {
   const res = await fetch(`${API_BASE}/api/users/${id}`);
-  return handleResponse(res) as Promise<User>;
+  return normalizeUser(await handleResponse(res));
 }
 
-export async function getUserUsages(user_id: number | string) {
-  const res = await fetch(`${API_BASE}/api/users/${user_id}/usages`);
-  return handleResponse(res);
+export async function getUserUsages(user_id: number | string, params?: ListParams, maxItems = 500) {
+  return getAllPages<APIUsage>(`/api/users/${user_id}/usages`, params, maxItems);
 }
 
-export async function getUserPayments(user_id: number | string) {
-  const res = await fetch(`${API_BASE}/api/users/${user_id}/payments`);
-  return handleResponse(res) as Promise<Payment[]>;
+export async function getUserPayments(user_id: number | string, params?: ListParams, maxItems = 500) {
+  return getAllPages<Payment>(`/api/users/${user_id}/payments`, params, maxItems);
 }
 
 export async function createDevice(payload: { user_id: number | string; imei: string; serial?: string; note?: string }) {
@@ -100,9 +155,8 @@ export async function createDevice(payload: { user_id: number | string; imei: st
   return handleResponse(res);
 }
 
-export async function getDevices(): Promise<DeviceRecord[]> {
-  const res = await fetch(`${API_BASE}/api/devices`);
-  return handleResponse(res) as Promise<DeviceRecord[]>;
+export async function getDevicesPage(params?: ListParams): Promise<Page<DeviceRecord>> {
+  return getNormalizedPage('/api/devices', normalizeDevice, params);
 }
 
 export async function updateDevice(id: number | string, payload: Partial<{ user_id: number | string; imei: string; serial: string; note: string }>) {
@@ -117,9 +171,41 @@ export async function deleteDevice(id: number | string) {
   return handleResponse(res);
 }
 
-export async function getUsages(): Promise<APIUsage[]> {
-  const res = await fetch(`${API_BASE}/api/usages`);
-  return handleResponse(res) as Promise<APIUsage[]>;
+export async function getUsagesPage(params?: ListParams): Promise<Page<APIUsage>> {
+  return getNormalizedPage('/api/usages', normalizeUsage, params);
+}
+
+// Aggregated usage from the server-side hourly / daily rollups (cheap for long ranges).
+export interface UsageStatsParams {
+  granularity?: 'hour' | 'day';
+  from?: string;
+  to?: string;
+  service_id?: number | string;
+  user_id?: number | string;
+  group_by?: 'service' | 'provider' | 'user';
+}
+
+export interface UsageStatsPoint {
+  bucket: string;
+  total: number;
+  success: number;
+  failed: number;
+  success_rate: number | null;
+  cost: number;
+  service_id?: number;
+  user_id?: number;
+  provider?: string | null;
+}
+
+export async function getUsageStats(params?: UsageStatsParams): Promise<UsageStatsPoint[]> {
+  const res = await fetch(`${API_BASE}/api/usages/stats${toQuery(params)}`);
+  const data = await handleResponse(res);
+  return data.points || [];
+}
+
+// Full-table exports are streamed by the server; point a link / window.location at this URL.
+export function exportUrl(name: 'usages' | 'payments' | 'devices', format: 'csv' | 'ndjson' = 'csv', params?: ListParams): string {
+  return `${API_BASE}/api/export/${name}${toQuery({ ...params, format })}`;
 }
 
 export async function createPayment(payload: Partial<Payment>) {
@@ -160,9 +246,8 @@ export async function lookup(user_id: number | string, service: string, imei: st
   return handleResponse(res);
 }
 
-export async function getPayments(): Promise<Payment[]> {
-  const res = await fetch(`${API_BASE}/api/payments`);
-  return handleResponse(res) as Promise<Payment[]>;
+export async function getPaymentsPage(params?: ListParams): Promise<Page<Payment>> {
+  return getNormalizedPage('/api/payments', normalizePayment, params);
 }
 
 // Admin auth helpers (use credentials to receive server session cookie)
@@ -198,16 +283,20 @@ export default {
   deleteService,
   getServiceByCode,
   getStatus,
-  getUsers,
-  getDevices,
+  getUsersPage,
+  getDevicesPage,
   getUserById,
   getUserUsages,
   getUserPayments,
   createDevice,
   updateDevice,
   deleteDevice,
-  getUsages,
-  getPayments,
+  getUsagesPage,
+  getUsageStats,
+  exportUrl,
+  getPaymentsPage,
+  getPage,
+  getAllPages,
   createPayment,
   deletePayment,
   updateUser,
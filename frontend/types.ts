@@ -48,6 +48,10 @@ export interface Service {
   api_key?: string;
   is_public: boolean;
   group: string;
+  cache_ttl?: number | null;
+  http_method?: 'GET' | 'POST' | null;
+  param_style?: 'json' | 'query' | 'form' | null;
+  auth_style?: 'all' | 'bearer' | 'header' | 'params' | 'none' | null;
 }
 
 export interface NavItem {
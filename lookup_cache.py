@@ -0,0 +1,205 @@
+# lookup_cache.py
+"""
+Result cache for provider lookups, keyed by (service code, IMEI).
+
+Successful provider responses are kept in a bounded in-memory LRU with a
+per-entry expiry. When a session factory is given, entries are also written
+to the `lookup_cache` table so they survive restarts; the table is consulted
+on an in-memory miss.
+
+SingleFlight deduplicates lookups that are still in progress, so parallel
+identical requests share one provider call.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from models import LookupCacheEntry
+
+
+class LookupCache:
+    def __init__(self, max_entries=10000, default_ttl=3600, session_factory=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.session_factory = session_factory
+        self._entries = OrderedDict()  # (service_code, imei) -> (expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl_for(self, ttl):
+        """Resolve a per-service TTL: None means the default, 0 disables caching."""
+        return self.default_ttl if ttl is None else ttl
+
+    def get(self, service_code, imei):
+        key = (service_code, imei)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        result = self._load(key, now)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def set(self, service_code, imei, result, ttl=None):
+        ttl = self.ttl_for(ttl)
+        if not ttl or ttl <= 0:
+            return
+        key = (service_code, imei)
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, result)
+        self._store(key, expires_at, result)
+
+    def purge(self, service_code=None, imei=None):
+        """Drop matching entries (all of them when no filter is given). Returns the count removed."""
+        def match(key):
+            return ((service_code is None or key[0] == service_code) and
+                    (imei is None or key[1] == imei))
+
+        with self._lock:
+            doomed = [k for k in self._entries if match(k)]
+            for k in doomed:
+                del self._entries[k]
+        removed = len(doomed)
+
+        if self.session_factory is not None:
+            db = self.session_factory()
+            try:
+                q = db.query(LookupCacheEntry)
+                if service_code is not None:
+                    q = q.filter(LookupCacheEntry.service_code == service_code)
+                if imei is not None:
+                    q = q.filter(LookupCacheEntry.imei == imei)
+                removed = max(removed, q.delete(synchronize_session=False))
+                db.commit()
+            finally:
+                db.close()
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "default_ttl": self.default_ttl,
+                "persistent": self.session_factory is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    # ---------- internals ---------- #
+    def _remember(self, key, expires_at, result):
+        with self._lock:
+            self._entries[key] = (expires_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _load(self, key, now):
+        if self.session_factory is None:
+            return None
+        db = self.session_factory()
+        try:
+            row = db.get(LookupCacheEntry, key)
+            if row is None:
+                return None
+            if row.expires_at <= now:
+                db.delete(row)
+                db.commit()
+                return None
+            result = json.loads(row.result)
+            expires_at = row.expires_at
+        finally:
+            db.close()
+        self._remember(key, expires_at, result)
+        return result
+
+    def _store(self, key, expires_at, result):
+        if self.session_factory is None:
+            return
+        db = self.session_factory()
+        try:
+            db.merge(LookupCacheEntry(service_code=key[0], imei=key[1],
+                                      result=json.dumps(result), expires_at=expires_at))
+            db.commit()
+        finally:
+            db.close()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is still running wait for it and receive the same result
+    (or exception) instead of issuing their own provider request.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Run fn() once per in-flight key. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
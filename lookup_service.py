@@ -0,0 +1,319 @@
+# lookup_service.py
+"""
+IMEI lookup service layer shared by the Flask API and the Telegram bot.
+
+LookupService owns everything a lookup needs: the service catalog, the
+pooled provider client, the result cache with in-flight deduplication, the
+atomic quota reservation and the write-behind usage queue. /api/lookup and
+/api/lookup/batch call it, and the bot calls it directly in direct-DB mode
+(BOT_MODE=direct) instead of going through HTTP.
+
+    lookups = LookupService.from_env(SessionLocal)
+    outcome = lookups.lookup(telegram_id, "svc_imei_basic", imei)
+"""
+import os
+import time
+from collections import namedtuple
+
+import requests
+from sqlalchemy import insert, update
+
+import metrics
+import provider_client
+import quota
+import stats_counters
+from catalog import ServiceCatalog
+from lookup_cache import LookupCache, SingleFlight
+from models import APIUsage, DeviceRecord, Service, User
+from write_behind import WriteBehindQueue
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+# How a service's provider wants to be called. The method and param style are
+# learned on the first successful call (see remember_request_style); the auth
+# style cannot be inferred from a success (the key went out every way at once)
+# and is only ever set explicitly through the service API, defaulting to 'all'.
+PROVIDER_METHODS = ('GET', 'POST')
+PARAM_STYLES = ('json', 'query', 'form')
+AUTH_STYLES = ('all', 'bearer', 'header', 'params', 'none')
+
+# source is 'HIT', 'COALESCED' or 'MISS' (only a MISS paid for a provider call)
+LookupOutcome = namedtuple("LookupOutcome", "success result error source")
+
+
+class LookupRejected(Exception):
+    """The lookup was refused before the provider was called; `status` is the HTTP equivalent."""
+    status = 400
+
+
+class ServiceNotFound(LookupRejected):
+    status = 404
+
+
+class NoCallsLeft(LookupRejected):
+    status = 403
+
+
+def validate_request_style(data):
+    """Return an error message if an explicit method/param/auth style in `data` is invalid."""
+    method = data.get('http_method')
+    if method and (not isinstance(method, str) or method.upper() not in PROVIDER_METHODS):
+        return f"http_method must be one of {', '.join(PROVIDER_METHODS)}"
+    param_style = data.get('param_style')
+    if param_style and (not isinstance(param_style, str) or param_style not in PARAM_STYLES):
+        return f"param_style must be one of {', '.join(PARAM_STYLES)}"
+    auth_style = data.get('auth_style')
+    if auth_style and (not isinstance(auth_style, str) or auth_style not in AUTH_STYLES):
+        return f"auth_style must be one of {', '.join(AUTH_STYLES)}"
+    return None
+
+
+def request_plans(svc):
+    """Ordered (method, param_style) candidates to try for `svc`."""
+    if svc.http_method:
+        method = svc.http_method.upper()
+        return [(method, svc.param_style or ('json' if method == 'POST' else 'query'))]
+    # Not learned yet: guess from the URL and fall back to the other method on a 405
+    if "imei.info" in svc.api_url or "imeicheck.net" in svc.api_url:
+        return [('POST', 'json'), ('GET', 'query')]
+    return [('GET', 'query'), ('POST', 'json')]
+
+
+def request_kwargs(svc, imei, param_style, auth_style):
+    params = {"imei": imei}
+    headers = {}
+
+    if svc.api_key:
+        if auth_style in ('all', 'params'):
+            params["apikey"] = svc.api_key
+            params["key"] = svc.api_key
+            params["token"] = svc.api_key
+        if auth_style in ('all', 'bearer'):
+            headers["Authorization"] = f"Bearer {svc.api_key}"
+        if auth_style in ('all', 'header'):
+            headers["key"] = svc.api_key
+
+    body_arg = {'json': 'json', 'form': 'data'}.get(param_style, 'params')
+    return {body_arg: params, "headers": headers}
+
+
+def get_or_create_user(db, telegram_id, username=None):
+    """Fetch the user for a telegram id, creating it (or refreshing its username) as needed."""
+    user = db.query(User).filter_by(telegram_id=telegram_id).first()
+
+    if not user:
+        user = User(
+            telegram_id=telegram_id,
+            username=username,
+            free_calls=10,
+            paid_calls=0,
+            registered=True
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    else:
+        if username and username != user.username:
+            user.username = username
+            db.commit()
+    return user
+
+
+class LookupService:
+    def __init__(self, session_factory, catalog, provider, result_cache, inflight, usage_writer):
+        self.session_factory = session_factory
+        self.catalog = catalog
+        self.provider = provider
+        self.result_cache = result_cache
+        self.inflight = inflight
+        self.usage_writer = usage_writer
+
+    @classmethod
+    def from_env(cls, session_factory, spool_path=None):
+        """Build the service and its collaborators from LOOKUP_CACHE_* / WRITE_BEHIND_* settings."""
+        persist = os.environ.get("LOOKUP_CACHE_PERSIST", "0").lower() in ("1", "true", "yes")
+        usage_writer = WriteBehindQueue(
+            session_factory,
+            interval_ms=float(os.environ.get("WRITE_BEHIND_INTERVAL_MS", "200")),
+            max_batch=int(os.environ.get("WRITE_BEHIND_BATCH", "500")),
+            max_queue=int(os.environ.get("WRITE_BEHIND_MAX_QUEUE", "50000")),
+            max_attempts=int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", "3")),
+            spool_path=spool_path or os.environ.get(
+                "WRITE_BEHIND_SPOOL", os.path.join(basedir, "write_behind.spool.jsonl")),
+        )
+        return cls(
+            session_factory,
+            catalog=ServiceCatalog(session_factory),
+            provider=provider_client.default_client,
+            result_cache=LookupCache(
+                max_entries=int(os.environ.get("LOOKUP_CACHE_SIZE", "10000")),
+                default_ttl=int(os.environ.get("LOOKUP_CACHE_TTL", "3600")),
+                session_factory=session_factory if persist else None,
+            ),
+            inflight=SingleFlight(),
+            usage_writer=usage_writer,
+        )
+
+    def start(self):
+        """Replay spooled usage records and start the write-behind thread."""
+        self.usage_writer.replay_spool()
+        self.usage_writer.start()
+
+    # ---------- provider ----------
+    def remember_request_style(self, svc, method, param_style):
+        """Persist the method / param style that just worked, unless one is already stored."""
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(Service)
+                .where(Service.id == svc.id, Service.http_method.is_(None))
+                .values(http_method=method, param_style=param_style)
+            )
+            db.commit()
+        finally:
+            db.close()
+        svc.http_method, svc.param_style = method, param_style
+        self.catalog.invalidate()
+
+    def call_provider(self, svc, imei):
+        """
+        Call the provider behind `svc` for one IMEI.
+        Returns (success, service_result, error_msg).
+        """
+        success = False
+        service_result = None
+        error_msg = None
+
+        # User-Agent / Accept come from the pooled session; the timeout is derived
+        # per host from observed latency by the provider client
+        auth_style = svc.auth_style or 'all'
+        learned = bool(svc.http_method)
+
+        started = time.perf_counter()
+        answered = False
+        try:
+            try:
+                for method, param_style in request_plans(svc):
+                    response = self.provider.request(method, svc.api_url, **request_kwargs(svc, imei, param_style, auth_style))
+                    if response.status_code != 405:  # Method Not Allowed -> try the next candidate
+                        break
+                answered = response.ok
+            finally:
+                metrics.observe_provider(svc.code, provider_client.host_key(svc.api_url),
+                                         time.perf_counter() - started, ok=answered)
+
+            response.raise_for_status()
+            if not learned:
+                self.remember_request_style(svc, method, param_style)
+
+            try:
+                service_result = response.json()
+                success = True
+
+                # Check for common API error fields in 200 OK responses
+                if isinstance(service_result, dict):
+                    if "error" in service_result and service_result["error"]:
+                        success = False
+                        error_msg = str(service_result["error"])
+                    elif "status" in service_result and service_result["status"] == "failed":
+                        success = False
+                        error_msg = service_result.get("message", "Unknown error")
+
+            except ValueError:
+                error_msg = "Provider returned invalid JSON: " + response.text[:100]
+        except requests.exceptions.RequestException as e:
+            error_msg = f"Provider API call failed: {str(e)}"
+
+        return success, service_result, error_msg
+
+    def lookup_one(self, svc, imei):
+        """
+        Resolve one (service, imei) lookup through the result cache and the
+        in-flight deduplication, calling the provider only when needed.
+        Returns a LookupOutcome; does not touch quota or usage records.
+        """
+        service_result = self.result_cache.get(svc.code, imei)
+        if service_result is not None:
+            return LookupOutcome(True, service_result, None, 'HIT')
+
+        def fetch():
+            result = self.call_provider(svc, imei)
+            if result[0]:
+                self.result_cache.set(svc.code, imei, result[1], ttl=svc.cache_ttl)
+            return result
+
+        (success, service_result, error_msg), shared = self.inflight.do((svc.code, imei), fetch)
+        return LookupOutcome(success, service_result, error_msg, 'COALESCED' if shared else 'MISS')
+
+    # ---------- full lookups ----------
+    def lookup(self, telegram_id, service_code, imei, username=None):
+        """
+        One charged lookup for a Telegram user: reserve a call, resolve the
+        lookup, refund unless a provider call was actually paid for, and queue
+        the usage/device records. Raises ServiceNotFound / NoCallsLeft.
+        """
+        svc = self.catalog.get_by_code(service_code)
+        if not svc:
+            raise ServiceNotFound("Service not found")
+
+        db = self.session_factory()
+        try:
+            user = get_or_create_user(db, telegram_id, username)
+            user_id = user.id
+            # reserve one call atomically before the provider is contacted
+            reservation = quota.reserve_calls(db, user_id)
+        finally:
+            db.close()
+        if reservation is None:
+            raise NoCallsLeft("No calls left")
+
+        charged = False
+        try:
+            outcome = self.lookup_one(svc, imei)
+            charged = outcome.success and outcome.source == 'MISS'
+        finally:
+            # only the request that actually paid for a successful provider call is
+            # charged; failures, cache hits and coalesced duplicates are refunded
+            if not charged:
+                db = self.session_factory()
+                try:
+                    quota.refund_calls(db, user_id, reservation)
+                finally:
+                    db.close()
+
+        self.usage_writer.submit(user_id, svc.id, imei, outcome.success)
+        return outcome
+
+    def save_batch(self, user_id, records, reservation):
+        """
+        Write the usages/devices of a finished batch in bulk and settle quota:
+        `reservation` covered the whole batch, the calls not charged are refunded.
+        `records` is a list of (service_id, imei, success, source) tuples.
+        Returns the number of calls charged.
+        """
+        db = self.session_factory()
+        if not records:
+            quota.refund_calls(db, user_id, reservation)
+            db.close()
+            return 0
+        try:
+            db.execute(insert(APIUsage), [
+                {"user_id": user_id, "service_id": service_id, "imei": imei, "success": success, "cost": 0.0}
+                for service_id, imei, success, _ in records
+            ])
+
+            imeis = {imei for _, imei, _, _ in records}
+            known = {row[0] for row in db.query(DeviceRecord.imei)
+                     .filter(DeviceRecord.user_id == user_id, DeviceRecord.imei.in_(imeis))}
+            new_imeis = sorted(imeis - known)
+            if new_imeis:
+                db.execute(insert(DeviceRecord), [{"user_id": user_id, "imei": imei} for imei in new_imeis])
+            # bulk Core inserts bypass the ORM flush hook that maintains the counters
+            stats_counters.bump(db, usages_count=len(records), devices_count=len(new_imeis))
+            db.commit()
+
+            charged = sum(1 for _, _, success, source in records if success and source == 'MISS')
+            quota.refund_calls(db, user_id, reservation, used=charged)
+            return charged
+        finally:
+            db.close()
@@ -0,0 +1,216 @@
+# metrics.py
+"""
+Dependency-free metrics registry with Prometheus text exposition.
+
+Counters and histograms are labelled; gauges are read from callbacks at
+scrape time (queue depths, cache sizes, ...). instrument_app() records per
+route request counts, errors, latency and DB time; instrument_engine()
+accumulates the number of SQL statements and the time spent in them per
+request (per thread) and observe_provider() is called around every upstream
+provider call.
+
+    GET /metrics   (see flask_app; optional METRICS_TOKEN bearer auth)
+"""
+import math
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(v):
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(float(bound)))])} {count}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(series[-2], 6))}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}"
+
+
+class Gauge:
+    """Read at scrape time: fn() returns a number or {label values tuple: number}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name, self.help, self.labelnames, self.fn = name, help, tuple(labelnames), fn
+
+    def render(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, v in sorted(value.items()):
+            if v is not None:
+                yield f"{self.name}{_labels(self.labelnames, key)} {_number(v)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self.register(Gauge(name, help, fn, labelnames))
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter("http_requests_total", "HTTP requests by route, method and status.",
+                            ("route", "method", "status"))
+ERRORS = registry.counter("http_request_errors_total", "HTTP requests answered with a 5xx or an exception.",
+                          ("route", "method"))
+LATENCY = registry.histogram("http_request_duration_seconds", "HTTP request latency.", ("route", "method"))
+DB_TIME = registry.histogram("http_request_db_seconds", "Time spent in SQL per HTTP request.",
+                             ("route", "method"), buckets=DB_BUCKETS + (2.5, 5.0))
+DB_QUERIES = registry.histogram("http_request_db_queries", "SQL statements executed per HTTP request.",
+                                ("route", "method"), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500))
+PROVIDER_LATENCY = registry.histogram("provider_request_duration_seconds",
+                                      "Upstream provider call latency by service and host.",
+                                      ("service", "host", "outcome"))
+
+# SQL statements / time of the request being handled on this thread
+# (seconds is None outside requests)
+_db_time = threading.local()
+
+
+def instrument_engine(engine):
+    """Accumulate cursor executions and their time into the current request's DB stats."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if getattr(_db_time, "seconds", None) is not None:
+            _db_time.seconds += elapsed
+            _db_time.queries += 1
+
+
+def request_db_seconds():
+    return getattr(_db_time, "seconds", None) or 0.0
+
+
+def request_db_queries():
+    return getattr(_db_time, "queries", 0)
+
+
+def observe_provider(service, host, seconds, ok):
+    PROVIDER_LATENCY.observe(seconds, service=service, host=host, outcome="ok" if ok else "error")
+
+
+def instrument_app(app):
+    """Record count / errors / latency / DB time for every request of `app`."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        _db_time.seconds = 0.0
+        _db_time.queries = 0
+
+    @app.after_request
+    def _record(response):
+        _observe(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _record_exception(exc):
+        if exc is not None and "metrics_start" in g:
+            _observe(500)
+        _db_time.seconds = None
+        _db_time.queries = 0
+
+    def _observe(status):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        method = request.method
+        REQUESTS.inc(route=route, method=method, status=str(status))
+        if status >= 500:
+            ERRORS.inc(route=route, method=method)
+        LATENCY.observe(time.perf_counter() - start, route=route, method=method)
+        DB_TIME.observe(request_db_seconds(), route=route, method=method)
+        DB_QUERIES.observe(request_db_queries(), route=route, method=method)
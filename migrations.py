@@ -0,0 +1,158 @@
+# migrations.py
+"""
+Minimal versioned schema migrations.
+
+`Base.metadata.create_all` creates missing tables (with their indexes) but
+never touches tables that already exist, so columns and indexes added after
+a database was created have to be applied here. Applied versions are
+recorded in `schema_migrations`; init_db() runs whatever is pending.
+
+Every step is idempotent (it checks what already exists first), so it is a
+no-op on a fresh database that create_all just built. Two workers starting at
+the same time can race on the same DDL: the loser gets "duplicate column" /
+"index already exists" (or the duplicate version row), re-checks
+`schema_migrations` and, if the version is not recorded yet, simply runs the
+step again, which now skips what the winner already created.
+
+Add a migration by appending (version, name, step) to MIGRATIONS, where
+`step(conn)` receives a connection inside a transaction.
+
+    python migrations.py        # apply pending migrations to DATABASE_URL
+"""
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, insert, inspect, select, text
+)
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+metadata = MetaData()
+MIGRATION_ATTEMPTS = 5
+
+schema_migrations = Table(
+    "schema_migrations", metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255)),
+    Column("applied_at", DateTime(timezone=True)),
+)
+
+
+def add_column(table, column, ddl):
+    def step(conn):
+        existing = {c["name"] for c in inspect(conn).get_columns(table)}
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+
+def create_index(table, name, *columns):
+    def step(conn):
+        existing = {ix["name"] for ix in inspect(conn).get_indexes(table)}
+        if name not in existing:
+            conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+    return step
+
+
+def mark_rolled_up(conn):
+    # rows up to the old id watermark were already folded into the rollups
+    row = conn.execute(text("SELECT value FROM app_stats WHERE name = 'usage_rollup_watermark'")).first()
+    if row is not None:
+        conn.execute(text("UPDATE api_usages SET rolled_up = :t WHERE id <= :wm"), {"t": True, "wm": int(row[0])})
+        conn.execute(text("DELETE FROM app_stats WHERE name = 'usage_rollup_watermark'"))
+
+
+def steps(*fns):
+    def step(conn):
+        for fn in fns:
+            fn(conn)
+    return step
+
+
+MIGRATIONS = [
+    (1, "services.cache_ttl", add_column("services", "cache_ttl", "INTEGER")),
+    (2, "services request style", steps(
+        add_column("services", "http_method", "VARCHAR(8)"),
+        add_column("services", "param_style", "VARCHAR(16)"),
+        add_column("services", "auth_style", "VARCHAR(16)"),
+    )),
+    (3, "hot-path indexes", steps(
+        create_index("api_usages", "ix_api_usages_user_created", "user_id", "created_at"),
+        create_index("api_usages", "ix_api_usages_created_at", "created_at"),
+        create_index("payments", "ix_payments_created_at", "created_at"),
+        create_index("payments", "ix_payments_user_created", "user_id", "created_at"),
+        create_index("devices", "ix_devices_user_imei", "user_id", "imei"),
+        create_index("users", "ix_users_created_at", "created_at"),
+    )),
+    (4, "api_usages.rolled_up", steps(
+        add_column("api_usages", "rolled_up", "BOOLEAN NOT NULL DEFAULT FALSE"),
+        mark_rolled_up,
+        create_index("api_usages", "ix_api_usages_rolled_up", "rolled_up", "id"),
+    )),
+]
+
+
+def create_tables(engine, meta):
+    """meta.create_all(), retried if a concurrent worker creates a table first."""
+    for attempt in range(1, MIGRATION_ATTEMPTS + 1):
+        try:
+            meta.create_all(bind=engine)
+            return
+        except (OperationalError, ProgrammingError):
+            # "table already exists": create_all checks first, so a retry only creates what is missing
+            if attempt == MIGRATION_ATTEMPTS:
+                raise
+            time.sleep(0.05 * attempt)
+
+
+def applied_versions(engine):
+    create_tables(engine, metadata)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def run_migrations(engine):
+    """Apply pending migrations in order. Returns the list of versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        if apply_migration(engine, version, name, step):
+            applied.append(version)
+    return applied
+
+
+def apply_migration(engine, version, name, step):
+    """Run one migration. Returns False if another process applied it first."""
+    for attempt in range(1, MIGRATION_ATTEMPTS + 1):
+        try:
+            with engine.begin() as conn:
+                step(conn)
+                conn.execute(insert(schema_migrations).values(
+                    version=version, name=name, applied_at=datetime.now(timezone.utc)))
+            return True
+        except IntegrityError:
+            # another process recorded this version first
+            return False
+        except (OperationalError, ProgrammingError):
+            # lost a race on the DDL itself (duplicate column / index already exists)
+            if version in applied_versions(engine):
+                return False
+            if attempt == MIGRATION_ATTEMPTS:
+                raise
+            time.sleep(0.05 * attempt)
+
+
+if __name__ == "__main__":
+    import os
+    from dotenv import load_dotenv
+    from models import Base, create_tuned_engine
+
+    load_dotenv()
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    url = os.environ.get("DATABASE_URL", f"sqlite:///{os.path.join(basedir, 'bot.db')}")
+    engine = create_tuned_engine(url)
+    create_tables(engine, Base.metadata)
+    applied = run_migrations(engine)
+    print(f"Applied migrations: {applied}" if applied else "Database is up to date.")
@@ -1,9 +1,12 @@
 # models.py
+import os
+
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, ForeignKey, Text, func, Float
+    Column, Integer, String, Boolean, DateTime, ForeignKey, Text, func, Float, Index, false
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 
 Base = declarative_base()
 
@@ -21,6 +24,10 @@ class User(Base):
     usages = relationship("APIUsage", back_populates="user")
     payments = relationship("Payment", back_populates="user")
 
+    __table_args__ = (
+        Index("ix_users_created_at", "created_at"),
+    )
+
 class Service(Base):
     __tablename__ = "services"
     id = Column(Integer, primary_key=True)
@@ -32,7 +39,12 @@ class Service(Base):
     api_key = Column(String(256), nullable=True)
     is_public = Column(Boolean, default=True)
     group = Column(String(128), default="General")
-
+    # seconds a successful lookup result may be served from cache (NULL = default, 0 = never cache)
+    cache_ttl = Column(Integer, nullable=True)
+    # how the provider must be called; learned on the first successful lookup or set explicitly
+    http_method = Column(String(8), nullable=True)     # GET / POST
+    param_style = Column(String(16), nullable=True)    # json / query / form
+    auth_style = Column(String(16), nullable=True)     # all / bearer / header / params / none
 
     usages = relationship("APIUsage", back_populates="service")
 
@@ -47,6 +59,10 @@ class DeviceRecord(Base):
 
     user = relationship("User", back_populates="devices")
 
+    __table_args__ = (
+        Index("ix_devices_user_imei", "user_id", "imei"),   # lookup path: device per (user, imei)
+    )
+
 class APIUsage(Base):
     __tablename__ = "api_usages"
     id = Column(Integer, primary_key=True)
@@ -56,10 +72,18 @@ class APIUsage(Base):
     success = Column(Boolean, default=False)
     cost = Column(Float, default=0.0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # set once the row has been folded into the usage rollups (see rollups)
+    rolled_up = Column(Boolean, nullable=False, default=False, server_default=false())
 
     user = relationship("User", back_populates="usages")
     service = relationship("Service", back_populates="usages")
 
+    __table_args__ = (
+        Index("ix_api_usages_user_created", "user_id", "created_at"),   # per-user history, newest first
+        Index("ix_api_usages_created_at", "created_at"),
+        Index("ix_api_usages_rolled_up", "rolled_up", "id"),            # rows still to fold
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
     id = Column(Integer, primary_key=True)
@@ -71,10 +95,104 @@ class Payment(Base):
 
     user = relationship("User", back_populates="payments")
 
+    __table_args__ = (
+        Index("ix_payments_created_at", "created_at"),
+        Index("ix_payments_user_created", "user_id", "created_at"),
+    )
+
+class LookupCacheEntry(Base):
+    """Persisted provider lookup result (optional backing store for lookup_cache)."""
+    __tablename__ = "lookup_cache"
+    service_code = Column(String(64), primary_key=True)
+    imei = Column(String(128), primary_key=True)
+    result = Column(Text)                       # JSON-encoded provider response
+    expires_at = Column(Float, index=True)      # unix timestamp
+
+class AppStat(Base):
+    """Incrementally maintained dashboard counter (see stats_counters)."""
+    __tablename__ = "app_stats"
+    name = Column(String(64), primary_key=True)
+    value = Column(Float, nullable=False, default=0.0)
+
+class _UsageRollupMixin:
+    # one row per (bucket, service, user, success); NULL ids are stored as 0
+    bucket_start = Column(DateTime, primary_key=True)   # UTC, truncated to the hour / day
+    service_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    success = Column(Boolean, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+
+class UsageRollupHourly(_UsageRollupMixin, Base):
+    """APIUsage rows folded into hourly buckets (see rollups)."""
+    __tablename__ = "usage_rollups_hourly"
+
+class UsageRollupDaily(_UsageRollupMixin, Base):
+    """APIUsage rows folded into daily buckets (see rollups)."""
+    __tablename__ = "usage_rollups_daily"
+
+# Engine tuning profile; every setting can be overridden through env next to DATABASE_URL
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+def engine_profile_from_env():
+    return {
+        # SQLite pragmas, applied to every new connection
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),       # WAL lets readers run during a write
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),      # NORMAL is durable enough with WAL
+        "busy_timeout_ms": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", "-65536")),   # negative = KiB (64 MiB)
+        # connection pool (file SQLite and server databases)
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "1800")),    # server databases only
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", "1"),               # server databases only
+    }
+
+def sqlite_pragmas(profile):
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        if profile.get("journal_mode"):
+            cur.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+        if profile.get("synchronous"):
+            cur.execute(f"PRAGMA synchronous={profile['synchronous']}")
+        cur.execute(f"PRAGMA busy_timeout={int(profile.get('busy_timeout_ms') or 0)}")
+        if profile.get("mmap_size") is not None:
+            cur.execute(f"PRAGMA mmap_size={int(profile['mmap_size'])}")
+        if profile.get("cache_size") is not None:
+            cur.execute(f"PRAGMA cache_size={int(profile['cache_size'])}")
+        cur.close()
+    return on_connect
+
+def create_tuned_engine(database_url, profile=None):
+    """create_engine() with the pool settings / SQLite pragmas of `profile` (default: from env)."""
+    profile = engine_profile_from_env() if profile is None else profile
+    url = make_url(database_url)
+    pool_args = {k: profile[k] for k in ("pool_size", "max_overflow", "pool_timeout") if k in profile}
+    if url.get_backend_name() == "sqlite":
+        in_memory = url.database in (None, "", ":memory:")
+        engine = create_engine(
+            database_url,
+            connect_args={"check_same_thread": False,
+                          "timeout": (profile.get("busy_timeout_ms") or 0) / 1000.0},
+            **({} if in_memory else pool_args),
+        )
+        event.listen(engine, "connect", sqlite_pragmas(profile))
+        return engine
+    for k in ("pool_recycle", "pool_pre_ping"):
+        if k in profile:
+            pool_args[k] = profile[k]
+    return create_engine(database_url, **pool_args)
+
 # Database engine & session factory (use env var DATABASE_URL)
-def init_db(database_url: str = "sqlite:///./bot.db"):
-    engine = create_engine(database_url, connect_args={"check_same_thread": False})
-    Base.metadata.create_all(bind=engine)
+def init_db(database_url: str = "sqlite:///./bot.db", profile=None):
+    engine = create_tuned_engine(database_url, profile)
+    from migrations import create_tables, run_migrations
+    create_tables(engine, Base.metadata)
+    # create_all never alters existing tables; bring live databases up to date
+    run_migrations(engine)
     return engine
 
 # create a session factory after init_db:
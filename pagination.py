@@ -0,0 +1,119 @@
+# pagination.py
+"""
+Keyset (cursor) pagination and common list filters for the JSON API.
+
+Lists are ordered newest first on (created_at, id). A page returns at most
+`limit` rows plus an opaque `next_cursor`; passing it back as `cursor` fetches
+the rows strictly after the last one, without OFFSET scans.
+
+The cursor keeps created_at exactly as the database stores it (SQLite keeps
+both 'YYYY-MM-DD HH:MM:SS' and '... .ffffff' strings), so the keyset
+comparison matches the ORDER BY even when formats are mixed.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import String, and_, or_, type_coerce
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class PaginationError(ValueError):
+    """Invalid limit / cursor / filter value (reported to the client as 400)."""
+
+
+def encode_cursor(created_raw, row_id):
+    payload = json.dumps([created_raw, row_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_raw, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return created_raw, int(row_id)
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def parse_datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise PaginationError(f"{name} must be an ISO date or datetime")
+
+
+def parse_bool(value, name):
+    lowered = value.lower()
+    if lowered in ("1", "true", "yes"):
+        return True
+    if lowered in ("0", "false", "no"):
+        return False
+    raise PaginationError(f"{name} must be true or false")
+
+
+def parse_int(value, name):
+    try:
+        return int(value)
+    except ValueError:
+        raise PaginationError(f"{name} must be an integer")
+
+
+def apply_filters(query, model, args):
+    """
+    Apply the filters present in `args` (request.args) that `model` supports:
+    from / to (created_at range, ISO format; `to` is exclusive),
+    user_id, service_id, success.
+    """
+    if args.get("from"):
+        query = query.filter(model.created_at >= parse_datetime(args["from"], "from"))
+    if args.get("to"):
+        query = query.filter(model.created_at < parse_datetime(args["to"], "to"))
+    for name in ("user_id", "service_id"):
+        if args.get(name) and hasattr(model, name):
+            query = query.filter(getattr(model, name) == parse_int(args[name], name))
+    if args.get("success") and hasattr(model, "success"):
+        query = query.filter(model.success == parse_bool(args["success"], "success"))
+    return query
+
+
+def keyset_page(query, model, limit, cursor=None):
+    """
+    Return (rows, next_cursor) for one page of `query`, newest first.
+    `query` may select the model entity (rows are objects) or a projection of
+    its columns (rows are tuples). `next_cursor` is None on the last page.
+    """
+    created_raw = type_coerce(model.created_at, String)
+    if cursor:
+        after_created, after_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            created_raw < after_created,
+            and_(created_raw == after_created, model.id < after_id),
+        ))
+    rows = (query.add_columns(model.id, created_raw)
+            .order_by(model.created_at.desc(), model.id.desc())
+            .limit(limit + 1)
+            .all())
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_id, last_created = rows[-1][-2], rows[-1][-1]
+        next_cursor = encode_cursor(str(last_created), last_id)
+    if len(query.column_descriptions) == 1:
+        return [r[0] for r in rows], next_cursor
+    return [tuple(r[:-2]) for r in rows], next_cursor
@@ -0,0 +1,111 @@
+# profiling.py
+"""
+Per-request SQL visibility and on-demand CPU profiling for the Flask app.
+
+- Every response carries X-DB-Queries / X-DB-Time-ms: the number of SQL
+  statements the request executed and the time spent in them (counted by
+  metrics.instrument_engine).
+- log_slow_queries() logs every statement slower than a threshold with its
+  parameters and, on SQLite, its EXPLAIN QUERY PLAN (SLOW_QUERY_MS).
+- With PROFILE_ROUTES set (comma-separated route rules such as
+  "/api/lookup,/api/status", or "*" for all), matching requests run under
+  cProfile and each one is dumped to PROFILE_DIR as a .prof file:
+
+      python -m pstats profiles/20240101-120000.123-POST-api_lookup-48ms.prof
+"""
+import cProfile
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+
+def add_query_headers(app):
+    """Report the request's SQL statement count and time in response headers."""
+    @app.after_request
+    def _query_headers(response):
+        response.headers['X-DB-Queries'] = str(metrics.request_db_queries())
+        response.headers['X-DB-Time-ms'] = f"{metrics.request_db_seconds() * 1000:.2f}"
+        return response
+
+
+def explain_query_plan(cursor, statement, parameters):
+    """SQLite's EXPLAIN QUERY PLAN for `statement` as indented lines, or None."""
+    try:
+        rows = cursor.connection.execute("EXPLAIN QUERY PLAN " + statement, parameters or ()).fetchall()
+    except Exception:
+        return None
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+def log_slow_queries(engine, threshold_ms):
+    """Log statements on `engine` that take longer than `threshold_ms`."""
+    from sqlalchemy import event
+
+    threshold = threshold_ms / 1000.0
+    sqlite = engine.dialect.name == "sqlite"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["slow_query_start"].pop()
+        if elapsed < threshold:
+            return
+        plan = None
+        if sqlite and not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+            plan = explain_query_plan(cursor, statement, parameters)
+        logger.warning("Slow query (%.1f ms): %s\nparameters: %r%s", elapsed * 1000, statement,
+                       parameters if not executemany else f"<{len(parameters)} rows>",
+                       f"\nquery plan:\n{plan}" if plan else "")
+
+
+def profile_routes(app, routes, directory):
+    """
+    Run requests whose route rule is in `routes` ("*" = every route) under
+    cProfile and dump one .prof file per request into `directory`.
+    """
+    from flask import g, request
+
+    routes = set(routes)
+    os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def _start_profile():
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        if rule is None or ("*" not in routes and rule not in routes):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another request on this interpreter is being profiled
+            return
+        g.profiler = profiler
+        g.profile_start = time.perf_counter()
+
+    @app.teardown_request
+    def _dump_profile(exc):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - g.pop("profile_start")) * 1000
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", request.url_rule.rule).strip("_") or "root"
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S.%f")[:-3]
+        path = os.path.join(directory, f"{stamp}-{request.method}-{slug}-{elapsed_ms:.0f}ms.prof")
+        profiler.dump_stats(path)
+        logger.info("Profiled %s %s in %.1f ms -> %s", request.method, request.path, elapsed_ms, path)
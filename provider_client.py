@@ -0,0 +1,163 @@
+# provider_client.py
+"""
+Pooled HTTP client for the upstream IMEI provider APIs.
+
+Every provider host (api.imei.info, imeicheck.net, ...) gets its own
+requests.Session with a keep-alive connection pool, so repeated lookups
+reuse the TCP+TLS connection instead of paying a fresh handshake each time.
+Sessions are created lazily and shared by all worker threads.
+
+When a ProviderHealth tracker is attached, every request is checked against
+the host's circuit breaker, gets a timeout derived from the host's observed
+latency (unless the caller passes one) and reports its outcome back.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from provider_health import ProviderHealth
+
+PROVIDER_POOL_SIZE = int(os.environ.get("PROVIDER_POOL_SIZE", "10"))
+PROVIDER_MAX_RETRIES = int(os.environ.get("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_BACKOFF = float(os.environ.get("PROVIDER_BACKOFF", "0.3"))
+
+USER_AGENT = "TGService/1.0"
+
+
+def host_key(url):
+    """Return the scheme://host[:port] part of a URL, used to key pools."""
+    parts = urlsplit(url or "")
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a provider's circuit breaker is open."""
+
+
+class ProviderClient:
+    def __init__(self, pool_size=PROVIDER_POOL_SIZE, max_retries=PROVIDER_MAX_RETRIES,
+                 backoff_factor=PROVIDER_BACKOFF, health=None):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.health = health
+        self._sessions = {}
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def _build_session(self):
+        # Only connection errors and gateway errors are retried; a read timeout
+        # is not, otherwise a stuck provider would hold the worker several times over.
+        # Connect errors are retried for every method (nothing was sent yet), gateway
+        # errors only for GET: a POST lookup may already have been processed and billed.
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            backoff_factor=self.backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              max_retries=retry, pool_block=False)
+        s = requests.Session()
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        s.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept": "application/json",
+            "Connection": "keep-alive",
+        })
+        return s, adapter
+
+    def session_for(self, url):
+        """Return the shared session for the host of `url`, creating it on first use."""
+        key = host_key(url)
+        s = self._sessions.get(key)
+        if s is not None:
+            return s
+        with self._lock:
+            s = self._sessions.get(key)
+            if s is None:
+                s, adapter = self._build_session()
+                self._sessions[key] = s
+                self._adapters[key] = adapter
+            return s
+
+    def request(self, method, url, **kwargs):
+        session = self.session_for(url)
+        if self.health is None:
+            return session.request(method, url, **kwargs)
+
+        host = host_key(url)
+        if not self.health.allow(host):
+            raise CircuitOpenError(f"Provider {host} is unavailable (circuit open)")
+        kwargs.setdefault("timeout", self.health.timeout_for(host))
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            self.health.record_failure(host, time.monotonic() - start, timed_out=True)
+            raise
+        except BaseException:
+            self.health.record_failure(host, time.monotonic() - start)
+            raise
+        elapsed = time.monotonic() - start
+        # 4xx means the provider is up and answered; only 5xx counts against it
+        if response.status_code >= 500:
+            self.health.record_failure(host, elapsed)
+        else:
+            self.health.record_success(host, elapsed)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """
+        Per-host connection counters. `requests` counts every request sent on
+        the pool, `connections` every new TCP connection it had to open; the
+        difference is the number of requests served over a reused connection.
+        """
+        with self._lock:
+            adapters = list(self._adapters.items())
+        result = {}
+        for key, adapter in adapters:
+            requests_sent = 0
+            connections = 0
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+            reused = max(requests_sent - connections, 0)
+            result[key] = {
+                "requests": requests_sent,
+                "connections": connections,
+                "reused": reused,
+                "reuse_ratio": round(reused / requests_sent, 4) if requests_sent else 0.0,
+                "pool_size": self.pool_size,
+            }
+        return result
+
+    def close(self):
+        with self._lock:
+            for s in self._sessions.values():
+                s.close()
+            self._sessions.clear()
+            self._adapters.clear()
+
+
+# Process-wide client shared by all request handlers / worker threads.
+default_client = ProviderClient(health=ProviderHealth())
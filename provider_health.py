@@ -0,0 +1,153 @@
+# provider_health.py
+"""
+Per-provider (per api_url host) health tracking for provider calls.
+
+For every host we keep an EWMA of request latency and a window of recent
+latencies (successes, plus timeouts at the time waited, so a provider that
+slows down pushes its own timeout up). The request timeout is derived from
+the observed p99 instead of a fixed 30s, and a circuit breaker stops sending
+requests to a host after repeated failures: while it is open, calls fail
+immediately; after a cooldown a single half-open probe is let through with
+the maximum timeout, and its outcome closes or re-opens the breaker. Opening
+the breaker clears the latency window, which is then learned again.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+PROVIDER_TIMEOUT_MIN = float(os.environ.get("PROVIDER_TIMEOUT_MIN", "3"))
+PROVIDER_TIMEOUT_MAX = float(os.environ.get("PROVIDER_TIMEOUT_MAX", "30"))
+PROVIDER_TIMEOUT_MULTIPLIER = float(os.environ.get("PROVIDER_TIMEOUT_MULTIPLIER", "2.0"))
+PROVIDER_BREAKER_FAILURES = int(os.environ.get("PROVIDER_BREAKER_FAILURES", "5"))
+PROVIDER_BREAKER_COOLDOWN = float(os.environ.get("PROVIDER_BREAKER_COOLDOWN", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+EWMA_ALPHA = 0.2
+MIN_SAMPLES = 20      # below this the p99 is not trusted and the max timeout is used
+WINDOW = 200          # latencies kept per host
+
+
+class HostHealth:
+    def __init__(self):
+        self.state = CLOSED
+        self.ewma = None
+        self.samples = deque(maxlen=WINDOW)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def p99(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.99 * (len(ordered) - 1))]
+
+
+class ProviderHealth:
+    def __init__(self, failure_threshold=PROVIDER_BREAKER_FAILURES, cooldown=PROVIDER_BREAKER_COOLDOWN,
+                 timeout_min=PROVIDER_TIMEOUT_MIN, timeout_max=PROVIDER_TIMEOUT_MAX,
+                 timeout_multiplier=PROVIDER_TIMEOUT_MULTIPLIER):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.timeout_min = timeout_min
+        self.timeout_max = timeout_max
+        self.timeout_multiplier = timeout_multiplier
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _get(self, host):
+        h = self._hosts.get(host)
+        if h is None:
+            h = self._hosts[host] = HostHealth()
+        return h
+
+    def allow(self, host):
+        """
+        Return True if a request to `host` may be sent now. While the breaker is
+        open only one half-open probe is admitted once the cooldown has passed.
+        """
+        with self._lock:
+            h = self._get(host)
+            if h.state == CLOSED:
+                return True
+            if h.state == OPEN and time.monotonic() - h.opened_at >= self.cooldown:
+                h.state = HALF_OPEN
+            if h.state == HALF_OPEN and not h.probe_in_flight:
+                h.probe_in_flight = True
+                return True
+            h.rejected += 1
+            return False
+
+    def timeout_for(self, host):
+        with self._lock:
+            h = self._get(host)
+            if h.state != CLOSED or len(h.samples) < MIN_SAMPLES:
+                return self.timeout_max
+            timeout = h.p99() * self.timeout_multiplier
+        return min(max(timeout, self.timeout_min), self.timeout_max)
+
+    def record_success(self, host, latency):
+        with self._lock:
+            h = self._get(host)
+            self._observe(h, latency)
+            h.samples.append(latency)
+            h.successes += 1
+            h.consecutive_failures = 0
+            h.probe_in_flight = False
+            h.state = CLOSED
+            h.opened_at = None
+
+    def record_failure(self, host, latency, timed_out=False):
+        with self._lock:
+            h = self._get(host)
+            self._observe(h, latency)
+            if timed_out:
+                # the provider took at least this long; keep it in the p99
+                h.samples.append(latency)
+            h.failures += 1
+            h.consecutive_failures += 1
+            h.probe_in_flight = False
+            if h.state == HALF_OPEN or h.consecutive_failures >= self.failure_threshold:
+                h.state = OPEN
+                h.opened_at = time.monotonic()
+                h.samples.clear()
+
+    def reset(self, host=None):
+        with self._lock:
+            if host is None:
+                self._hosts.clear()
+            else:
+                self._hosts.pop(host, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            hosts = list(self._hosts.items())
+        result = {}
+        for host, h in hosts:
+            p99 = h.p99()
+            result[host] = {
+                "state": h.state,
+                "ewma_latency": round(h.ewma, 4) if h.ewma is not None else None,
+                "p99_latency": round(p99, 4) if p99 is not None else None,
+                "timeout": round(self.timeout_for(host), 3),
+                "samples": len(h.samples),
+                "successes": h.successes,
+                "failures": h.failures,
+                "consecutive_failures": h.consecutive_failures,
+                "rejected": h.rejected,
+                "retry_in": (round(max(self.cooldown - (now - h.opened_at), 0.0), 1)
+                             if h.state == OPEN and h.opened_at is not None else None),
+            }
+        return result
+
+    @staticmethod
+    def _observe(h, latency):
+        h.ewma = latency if h.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * h.ewma
@@ -0,0 +1,76 @@
+# quota.py
+"""
+Atomic quota reservation for lookups.
+
+Calls are reserved *before* the provider is contacted, with conditional
+UPDATEs that the database applies atomically, and handed back with
+refund_calls() if the lookup does not end up being charged. Free calls are
+consumed first, then paid calls. Each function commits its own short
+transaction, so no session has to stay open across the provider call.
+"""
+from sqlalchemy import func, select, update
+
+from models import User
+
+CAS_ATTEMPTS = 5
+
+
+def reserve_calls(db, user_id, n=1):
+    """
+    Take `n` calls from the user's quota.
+    Returns (free_taken, paid_taken), or None if the quota is insufficient.
+    """
+    if n <= 0:
+        return (0, 0)
+    if n == 1:
+        for column, taken in ((User.free_calls, (1, 0)), (User.paid_calls, (0, 1))):
+            res = db.execute(
+                update(User)
+                .where(User.id == user_id, column > 0)
+                .values({column: column - 1})
+            )
+            db.commit()
+            if res.rowcount == 1:
+                return taken
+        return None
+
+    # n > 1 has to be split between free and paid calls: read the balance and
+    # apply it with a compare-and-swap UPDATE, retrying if another request won.
+    free_col = func.coalesce(User.free_calls, 0)
+    paid_col = func.coalesce(User.paid_calls, 0)
+    for _ in range(CAS_ATTEMPTS):
+        row = db.execute(select(free_col, paid_col).where(User.id == user_id)).first()
+        if row is None or row[0] + row[1] < n:
+            db.rollback()
+            return None
+        free, paid = row
+        take_free = min(free, n)
+        take_paid = n - take_free
+        res = db.execute(
+            update(User)
+            .where(User.id == user_id, free_col == free, paid_col == paid)
+            .values(free_calls=free - take_free, paid_calls=paid - take_paid)
+        )
+        db.commit()
+        if res.rowcount == 1:
+            return (take_free, take_paid)
+    return None
+
+
+def refund_calls(db, user_id, reservation, used=0):
+    """
+    Give back the part of `reservation` that was not used. Paid calls are
+    returned first, so the calls that were used count against free calls.
+    """
+    free_taken, paid_taken = reservation
+    unused = free_taken + paid_taken - used
+    if unused <= 0:
+        return
+    paid_back = min(unused, paid_taken)
+    free_back = unused - paid_back
+    db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(free_calls=User.free_calls + free_back, paid_calls=User.paid_calls + paid_back)
+    )
+    db.commit()
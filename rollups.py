@@ -0,0 +1,148 @@
+# rollups.py
+"""
+Time-bucketed usage rollups.
+
+New APIUsage rows are folded incrementally into hourly and daily rollup
+tables keyed by (bucket, service_id, user_id, success), each holding a call
+count and a cost sum. Folded usages are flagged (`api_usages.rolled_up`) in
+the same transaction as the rollup updates, with a conditional UPDATE that
+only one concurrent folder can win, so each usage is folded exactly once.
+The flag does not depend on ids committing in order (a lower id that commits
+after a higher one on PostgreSQL is simply picked up by the next run).
+
+Analytics queries (/api/usages/stats) then read the small rollup tables
+instead of scanning api_usages.
+"""
+import threading
+from collections import defaultdict
+from datetime import timezone
+
+from sqlalchemy import case, false, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import APIUsage, UsageRollupDaily, UsageRollupHourly
+
+ROLLUPS = {"hour": UsageRollupHourly, "day": UsageRollupDaily}
+FOLD_BATCH = 5000
+
+_fold_lock = threading.Lock()
+
+
+def bucket_start(dt, granularity):
+    """Truncate a usage timestamp to its UTC hour / day bucket (naive datetime)."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    dt = dt.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        dt = dt.replace(hour=0)
+    return dt
+
+
+def _fold(db, rows):
+    for granularity, model in ROLLUPS.items():
+        agg = defaultdict(lambda: [0, 0.0])
+        for r in rows:
+            if r.created_at is None:
+                continue
+            key = (bucket_start(r.created_at, granularity), r.service_id or 0, r.user_id or 0, bool(r.success))
+            agg[key][0] += 1
+            agg[key][1] += r.cost or 0.0
+        for (bucket, service_id, user_id, success), (count, cost) in agg.items():
+            res = db.execute(
+                update(model)
+                .where(model.bucket_start == bucket, model.service_id == service_id,
+                       model.user_id == user_id, model.success == success)
+                .values(count=model.count + count, cost=model.cost + cost)
+            )
+            if res.rowcount == 0:
+                db.execute(insert(model).values(bucket_start=bucket, service_id=service_id, user_id=user_id,
+                                                success=success, count=count, cost=cost))
+
+
+def fold_new_usages(session_factory, batch_size=FOLD_BATCH, blocking=True):
+    """
+    Fold every APIUsage row not yet rolled up into the rollups.
+    Returns the number of rows folded (0 if another thread is already folding
+    and blocking is False).
+    """
+    if not _fold_lock.acquire(blocking=blocking):
+        return 0
+    folded = 0
+    try:
+        while True:
+            db = session_factory()
+            try:
+                rows = db.execute(
+                    select(APIUsage.id, APIUsage.created_at, APIUsage.service_id,
+                           APIUsage.user_id, APIUsage.success, APIUsage.cost)
+                    .where(APIUsage.rolled_up == false())
+                    .order_by(APIUsage.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    return folded
+                claimed = db.execute(
+                    update(APIUsage)
+                    .where(APIUsage.id.in_([r.id for r in rows]), APIUsage.rolled_up == false())
+                    .values(rolled_up=True)
+                    .execution_options(synchronize_session=False)
+                )
+                if claimed.rowcount != len(rows):
+                    db.rollback()   # another process folded some of these rows first
+                    continue
+                _fold(db, rows)
+                db.commit()
+            except IntegrityError:
+                db.rollback()       # concurrent insert of the same bucket; retry the batch
+                continue
+            finally:
+                db.close()
+            folded += len(rows)
+            if len(rows) < batch_size:
+                return folded
+    finally:
+        _fold_lock.release()
+
+
+def query_stats(db, granularity="hour", start=None, end=None, service_id=None, user_id=None, group_by=None):
+    """
+    Aggregate the rollups into a time series. `group_by` may be None,
+    "service" or "user"; every point carries totals, successes and cost.
+    """
+    model = ROLLUPS[granularity]
+    keys = [model.bucket_start]
+    if group_by == "service":
+        keys.append(model.service_id)
+    elif group_by == "user":
+        keys.append(model.user_id)
+
+    q = (select(*keys,
+                func.sum(model.count),
+                func.sum(case((model.success.is_(True), model.count), else_=0)),
+                func.sum(model.cost))
+         .group_by(*keys)
+         .order_by(model.bucket_start))
+    if start is not None:
+        q = q.where(model.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        q = q.where(model.bucket_start < end)
+    if service_id is not None:
+        q = q.where(model.service_id == service_id)
+    if user_id is not None:
+        q = q.where(model.user_id == user_id)
+
+    points = []
+    for row in db.execute(q):
+        total, succeeded, cost = int(row[-3] or 0), int(row[-2] or 0), float(row[-1] or 0.0)
+        point = {
+            "bucket": row[0].isoformat(),
+            "total": total,
+            "success": succeeded,
+            "failed": total - succeeded,
+            "success_rate": round(succeeded / total, 4) if total else None,
+            "cost": cost,
+        }
+        if group_by in ("service", "user"):
+            point[f"{group_by}_id"] = row[1]
+        points.append(point)
+    return points
@@ -0,0 +1,96 @@
+# serializers.py
+"""
+Column-projected serialization for the JSON API.
+
+List and detail endpoints select only the columns in FIELDS as plain row
+tuples (no ORM objects, no identity map) and turn them into dicts with one
+precompiled converter per model: datetimes become ISO strings and boolean
+flags become real booleans in a single pass. Responses are encoded with
+orjson when it is installed, falling back to the standard json module.
+
+Objects that are already loaded (e.g. right after a create/update) go
+through to_dict(), so every endpoint emits the same shape.
+"""
+import json
+from datetime import date, datetime
+
+from flask import Response
+
+from catalog import FIELDS as SERVICE_FIELDS
+from models import APIUsage, DeviceRecord, Payment, Service, User
+
+try:
+    import orjson
+except ImportError:     # optional speed-up
+    orjson = None
+
+FIELDS = {
+    User: ("id", "telegram_id", "username", "registered", "free_calls", "paid_calls", "created_at"),
+    Service: SERVICE_FIELDS,
+    DeviceRecord: ("id", "user_id", "imei", "serial", "note", "created_at"),
+    APIUsage: ("id", "user_id", "service_id", "imei", "success", "cost", "created_at"),
+    Payment: ("id", "user_id", "amount", "method", "note", "created_at"),
+}
+BOOLEAN_FIELDS = {"registered", "is_public", "success"}
+
+
+def _isoformat(v):
+    return v.isoformat() if v is not None else None
+
+
+def _compile(model):
+    names = FIELDS[model]
+    converters = []
+    for i, name in enumerate(names):
+        column_type = getattr(model, name).type.python_type
+        if name in BOOLEAN_FIELDS:
+            converters.append((i, bool))
+        elif column_type in (datetime, date):
+            converters.append((i, _isoformat))
+
+    def convert(row):
+        if converters:
+            row = list(row)
+            for i, fn in converters:
+                row[i] = fn(row[i])
+        return dict(zip(names, row))
+    return convert
+
+
+_CONVERTERS = {model: _compile(model) for model in FIELDS}
+
+
+def columns(model):
+    """The columns to select for `model`, e.g. db.query(*columns(User))."""
+    return [getattr(model, name) for name in FIELDS[model]]
+
+
+def row_to_dict(model, row):
+    return _CONVERTERS[model](row)
+
+
+def rows_to_dicts(model, rows):
+    convert = _CONVERTERS[model]
+    return [convert(row) for row in rows]
+
+
+def to_dict(model, obj):
+    """Serialize a loaded ORM object with the same fields/format as its rows."""
+    return _CONVERTERS[model](tuple(getattr(obj, name) for name in FIELDS[model]))
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """Encode `payload` as JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype="application/json")
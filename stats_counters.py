@@ -0,0 +1,96 @@
+# stats_counters.py
+"""
+Incrementally maintained dashboard counters (the `app_stats` table).
+
+/api/status used to run four COUNT(*) queries and a SUM over full tables on
+every dashboard poll. Instead, a Session `after_flush` hook adjusts the
+counters in the same transaction whenever users, services, devices, usages
+or payments are inserted or deleted through the ORM. Code that writes with
+Core bulk INSERTs must call bump() itself.
+
+reconcile() recomputes the true values and overwrites the counters; it runs
+at startup when counters are missing and then periodically to correct any
+drift (e.g. rows changed outside the application).
+"""
+from collections import defaultdict
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import APIUsage, AppStat, DeviceRecord, Payment, Service, User
+
+COUNTED = {
+    User: "users_count",
+    Service: "services_count",
+    DeviceRecord: "devices_count",
+    APIUsage: "usages_count",
+}
+NAMES = tuple(COUNTED.values()) + ("payments_total",)
+
+
+def bump(conn, **deltas):
+    """Add the given deltas to the counters, on `conn` (a Connection or Session)."""
+    for name, delta in deltas.items():
+        if delta:
+            conn.execute(update(AppStat).where(AppStat.name == name).values(value=AppStat.value + delta))
+
+
+def read(db):
+    """Current counter values as {name: value}; missing counters read as 0."""
+    values = dict(db.execute(select(AppStat.name, AppStat.value).where(AppStat.name.in_(NAMES))).all())
+    return {name: values.get(name, 0.0) for name in NAMES}
+
+
+def needs_reconcile(db):
+    return db.query(func.count(AppStat.name)).filter(AppStat.name.in_(NAMES)).scalar() < len(NAMES)
+
+
+def reconcile(session_factory):
+    """
+    Recompute every counter from the base tables. Returns the corrected values.
+    Each counter is set by a single UPDATE ... SET value = (SELECT ...), so a
+    bump() committed concurrently is never overwritten with a stale count.
+    """
+    truth = {name: select(func.count(model.id)).scalar_subquery() for model, name in COUNTED.items()}
+    truth["payments_total"] = select(func.coalesce(func.sum(Payment.amount), 0.0)).scalar_subquery()
+    db = session_factory()
+    try:
+        existing = set(db.execute(select(AppStat.name).where(AppStat.name.in_(NAMES))).scalars())
+        missing = [name for name in NAMES if name not in existing]
+        if missing:
+            db.add_all(AppStat(name=name, value=0.0) for name in missing)
+            try:
+                db.commit()
+            except IntegrityError:  # created by a concurrent reconcile
+                db.rollback()
+        for name, value in truth.items():
+            db.execute(update(AppStat).where(AppStat.name == name).values(value=value))
+        db.commit()
+        return read(db)
+    finally:
+        db.close()
+
+
+@event.listens_for(Session, "after_flush")
+def _count_flushed_rows(session, flush_context):
+    deltas = defaultdict(float)
+    for obj in session.new:
+        name = COUNTED.get(type(obj))
+        if name:
+            deltas[name] += 1
+        elif isinstance(obj, Payment):
+            deltas["payments_total"] += obj.amount or 0.0
+    for obj in session.deleted:
+        name = COUNTED.get(type(obj))
+        if name:
+            deltas[name] -= 1
+        elif isinstance(obj, Payment):
+            deltas["payments_total"] -= obj.amount or 0.0
+    for obj in session.dirty:
+        if isinstance(obj, Payment):
+            hist = inspect(obj).attrs.amount.history
+            if hist.has_changes():
+                deltas["payments_total"] += sum(v or 0.0 for v in hist.added) - sum(v or 0.0 for v in hist.deleted)
+    if deltas:
+        bump(session.connection(), **deltas)
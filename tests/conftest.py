@@ -0,0 +1,138 @@
+# conftest.py
+"""
+Shared fixtures.
+
+flask_app builds its engine and background jobs at import time, so the
+environment is pointed at a throwaway SQLite file (with the periodic jobs and
+the write-behind thread off) before anything imports it. Tests that only need
+a database use the `session_factory` fixture, a fresh file per test.
+"""
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_TMP = tempfile.mkdtemp(prefix="imei-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_TMP, 'app.db')}",
+    "ROLLUP_INTERVAL": "0",
+    "STATS_RECONCILE_INTERVAL": "0",
+    "WRITE_BEHIND_INTERVAL_MS": "0",
+    "WRITE_BEHIND_SPOOL": os.path.join(_TMP, "write_behind.spool.jsonl"),
+    "LOOKUP_CACHE_PERSIST": "0",
+})
+
+_ids = itertools.count(1000)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Session factory bound to a fresh, fully migrated SQLite file."""
+    from sqlalchemy.orm import sessionmaker
+    from models import init_db
+
+    engine = init_db(f"sqlite:///{tmp_path / 'test.db'}")
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import flask_app
+    return flask_app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def make_user(app_module):
+    """make_user(free, paid) -> (telegram_id, user_id) for a new user with that quota."""
+    from models import User
+
+    def make(free=10, paid=0):
+        telegram_id = next(_ids)
+        db = app_module.SessionLocal()
+        user = User(telegram_id=telegram_id, username=f"u{telegram_id}", free_calls=free, paid_calls=paid,
+                    registered=True)
+        db.add(user)
+        db.commit()
+        user_id = user.id
+        db.close()
+        return telegram_id, user_id
+    return make
+
+
+@pytest.fixture
+def quota_of(app_module):
+    """quota_of(user_id) -> (free_calls, paid_calls) as stored."""
+    from models import User
+
+    def read(user_id):
+        db = app_module.SessionLocal()
+        try:
+            user = db.get(User, user_id)
+            return user.free_calls, user.paid_calls
+        finally:
+            db.close()
+    return read
+
+
+class FakeProvider:
+    """Stands in for provider_client: IMEIs starting with "0" fail with a 500."""
+
+    def __init__(self):
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        imei = (kwargs.get("params") or {}).get("imei") or (kwargs.get("json") or {}).get("imei")
+        self.calls.append(imei)
+        response = requests.Response()
+        response.url = url
+        if str(imei).startswith("0"):
+            response.status_code = 500
+            response._content = b'{"error": "provider failed"}'
+        else:
+            response.status_code = 200
+            response._content = json.dumps({"imei": imei, "model": "Test Phone"}).encode()
+        return response
+
+
+@pytest.fixture
+def provider(app_module, monkeypatch):
+    fake = FakeProvider()
+    monkeypatch.setattr(app_module.lookups, "provider", fake)
+    return fake
+
+
+@pytest.fixture
+def service(app_module):
+    """Code of a new service (GET / query style, so no method probing)."""
+    from models import Service
+
+    code = f"svc{next(_ids)}"
+    db = app_module.SessionLocal()
+    db.add(Service(code=code, name=code, api_url=f"http://provider.test/{code}",
+                   http_method="GET", param_style="query"))
+    db.commit()
+    db.close()
+    app_module.catalog.invalidate()
+    return code
+
+
+@pytest.fixture
+def imeis():
+    """imeis(n, ok=True) -> n IMEIs never used before (failing ones start with "0")."""
+    def make(n, ok=True):
+        prefix = "35" if ok else "00"
+        return [f"{prefix}{next(_ids):013d}" for _ in range(n)]
+    return make
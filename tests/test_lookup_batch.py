@@ -0,0 +1,60 @@
+# test_lookup_batch.py
+"""/api/lookup/batch: one reservation for the whole batch, unused calls refunded."""
+import json
+
+
+def run_batch(client, **body):
+    response = client.post("/api/lookup/batch", json=body)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line.strip()]
+    return response, lines
+
+
+def test_failed_lookups_are_refunded(client, make_user, quota_of, provider, service, imeis):
+    telegram_id, user_id = make_user(free=2, paid=3)
+    good, bad = imeis(2), imeis(2, ok=False)
+
+    response, lines = run_batch(client, user_id=telegram_id, service=service, imeis=good + bad)
+
+    assert response.status_code == 200
+    results, summary = lines[:-1], lines[-1]["summary"]
+    assert {r["imei"]: r["success"] for r in results} == {**{i: True for i in good}, **{i: False for i in bad}}
+    assert summary == {"total": 4, "succeeded": 2, "failed": 2, "charged": 2}
+    # 2 free + 2 paid reserved, 2 used: the refund hands paid calls back first
+    assert quota_of(user_id) == (0, 3)
+
+
+def test_cached_results_are_not_charged(client, make_user, quota_of, provider, service, imeis):
+    telegram_id, user_id = make_user(free=10)
+    batch = imeis(3)
+    run_batch(client, user_id=telegram_id, service=service, imeis=batch)
+    assert quota_of(user_id) == (7, 0)
+
+    _, lines = run_batch(client, user_id=telegram_id, service=service, imeis=batch)
+
+    assert {r["cache"] for r in lines[:-1]} == {"HIT"}
+    assert lines[-1]["summary"]["charged"] == 0
+    assert quota_of(user_id) == (7, 0)
+    assert len(provider.calls) == 3
+
+
+def test_insufficient_quota_reserves_nothing(client, make_user, quota_of, provider, service, imeis):
+    telegram_id, user_id = make_user(free=1, paid=1)
+
+    response, _ = run_batch(client, user_id=telegram_id, service=service, imeis=imeis(3))
+
+    assert response.status_code == 403
+    assert quota_of(user_id) == (1, 1)
+    assert provider.calls == []
+
+
+def test_rejects_malformed_imeis_and_services(client, make_user, quota_of, provider, service):
+    telegram_id, user_id = make_user(free=10)
+    for body in ({"imeis": "35000000000001", "service": service},
+                 {"imeis": [True], "service": service},
+                 {"imeis": [{"imei": "1"}], "service": service},
+                 {"imeis": ["35000000000001"], "services": [{"code": service}]},
+                 {"imeis": ["35000000000001"], "service": [service]}):
+        response = client.post("/api/lookup/batch", json=dict(body, user_id=telegram_id))
+        assert response.status_code == 400, body
+    assert quota_of(user_id) == (10, 0)
+    assert provider.calls == []
@@ -0,0 +1,146 @@
+# test_migrations.py
+"""Migrations against a database created by the original (baseline) schema."""
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import inspect, text
+
+import migrations
+from models import Base, create_tuned_engine, init_db
+
+# the schema as the first release's create_all built it
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL, telegram_id INTEGER NOT NULL, username VARCHAR(128), registered BOOLEAN,
+    free_calls INTEGER, paid_calls INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id), UNIQUE (telegram_id)
+);
+CREATE INDEX ix_users_id ON users (id);
+CREATE TABLE services (
+    id INTEGER NOT NULL, code VARCHAR(64) NOT NULL, name VARCHAR(255), description TEXT,
+    api_url VARCHAR(1024), api_key VARCHAR(256), is_public BOOLEAN, "group" VARCHAR(128),
+    PRIMARY KEY (id), UNIQUE (code)
+);
+CREATE TABLE devices (
+    id INTEGER NOT NULL, user_id INTEGER, imei VARCHAR(128), serial VARCHAR(128), note TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE INDEX ix_devices_serial ON devices (serial);
+CREATE INDEX ix_devices_imei ON devices (imei);
+CREATE TABLE api_usages (
+    id INTEGER NOT NULL, user_id INTEGER, service_id INTEGER, imei VARCHAR(128), success BOOLEAN,
+    cost FLOAT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id), FOREIGN KEY(service_id) REFERENCES services (id)
+);
+CREATE TABLE payments (
+    id INTEGER NOT NULL, user_id INTEGER, amount FLOAT, method VARCHAR(128), note TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id)
+);
+"""
+
+MIGRATED_INDEXES = {
+    "api_usages": {"ix_api_usages_user_created", "ix_api_usages_created_at", "ix_api_usages_rolled_up"},
+    "payments": {"ix_payments_created_at", "ix_payments_user_created"},
+    "devices": {"ix_devices_user_imei"},
+    "users": {"ix_users_created_at"},
+}
+
+
+def baseline_db(tmp_path, *statements):
+    path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    for statement in statements:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{path}"
+
+
+def recorded(engine):
+    with engine.connect() as conn:
+        return sorted(row[0] for row in conn.execute(text("SELECT version FROM schema_migrations")))
+
+
+def test_baseline_database_is_brought_up_to_date(tmp_path):
+    engine = create_tuned_engine(baseline_db(tmp_path))
+    migrations.create_tables(engine, Base.metadata)
+
+    assert migrations.run_migrations(engine) == [1, 2, 3, 4]
+
+    schema = inspect(engine)
+    assert {"cache_ttl", "http_method", "param_style", "auth_style"} <= {c["name"] for c in schema.get_columns("services")}
+    assert "rolled_up" in {c["name"] for c in schema.get_columns("api_usages")}
+    for table, names in MIGRATED_INDEXES.items():
+        assert names <= {ix["name"] for ix in schema.get_indexes(table)}, table
+    assert recorded(engine) == [1, 2, 3, 4]
+    assert migrations.run_migrations(engine) == []
+
+
+def test_existing_rows_survive_and_get_defaults(tmp_path):
+    engine = init_db(baseline_db(
+        tmp_path,
+        "INSERT INTO services (id, code, name, api_url) VALUES (1, 'svc', 'Service', 'http://provider.test')",
+        "INSERT INTO api_usages (id, service_id, imei, success, cost) VALUES (1, 1, '350000000000001', 1, 0)",
+    ))
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT code, cache_ttl, http_method FROM services")).one() == ("svc", None, None)
+        assert conn.execute(text("SELECT rolled_up FROM api_usages")).scalar_one() == 0
+
+
+def test_fresh_database_records_every_version(tmp_path):
+    engine = init_db(f"sqlite:///{tmp_path / 'fresh.db'}")
+
+    assert recorded(engine) == [1, 2, 3, 4]
+    assert migrations.run_migrations(engine) == []
+
+
+def test_concurrent_workers_both_start(tmp_path, monkeypatch):
+    url = baseline_db(tmp_path)
+    real_inspect = migrations.inspect
+
+    class SlowInspector:
+        """Widens the gap between "does it exist?" and the DDL so the workers collide."""
+
+        def __init__(self, conn):
+            self._inspector = real_inspect(conn)
+
+        def get_columns(self, table):
+            columns = self._inspector.get_columns(table)
+            time.sleep(0.05)
+            return columns
+
+        def get_indexes(self, table):
+            indexes = self._inspector.get_indexes(table)
+            time.sleep(0.05)
+            return indexes
+
+    monkeypatch.setattr(migrations, "inspect", SlowInspector)
+    workers = 4
+    barrier = threading.Barrier(workers)
+    applied, errors = [], []
+
+    def start_worker():
+        engine = create_tuned_engine(url)
+        barrier.wait()
+        try:
+            migrations.create_tables(engine, Base.metadata)
+            applied.extend(migrations.run_migrations(engine))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            engine.dispose()
+
+    threads = [threading.Thread(target=start_worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert sorted(applied) == [1, 2, 3, 4]   # each version applied by exactly one worker
+    assert recorded(create_tuned_engine(url)) == [1, 2, 3, 4]
@@ -0,0 +1,68 @@
+# test_pagination.py
+"""Keyset cursors on the list endpoints."""
+import base64
+from datetime import datetime
+
+from models import Payment
+
+
+def add_payments(app_module, user_id):
+    """Seven payments: four with the database's default timestamp, three sharing one explicit timestamp."""
+    db = app_module.SessionLocal()
+    same_time = datetime(2024, 1, 1, 12, 0, 0)
+    payments = [Payment(user_id=user_id, amount=i, method="test") for i in range(4)]
+    payments += [Payment(user_id=user_id, amount=10 + i, method="test", created_at=same_time) for i in range(3)]
+    db.add_all(payments)
+    db.commit()
+    ids = [p.id for p in payments]
+    db.close()
+    return ids
+
+
+def walk(client, path, **params):
+    pages, cursor = [], None
+    while True:
+        query = dict(params, **({"cursor": cursor} if cursor else {}))
+        response = client.get(path, query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        pages.append([item["id"] for item in body["items"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip_returns_every_row_once(client, app_module, make_user):
+    _, user_id = make_user()
+    ids = add_payments(app_module, user_id)
+
+    pages = walk(client, "/api/payments", user_id=user_id, limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    seen = [i for page in pages for i in page]
+    assert sorted(seen) == sorted(ids)
+    # newest first; rows sharing a timestamp come in descending id order
+    assert seen[-3:] == sorted(ids[4:], reverse=True)
+
+
+def test_cursor_round_trip_matches_a_single_page(client, app_module, make_user):
+    _, user_id = make_user()
+    add_payments(app_module, user_id)
+
+    paged = [i for page in walk(client, "/api/payments", user_id=user_id, limit=2) for i in page]
+    whole = walk(client, "/api/payments", user_id=user_id, limit=100)
+
+    assert whole == [paged]
+
+
+def test_invalid_cursor_is_a_400(client):
+    bad_json = base64.urlsafe_b64encode(b"[1]").decode()
+    for cursor in ("not a cursor", "%%%", bad_json):
+        response = client.get("/api/payments", query_string={"cursor": cursor})
+        assert response.status_code == 400, cursor
+        assert response.get_json() == {"error": "Invalid cursor"}
+
+
+def test_invalid_limit_is_a_400(client):
+    for limit in ("abc", "0", "-5"):
+        assert client.get("/api/usages", query_string={"limit": limit}).status_code == 400
@@ -0,0 +1,102 @@
+# test_quota.py
+"""Atomic quota reservation under concurrency, and refunds."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import quota
+from models import User
+
+
+def add_user(session_factory, free, paid):
+    db = session_factory()
+    user = User(telegram_id=1, free_calls=free, paid_calls=paid)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+def balance(session_factory, user_id):
+    db = session_factory()
+    try:
+        user = db.get(User, user_id)
+        return user.free_calls, user.paid_calls
+    finally:
+        db.close()
+
+
+def reserve_concurrently(session_factory, user_id, n, workers):
+    barrier = threading.Barrier(workers)
+
+    def reserve(_):
+        db = session_factory()
+        try:
+            barrier.wait()
+            return quota.reserve_calls(db, user_id, n)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(reserve, range(workers)))
+
+
+def test_single_call_reservations_never_oversell(session_factory):
+    user_id = add_user(session_factory, free=3, paid=2)
+
+    results = reserve_concurrently(session_factory, user_id, 1, workers=20)
+
+    granted = [r for r in results if r is not None]
+    assert sorted(granted) == [(0, 1), (0, 1), (1, 0), (1, 0), (1, 0)]
+    assert balance(session_factory, user_id) == (0, 0)
+
+
+def test_multi_call_reservations_never_oversell(session_factory):
+    user_id = add_user(session_factory, free=5, paid=5)
+
+    results = reserve_concurrently(session_factory, user_id, 3, workers=10)
+
+    granted = [r for r in results if r is not None]
+    assert 1 <= len(granted) <= 3
+    assert all(sum(r) == 3 for r in granted)
+    free, paid = balance(session_factory, user_id)
+    assert (free, paid) == (5 - sum(r[0] for r in granted), 5 - sum(r[1] for r in granted))
+    assert free >= 0 and paid >= 0
+
+
+def test_refund_returns_paid_calls_first(session_factory):
+    user_id = add_user(session_factory, free=2, paid=2)
+    db = session_factory()
+    reservation = quota.reserve_calls(db, user_id, 3)
+    assert reservation == (2, 1)
+
+    quota.refund_calls(db, user_id, reservation, used=1)
+    db.close()
+
+    assert balance(session_factory, user_id) == (1, 2)
+
+
+def test_concurrent_lookups_charge_exactly_the_quota(client, make_user, quota_of, provider, service, imeis):
+    telegram_id, user_id = make_user(free=3)
+    batch = imeis(10)
+    barrier = threading.Barrier(len(batch))
+
+    def lookup(imei):
+        barrier.wait()
+        return client.post("/api/lookup", json={"user_id": telegram_id, "service": service, "imei": imei}).status_code
+
+    with ThreadPoolExecutor(len(batch)) as pool:
+        statuses = list(pool.map(lookup, batch))
+
+    assert sorted(statuses) == [200] * 3 + [403] * 7
+    assert quota_of(user_id) == (0, 0)
+    assert len(provider.calls) == 3
+
+
+def test_failed_lookup_is_refunded(client, make_user, quota_of, provider, service, imeis):
+    telegram_id, user_id = make_user(free=1)
+
+    response = client.post("/api/lookup", json={"user_id": telegram_id, "service": service, "imei": imeis(1, ok=False)[0]})
+
+    assert "error" in response.get_json()
+    assert quota_of(user_id) == (1, 0)
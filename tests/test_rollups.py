@@ -0,0 +1,103 @@
+# test_rollups.py
+"""Usages are folded into the hourly / daily rollups exactly once."""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+import rollups
+from models import APIUsage, UsageRollupDaily, UsageRollupHourly
+
+START = datetime(2024, 3, 1, 10, 15)
+
+
+class NoLock:
+    """Stands in for the in-process fold lock, as if every folder were a separate process."""
+
+    def acquire(self, blocking=True):
+        return True
+
+    def release(self):
+        pass
+
+
+def add_usages(session_factory, n, start_id=None):
+    db = session_factory()
+    db.add_all([
+        APIUsage(**({"id": start_id + i} if start_id is not None else {}),
+                 user_id=1 + i % 3, service_id=1 + i % 2, imei=f"35{i:013d}", success=i % 4 != 0, cost=0.5,
+                 created_at=START + timedelta(minutes=20 * i))
+        for i in range(n)
+    ])
+    db.commit()
+    db.close()
+
+
+def rollup_total(session_factory, model):
+    db = session_factory()
+    try:
+        return db.execute(select(func.coalesce(func.sum(model.count), 0))).scalar_one()
+    finally:
+        db.close()
+
+
+def unfolded(session_factory):
+    db = session_factory()
+    try:
+        return db.execute(select(func.count()).where(APIUsage.rolled_up.is_(False))).scalar_one()
+    finally:
+        db.close()
+
+
+def test_fold_counts_each_usage_once(session_factory):
+    add_usages(session_factory, 20)
+
+    assert rollups.fold_new_usages(session_factory, batch_size=6) == 20
+    assert rollups.fold_new_usages(session_factory) == 0
+
+    assert rollup_total(session_factory, UsageRollupHourly) == 20
+    assert rollup_total(session_factory, UsageRollupDaily) == 20
+    db = session_factory()
+    points = rollups.query_stats(db, "day", start=START - timedelta(days=1))
+    db.close()
+    assert sum(p["total"] for p in points) == 20
+    assert sum(p["success"] for p in points) == 15
+    assert round(sum(p["cost"] for p in points), 2) == 10.0
+
+
+def test_concurrent_folders_never_double_count(session_factory, monkeypatch):
+    monkeypatch.setattr(rollups, "_fold_lock", NoLock())
+    add_usages(session_factory, 60)
+    workers = 4
+    barrier = threading.Barrier(workers)
+    folded, errors = [], []
+
+    def fold():
+        barrier.wait()
+        try:
+            folded.append(rollups.fold_new_usages(session_factory, batch_size=7))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fold) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert sum(folded) == 60
+    assert unfolded(session_factory) == 0
+    assert rollup_total(session_factory, UsageRollupHourly) == 60
+    assert rollup_total(session_factory, UsageRollupDaily) == 60
+
+
+def test_usage_committed_late_with_a_lower_id_is_folded(session_factory):
+    add_usages(session_factory, 5, start_id=100)
+    assert rollups.fold_new_usages(session_factory) == 5
+
+    add_usages(session_factory, 1, start_id=50)
+
+    assert rollups.fold_new_usages(session_factory) == 1
+    assert rollup_total(session_factory, UsageRollupHourly) == 6
+    assert unfolded(session_factory) == 0
@@ -0,0 +1,106 @@
+# test_write_behind.py
+"""Write-behind spooling, spool replay and failed-batch isolation."""
+import json
+import logging
+import threading
+
+from sqlalchemy import func, select
+
+import stats_counters
+from models import APIUsage, DeviceRecord
+from write_behind import WriteBehindQueue
+
+
+def broken_session():
+    raise RuntimeError("database unavailable")
+
+
+def usage_count(session_factory):
+    db = session_factory()
+    try:
+        return db.execute(select(func.count()).select_from(APIUsage)).scalar_one()
+    finally:
+        db.close()
+
+
+def spool_records(session_factory, spool, n):
+    """Queue n records while the database is down and shut down, leaving them in `spool`."""
+    queue = WriteBehindQueue(broken_session, interval_ms=60000, spool_path=str(spool))
+    queue.start()
+    for i in range(n):
+        queue.submit(1, 1, f"35{i:013d}", True)
+    queue.stop()
+    return queue
+
+
+def test_records_left_at_shutdown_are_spooled_and_replayed_once(session_factory, tmp_path, caplog):
+    caplog.set_level(logging.CRITICAL)
+    spool = tmp_path / "spool.jsonl"
+    stats_counters.reconcile(session_factory)
+
+    stopped = spool_records(session_factory, spool, 5)
+    assert stopped.stats()["spooled"] == 5
+    assert len(spool.read_text().splitlines()) == 5
+
+    queue = WriteBehindQueue(session_factory, interval_ms=0, spool_path=str(spool))
+    assert queue.replay_spool() == 5
+    assert queue.replay_spool() == 0
+
+    assert not spool.exists()
+    assert usage_count(session_factory) == 5
+    db = session_factory()
+    assert db.execute(select(func.count()).select_from(DeviceRecord)).scalar_one() == 5
+    assert stats_counters.read(db)["usages_count"] == 5
+    db.close()
+
+
+def test_concurrent_replays_write_the_spool_once(session_factory, tmp_path, caplog):
+    caplog.set_level(logging.CRITICAL)
+    spool = tmp_path / "spool.jsonl"
+    spool_records(session_factory, spool, 20)
+    workers = 4
+    barrier = threading.Barrier(workers)
+    replayed = []
+
+    def replay():
+        queue = WriteBehindQueue(session_factory, interval_ms=0, spool_path=str(spool))
+        barrier.wait()
+        replayed.append(queue.replay_spool())
+
+    threads = [threading.Thread(target=replay) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(replayed) == 20
+    assert usage_count(session_factory) == 20
+
+
+def test_bad_record_is_isolated_and_the_rest_written(session_factory, tmp_path, caplog):
+    caplog.set_level(logging.CRITICAL)
+    spool = tmp_path / "spool.jsonl"
+    queue = WriteBehindQueue(session_factory, interval_ms=60000, spool_path=str(spool), max_attempts=2)
+    queue.start()
+    queue.submit(1, 1, ["not", "an", "imei"], True)
+    for i in range(9):
+        queue.submit(1, 1, f"35{i:013d}", True)
+
+    assert queue.flush() == 0            # first failure: kept at the head for a retry
+    assert queue.flush() == 9            # second failure: bisected, the bad record spooled
+    queue.stop()
+
+    assert usage_count(session_factory) == 9
+    stats = queue.stats()
+    assert (stats["rejected"], stats["depth"]) == (1, 0)
+    assert [json.loads(line)["imei"] for line in spool.read_text().splitlines()] == [["not", "an", "imei"]]
+
+
+def test_overflow_write_failure_does_not_raise(tmp_path, caplog):
+    caplog.set_level(logging.CRITICAL)
+    spool = tmp_path / "spool.jsonl"
+    queue = WriteBehindQueue(broken_session, interval_ms=0, spool_path=str(spool))
+
+    queue.submit(1, 1, "350000000000001", True)
+
+    assert len(spool.read_text().splitlines()) == 1
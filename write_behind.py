@@ -0,0 +1,273 @@
+# write_behind.py
+"""
+Write-behind queue for the APIUsage / DeviceRecord rows produced by lookups.
+
+Committing one usage (and maybe one device) per /api/lookup request takes the
+SQLite write lock once per request. Instead, lookups submit() their records
+to an in-memory queue and a background thread writes them in bulk: every
+`interval_ms` milliseconds, or as soon as `max_batch` records are waiting.
+Each flush is one transaction of Core bulk INSERTs (usages, then the
+devices not yet known for those (user, imei) pairs), with the dashboard
+counters bumped in the same transaction.
+
+Durability: stop() (registered with atexit) drains the queue; whatever cannot
+be written is appended to a JSONL spool file, which replay_spool() loads
+back into the database at the next startup. A failed flush keeps its records
+at the head of the queue and is retried on the next tick. After
+`max_attempts` failures of the same head batch (not counting lock / connection
+errors, which say nothing about the records), the batch is bisected: the
+records that can be written are, and any record that fails on its own is
+spooled, so one bad record cannot block everything queued behind it. A
+record that cannot be written on the overflow path is spooled as well; a
+lookup never fails because its usage could not be recorded.
+
+With interval_ms <= 0 (or before start()), submit() writes synchronously.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+import stats_counters
+from models import APIUsage, DeviceRecord
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, session_factory, interval_ms=200, max_batch=500, max_queue=50000, spool_path=None,
+                 max_attempts=3):
+        self.session_factory = session_factory
+        self.interval = interval_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.spool_path = spool_path
+        self.max_attempts = max_attempts
+        self._head_failures = 0                 # consecutive failed flushes of the head batch
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()     # one bulk writer at a time
+        self._thread = None
+        self._stopping = False
+        self._metrics = {
+            "enqueued": 0,
+            "written": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "rejected": 0,
+            "overflow_writes": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "max_depth": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, user_id, service_id, imei, success, cost=0.0):
+        record = {
+            "user_id": user_id,
+            "service_id": service_id,
+            "imei": imei,
+            "success": bool(success),
+            "cost": cost,
+            "created_at": datetime.now(timezone.utc),
+        }
+        queued = False
+        with self._cond:
+            if self._thread is not None and not self._stopping and len(self._pending) < self.max_queue:
+                self._pending.append(record)
+                self._metrics["enqueued"] += 1
+                depth = len(self._pending)
+                self._metrics["max_depth"] = max(self._metrics["max_depth"], depth)
+                if depth >= self.max_batch:
+                    self._cond.notify()
+                queued = True
+        if not queued:
+            # not running, shutting down, or full: write on the caller's thread (backpressure)
+            if self._thread is not None:
+                with self._cond:
+                    self._metrics["overflow_writes"] += 1
+            with self._flush_lock:
+                try:
+                    self._write([record])
+                except Exception:
+                    logger.exception("Write-behind overflow write failed; spooling the record")
+                    self._spool([record])
+
+    def flush(self):
+        """Write everything queued now. Returns the number of records written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch))]
+                if not batch:
+                    break
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.exception("Write-behind flush of %d records failed", len(batch))
+                    with self._cond:
+                        self._metrics["failed_flushes"] += 1
+                    if not isinstance(e, OperationalError):
+                        self._head_failures += 1
+                    if self._head_failures < self.max_attempts:
+                        with self._cond:
+                            self._pending.extendleft(reversed(batch))
+                        break
+                    # the same records keep failing: write what can be written, spool the rest
+                    self._head_failures = 0
+                    written += self._write_isolating(batch)
+                    continue
+                self._head_failures = 0
+                written += len(batch)
+        return written
+
+    def stop(self, timeout=10.0):
+        """Stop the writer, flush what is queued and spool anything left over."""
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        with self._cond:
+            leftovers = list(self._pending)
+            self._pending.clear()
+        if leftovers:
+            self._spool(leftovers)
+
+    def replay_spool(self):
+        """Write records spooled by a previous shutdown. Returns how many were replayed."""
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return 0
+        claimed = f"{self.spool_path}.{os.getpid()}.replay"
+        try:
+            os.replace(self.spool_path, claimed)   # only one worker gets the file
+        except FileNotFoundError:
+            return 0
+        with open(claimed, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        for r in records:
+            r["created_at"] = datetime.fromisoformat(r["created_at"])
+        done = 0
+        try:
+            with self._flush_lock:
+                for i in range(0, len(records), self.max_batch):
+                    self._write(records[i:i + self.max_batch])
+                    done = i + self.max_batch
+        except Exception:
+            logger.exception("Replaying the write-behind spool failed")
+            self._spool(records[done:])
+        os.remove(claimed)
+        replayed = min(done, len(records))
+        with self._cond:
+            self._metrics["replayed"] += replayed
+        return replayed
+
+    def stats(self):
+        with self._cond:
+            m = dict(self._metrics)
+            m["depth"] = len(self._pending)
+            m["running"] = self._thread is not None and self._thread.is_alive()
+        total = m.pop("total_flush_ms")
+        m["avg_flush_ms"] = round(total / m["flushes"], 3) if m["flushes"] else None
+        m["interval_ms"] = self.interval * 1000
+        m["max_batch"] = self.max_batch
+        return m
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.max_batch:
+                    self._cond.wait(self.interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _write(self, records):
+        start = time.perf_counter()
+        db = self.session_factory()
+        try:
+            db.execute(insert(APIUsage), records)
+            pairs = {(r["user_id"], r["imei"]) for r in records}
+            known = set(
+                db.query(DeviceRecord.user_id, DeviceRecord.imei)
+                .filter(DeviceRecord.user_id.in_({u for u, _ in pairs}),
+                        DeviceRecord.imei.in_({i for _, i in pairs}))
+                .all()
+            )
+            new_devices = sorted(pairs - known)
+            if new_devices:
+                db.execute(insert(DeviceRecord), [{"user_id": u, "imei": i} for u, i in new_devices])
+            # bulk Core inserts bypass the ORM flush hook that maintains the counters
+            stats_counters.bump(db, usages_count=len(records), devices_count=len(new_devices))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._cond:
+            self._metrics["written"] += len(records)
+            self._metrics["flushes"] += 1
+            self._metrics["last_flush_ms"] = round(elapsed, 3)
+            self._metrics["max_flush_ms"] = max(self._metrics["max_flush_ms"], round(elapsed, 3))
+            self._metrics["total_flush_ms"] += elapsed
+
+    def _write_isolating(self, records):
+        """
+        Write `records`, bisecting on failure; records that fail on their own
+        are spooled (so are the rest if the database itself becomes
+        unavailable meanwhile). Returns the number written.
+        """
+        try:
+            self._write(records)
+            return len(records)
+        except OperationalError:
+            logger.exception("Write-behind database unavailable while isolating a failed batch")
+            self._spool(records)
+            return 0
+        except Exception:
+            if len(records) > 1:
+                mid = len(records) // 2
+                return self._write_isolating(records[:mid]) + self._write_isolating(records[mid:])
+            logger.exception("Write-behind record rejected, spooling it: %r", records[0])
+            with self._cond:
+                self._metrics["rejected"] += 1
+            self._spool(records)
+            return 0
+
+    def _spool(self, records):
+        if not self.spool_path:
+            logger.error("Write-behind queue lost %d records (no spool file configured)", len(records))
+            return
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for r in records:
+                    f.write(json.dumps(dict(r, created_at=r["created_at"].isoformat())) + "\n")
+        except Exception:
+            logger.exception("Write-behind queue lost %d records (spool file not writable)", len(records))
+            return
+        with self._cond:
+            self._metrics["spooled"] += len(records)
+        logger.warning("Write-behind queue spooled %d records to %s", len(records), self.spool_path)